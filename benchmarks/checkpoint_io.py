@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# TAMkin is a post-processing toolkit for normal mode analysis, thermochemistry
+# and reaction kinetics.
+# Copyright (C) 2008-2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, An Ghysels
+# <An.Ghysels@UGent.be> and Matthias Vandichel <Matthias.Vandichel@UGent.be>
+# Center for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all
+# rights reserved unless otherwise stated.
+#
+# This file is part of TAMkin.
+#
+# TAMkin is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# In addition to the regulations of the GNU General Public License,
+# publications and communications based in parts on this program or on
+# parts of this program are required to cite the following article:
+#
+# "TAMkin: A Versatile Package for Vibrational Analysis and Chemical Kinetics",
+# An Ghysels, Toon Verstraelen, Karen Hemelsoet, Michel Waroquier and Veronique
+# Van Speybroeck, Journal of Chemical Information and Modeling, 2010, 50,
+# 1736-1750W
+# http://dx.doi.org/10.1021/ci100099g
+#
+# TAMkin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+"""Benchmark of the text and binary checkpoint files of an NMA object.
+
+   Synthetic NMA objects with random frequencies and modes are written to
+   checkpoint files in the text and the binary format and read again. All
+   arrays have the sizes of a real normal mode analysis with the given number
+   of atoms, e.g. 3000 atoms give modes of 9000x9000 (a text file of about
+   1.9 GB). The timings include reading only the fields needed for a
+   partition function. Run this script from the root of the source tree.
+"""
+
+
+from tamkin import *
+
+import numpy, os, sys, tempfile, time
+
+
+def bench(fn, repeat=1):
+    timings = []
+    for i in xrange(repeat):
+        start = time.time()
+        fn()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def make_nma(size):
+    nma = NMA.__new__(NMA)
+    nma.freqs = numpy.random.uniform(0, 1e-2, 3*size)
+    nma.modes = numpy.random.normal(0, 1, (3*size, 3*size))
+    nma.masses = numpy.random.uniform(1, 100, size)
+    nma.masses3 = nma.masses.repeat(3)
+    nma.mass = nma.masses.sum()
+    nma.numbers = numpy.random.randint(1, 10, size)
+    nma.coordinates = numpy.random.normal(0, 10, (size, 3))
+    nma.inertia_tensor = numpy.identity(3)
+    nma.multiplicity = 1
+    nma.symmetry_number = 1
+    nma.periodic = False
+    nma.energy = -1.0
+    nma.zeros = numpy.arange(6)
+    nma.title = "benchmark"
+    nma.chemical_formula = "X%i" % size
+    return nma
+
+
+def main(sizes=(100, 300, 1000, 3000)):
+    numpy.random.seed(1)
+    dirname = tempfile.mkdtemp("tamkin-bench-chk")
+    filename = os.path.join(dirname, "nma.chk")
+    print "   atoms  format  size [MB]  write [s]  read [s]  read partf [s]"
+    try:
+        for size in sizes:
+            nma = make_nma(size)
+            for binary in False, True:
+                time_write = bench(lambda: nma.write_to_file(filename, binary=binary))
+                file_size = os.path.getsize(filename)/1e6
+                time_read = bench(lambda: NMA.read_from_file(filename))
+                time_partf = bench(lambda: NMA.read_from_file(filename, fields='partf'))
+                print "%8i  %6s %10.1f %10.3f %9.3f %15.3f" % (
+                    size, {False: "text", True: "binary"}[binary], file_size,
+                    time_write, time_read, time_partf
+                )
+            del nma
+    finally:
+        os.remove(filename)
+        os.rmdir(dirname)
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or (100, 300, 1000, 3000))
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# TAMkin is a post-processing toolkit for normal mode analysis, thermochemistry
+# and reaction kinetics.
+# Copyright (C) 2008-2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, An Ghysels
+# <An.Ghysels@UGent.be> and Matthias Vandichel <Matthias.Vandichel@UGent.be>
+# Center for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all
+# rights reserved unless otherwise stated.
+#
+# This file is part of TAMkin.
+#
+# TAMkin is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# In addition to the regulations of the GNU General Public License,
+# publications and communications based in parts on this program or on
+# parts of this program are required to cite the following article:
+#
+# "TAMkin: A Versatile Package for Vibrational Analysis and Chemical Kinetics",
+# An Ghysels, Toon Verstraelen, Karen Hemelsoet, Michel Waroquier and Veronique
+# Van Speybroeck, Journal of Chemical Information and Modeling, 2010, 50,
+# 1736-1750W
+# http://dx.doi.org/10.1021/ci100099g
+#
+# TAMkin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+"""Benchmark of the gradient correction in the Constrain treatment.
+
+   Elastic network models of the first atoms of crambin are given a random
+   gradient. Chains of distance, bending angle and dihedral angle constraints
+   are imposed on consecutive atoms. The time spent in the gradient correction
+   is the difference between the treatment with and without the correction.
+   Run this script from the root of the source tree.
+"""
+
+
+from tamkin import *
+
+from molmod.units import angstrom
+
+import numpy, time
+
+
+def bench(fn, repeat=3):
+    timings = []
+    for i in xrange(repeat):
+        start = time.time()
+        fn()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def make_constraints(size, num):
+    constraints = []
+    i = 0
+    while len(constraints) < num:
+        for length in 2, 3, 4:
+            start = (i*3) % (size - length)
+            constraints.append(range(start, start+length))
+        i += 1
+    return constraints[:num]
+
+
+def main():
+    coordinates = numpy.loadtxt("test/input/charmm/crambin.crd", skiprows=6, usecols=(4,5,6))*angstrom
+    numpy.random.seed(1)
+    print "   atoms  constraints  without [s]  with [s]  correction [s]"
+    for size, num in (50, 30), (100, 30), (200, 30), (400, 30), (200, 10), (200, 100), (200, 300):
+        molecule = create_enm_molecule(coordinates[:size], rcut=6*angstrom)
+        molecule = Molecule(
+            molecule.numbers, molecule.coordinates, molecule.masses, molecule.energy,
+            numpy.random.normal(0, 1e-3, molecule.coordinates.shape), molecule.hessian,
+        )
+        constraints = make_constraints(size, num)
+        time_without = bench(lambda: Constrain(constraints, do_gradient_correction=False)(molecule, False))
+        time_with = bench(lambda: Constrain(constraints)(molecule, False))
+        print "%8i %12i %12.3f %9.3f %15.3f" % (size, num, time_without, time_with, time_with - time_without)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# TAMkin is a post-processing toolkit for normal mode analysis, thermochemistry
+# and reaction kinetics.
+# Copyright (C) 2008-2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, An Ghysels
+# <An.Ghysels@UGent.be> and Matthias Vandichel <Matthias.Vandichel@UGent.be>
+# Center for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all
+# rights reserved unless otherwise stated.
+#
+# This file is part of TAMkin.
+#
+# TAMkin is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# In addition to the regulations of the GNU General Public License,
+# publications and communications based in parts on this program or on
+# parts of this program are required to cite the following article:
+#
+# "TAMkin: A Versatile Package for Vibrational Analysis and Chemical Kinetics",
+# An Ghysels, Toon Verstraelen, Karen Hemelsoet, Michel Waroquier and Veronique
+# Van Speybroeck, Journal of Chemical Information and Modeling, 2010, 50,
+# 1736-1750W
+# http://dx.doi.org/10.1021/ci100099g
+#
+# TAMkin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+"""Benchmark of the reaction analysis on a fine temperature grid.
+
+   The rate constants of the reaction in test/input/sterck with a Wigner
+   tunneling correction are computed on a 1K temperature grid, once with one
+   call to the kinetic model per temperature and once with the array of all
+   temperatures. Run this script from the root of the source tree.
+"""
+
+
+from tamkin import *
+
+import numpy, time
+
+
+def load_model():
+    pf_react1 = PartFun(NMA(load_molecule_g03fchk("test/input/sterck/aa.fchk")), [ExtTrans(cp=False), ExtRot(1)])
+    pf_react2 = PartFun(NMA(load_molecule_g03fchk("test/input/sterck/aarad.fchk")), [ExtTrans(cp=False), ExtRot(1)])
+    pf_ts = PartFun(NMA(load_molecule_g03fchk("test/input/sterck/paats.fchk")), [ExtTrans(cp=False), ExtRot(1)])
+    return KineticModel([pf_react1, pf_react2], pf_ts, tunneling=Wigner(pf_ts))
+
+
+def bench(fn, repeat=5):
+    timings = []
+    for i in xrange(repeat):
+        start = time.time()
+        fn()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def main():
+    km = load_model()
+    temps = numpy.arange(100.0, 1200.5, 1.0)
+
+    def per_temp():
+        return numpy.array([km.rate_constant(temp, do_log=True) for temp in temps])
+
+    def vectorized():
+        return km.rate_constant(temps, do_log=True)
+
+    error = abs(per_temp() - vectorized()).max()
+    time_per_temp = bench(per_temp)
+    time_vectorized = bench(vectorized)
+    time_analysis = bench(lambda: ReactionAnalysis(km, 100, 1200, temp_step=1))
+
+    print "Number of temperatures:            %10i" % len(temps)
+    print "Maximum deviation of ln(k):        %10.1e" % error
+    print "One call per temperature [ms]:     %10.2f" % (time_per_temp*1e3)
+    print "One call for all temperatures [ms]:%10.2f" % (time_vectorized*1e3)
+    print "Speedup:                           %10.1f" % (time_per_temp/time_vectorized)
+    print "ReactionAnalysis with 1K steps [ms]:%9.2f" % (time_analysis*1e3)
+
+
+if __name__ == "__main__":
+    main()
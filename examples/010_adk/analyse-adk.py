@@ -111,7 +111,8 @@ def take_cut(filechk,jobtimer):
 def do_gibbs(filechk, filethermo, jobtimer):
     jobtimer.sample("start reading")
     jobtimer.dump()
-    nma = NMA.read_from_file(filechk)
+    # the modes are not needed for the partition function
+    nma = NMA.read_from_file(filechk, fields='partf')
 
     jobtimer.sample("gibbs")
     jobtimer.dump()
@@ -37,11 +37,16 @@
 from tamkin.chemmod import *
 from tamkin.data import *
 from tamkin.io import *
+from tamkin.microcanonical import *
 from tamkin.geom import *
 from tamkin.nma import *
 from tamkin.nmatools import *
 from tamkin.partf import *
+from tamkin.partfbank import *
 from tamkin.rotor import *
+from tamkin.rrkm import *
+from tamkin.surrogate import *
 from tamkin.timer import *
+from tamkin.batch import *
 from tamkin.pftools import *
 from tamkin.tunneling import *
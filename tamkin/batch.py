@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+# TAMkin is a post-processing toolkit for normal mode analysis, thermochemistry
+# and reaction kinetics.
+# Copyright (C) 2008-2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, An Ghysels
+# <An.Ghysels@UGent.be> and Matthias Vandichel <Matthias.Vandichel@UGent.be>
+# Center for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all
+# rights reserved unless otherwise stated.
+#
+# This file is part of TAMkin.
+#
+# TAMkin is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# In addition to the regulations of the GNU General Public License,
+# publications and communications based in parts on this program or on
+# parts of this program are required to cite the following article:
+#
+# "TAMkin: A Versatile Package for Vibrational Analysis and Chemical Kinetics",
+# An Ghysels, Toon Verstraelen, Karen Hemelsoet, Michel Waroquier and Veronique
+# Van Speybroeck, Journal of Chemical Information and Modeling, 2010, 50,
+# 1736-1750W
+# http://dx.doi.org/10.1021/ci100099g
+#
+# TAMkin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+"""Normal mode analysis of many structures in a pool of processes
+
+   Production runs often involve hundreds of conformers and transition states
+   that are processed independently: load the molecule, compute the normal
+   modes and build a partition function. A :class:`BatchJob` describes these
+   steps for one structure and :func:`run_batch` carries them out for a list of
+   jobs in a pool of worker processes. The results are yielded as soon as they
+   are available. For example::
+
+     >>> jobs = [BatchJob(fn, treatment=ConstrainExt(), terms=[ExtTrans(), ExtRot(1)])
+     ...         for fn in glob.glob("conformers/*.fchk")]
+     >>> for result in run_batch(jobs, num_workers=8):
+     ...     if result.error is None:
+     ...         print result.job.args, result.value.free_energy(300)
+     ...     else:
+     ...         print result.job.args, "failed"
+
+   Each worker limits the number of threads of the BLAS library (one by
+   default) to avoid oversubscription of the cores. The number of jobs that
+   are submitted but whose results are not consumed yet is bounded, such that
+   only a limited number of results is kept in memory. An exception raised by a
+   job does not interrupt the batch: it is reported in the corresponding
+   :class:`BatchResult`.
+"""
+
+
+import copy, os, time, traceback
+
+from tamkin.data import Molecule
+from tamkin.io.gaussian import load_molecule_g03fchk
+from tamkin.nma import NMA
+from tamkin.partf import PartFun
+
+
+__all__ = ["BatchJob", "BatchResult", "run_batch"]
+
+
+# environment variables that control the number of threads of the common BLAS
+# and OpenMP libraries
+_blas_variables = [
+    "OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS",
+]
+
+
+class BatchJob(object):
+    """The specification of the computations for one structure."""
+
+    def __init__(self, args, loader=load_molecule_g03fchk, treatment=None, do_modes=True, terms=None, checkpoint=None, checkpoint_fields='all'):
+        """
+           Argument:
+            | ``args`` -- the argument(s) of the loader, e.g. a filename, or a
+                          tuple with filenames. When a Molecule object is
+                          given, it is used as such and the loader is not
+                          called.
+
+           Optional arguments:
+            | ``loader`` -- the function that loads the molecule
+                            [default=load_molecule_g03fchk]
+            | ``treatment`` -- the treatment of the normal mode analysis
+                               [default=Full()]
+            | ``do_modes`` -- when False, only the frequencies are computed
+                              [default=True]
+            | ``terms`` -- when given, the result is a PartFun object with
+                           these contributions. Otherwise the result is the
+                           NMA object.
+            | ``checkpoint`` -- when given, the NMA object is written to this
+                                checkpoint file and the result is the filename.
+                                This avoids the transfer of large arrays from
+                                the worker processes. The argument ``terms`` is
+                                ignored in this case.
+            | ``checkpoint_fields`` -- the fields argument of
+                                       NMA.write_to_file [default='all']
+
+           In a pool of processes, the job is pickled. The loader must then be
+           a function defined at the module level and the treatment and the
+           terms must be picklable.
+        """
+        self.args = args
+        self.loader = loader
+        self.treatment = treatment
+        self.do_modes = do_modes
+        self.terms = terms
+        self.checkpoint = checkpoint
+        self.checkpoint_fields = checkpoint_fields
+
+    def run(self):
+        """Carry out the computations and return the result."""
+        if isinstance(self.args, Molecule):
+            molecule = self.args
+        elif isinstance(self.args, tuple):
+            molecule = self.loader(*self.args)
+        else:
+            molecule = self.loader(self.args)
+        nma = NMA(molecule, self.treatment, self.do_modes)
+        if self.checkpoint is not None:
+            nma.write_to_file(self.checkpoint, self.checkpoint_fields)
+            return self.checkpoint
+        if self.terms is not None:
+            return PartFun(nma, self.terms)
+        return nma
+
+
+class BatchResult(object):
+    """The outcome of one job in a batch."""
+
+    def __init__(self, index, job, value, error, elapsed):
+        """
+           Arguments:
+            | ``index`` -- the position of the job in the list given to
+                           run_batch
+            | ``job`` -- the BatchJob object
+            | ``value`` -- the result of the job (None in case of an error)
+            | ``error`` -- None, or a string with the traceback of the
+                           exception raised by the job
+            | ``elapsed`` -- the wall time spent on the job in seconds
+        """
+        self.index = index
+        self.job = job
+        self.value = value
+        self.error = error
+        self.elapsed = elapsed
+
+
+def _limit_blas_threads(num_threads):
+    """Limit the number of BLAS threads in the current process."""
+    for name in _blas_variables:
+        os.environ[name] = str(num_threads)
+    # The environment variables are only effective when the BLAS library is
+    # not loaded yet. In forked processes, threadpoolctl (when available)
+    # also changes the limit of the libraries that are already loaded.
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(num_threads)
+
+
+def _run_task(task):
+    """Run one job and catch all exceptions (worker side)."""
+    index, job = task
+    begin = time.time()
+    try:
+        value = job.run()
+        error = None
+    except Exception:
+        value = None
+        error = traceback.format_exc()
+    return value, error, time.time() - begin
+
+
+def run_batch(jobs, num_workers=None, max_in_flight=None, ordered=True, key=None, blas_threads=1, tasks_per_worker=None, timeout=None):
+    """Run a list of jobs in a pool of processes
+
+       Argument:
+        | ``jobs`` -- a list of BatchJob objects
+
+       Optional arguments:
+        | ``num_workers`` -- the number of worker processes. When zero, the
+                             jobs are carried out one by one in the current
+                             process. [default=the number of cores]
+        | ``max_in_flight`` -- the maximum number of jobs that are submitted
+                               and whose results are not yielded yet. This
+                               bounds the memory usage. [default=2*num_workers]
+        | ``ordered`` -- when True, the results are yielded in the order of
+                         submission. When False, they are yielded as soon as
+                         they are completed. [default=True]
+        | ``key`` -- a function that maps a job to a sort key. When given, the
+                     jobs are submitted in ascending order of the key, e.g.
+                     the largest jobs first for a better load balance.
+        | ``blas_threads`` -- the number of BLAS threads in each worker
+                              process [default=1]
+        | ``tasks_per_worker`` -- when given, each worker process is replaced
+                                  after this number of jobs, such that all its
+                                  memory is returned to the system.
+        | ``timeout`` -- the maximum wall time of a job in seconds. A job that
+                         takes longer gets an error in its result. The pool
+                         of processes is then replaced and the other
+                         unfinished jobs are resubmitted. This is ignored
+                         when num_workers is zero. [default=no limit]
+
+       This is a generator of BatchResult objects, one for each job. The
+       attribute ``index`` of a result refers to the position of the job in the
+       list ``jobs``. Exceptions raised by a job are stored in the ``error``
+       attribute of its result and do not interrupt the other jobs.
+
+       When a worker process dies without raising an exception, e.g. when it
+       is killed by the operating system because it runs out of memory, the
+       result of its job never arrives. Without a ``timeout``, this hangs the
+       batch. With a ``timeout``, such a job is reported as timed out. The
+       time is counted from the moment the job (at the latest) started in a
+       worker, not from its submission.
+    """
+    tasks = list(enumerate(jobs))
+    if key is not None:
+        tasks.sort(key=(lambda task: key(task[1])))
+    if num_workers is None:
+        import multiprocessing
+        num_workers = multiprocessing.cpu_count()
+    if num_workers < 0:
+        raise ValueError("The number of workers can not be negative.")
+    if num_workers == 0:
+        # serial, mainly useful for debugging. The job is copied such that the
+        # treatments and terms of different jobs are independent, just like in
+        # a process pool.
+        for index, job in tasks:
+            value, error, elapsed = _run_task((index, copy.deepcopy(job)))
+            yield BatchResult(index, job, value, error, elapsed)
+        return
+    if max_in_flight is None:
+        max_in_flight = 2*num_workers
+    if max_in_flight < 1:
+        raise ValueError("At least one job must be in flight.")
+    if timeout is not None and timeout <= 0:
+        raise ValueError("The timeout must be strictly positive.")
+
+    from multiprocessing import Pool
+    pool = Pool(num_workers, _limit_blas_threads, (blas_threads,), tasks_per_worker)
+    try:
+        # list of [index, job, async_result, start, error] in order of
+        # submission. The start time is an upper bound for the time at which a
+        # worker picked up the job. The error is set when the job timed out.
+        pending = []
+        counter = 0
+        while counter < len(tasks) or len(pending) > 0:
+            while counter < len(tasks) and len(pending) < max_in_flight:
+                index, job = tasks[counter]
+                pending.append([index, job, pool.apply_async(_run_task, ((index, job),)), None, None])
+                counter += 1
+            position = None
+            while position is None:
+                now = time.time()
+                running = 0
+                for i, item in enumerate(pending):
+                    if item[4] is not None or item[2].ready():
+                        if position is None and (i == 0 or not ordered):
+                            position = i
+                        continue
+                    # The tasks are picked up in order of submission, so
+                    # this one is running when less than num_workers earlier
+                    # jobs are not finished.
+                    if item[3] is None and running < num_workers:
+                        item[3] = now
+                    running += 1
+                    if timeout is not None and item[3] is not None and now - item[3] > timeout:
+                        item[4] = "Timeout: the job did not finish within %s seconds.\n" % timeout
+                        # The worker may be stuck or killed. The only way to
+                        # get rid of it is to replace the whole pool and to
+                        # resubmit the other unfinished jobs.
+                        pool.terminate()
+                        pool = Pool(num_workers, _limit_blas_threads, (blas_threads,), tasks_per_worker)
+                        for other in pending:
+                            if other[4] is None and not other[2].ready():
+                                other[2] = pool.apply_async(_run_task, ((other[0], other[1]),))
+                                other[3] = None
+                        break
+                if position is None:
+                    if timeout is None and ordered:
+                        pending[0][2].wait()
+                    else:
+                        pending[0][2].wait(0.01)
+            index, job, async_result, start, error = pending.pop(position)
+            if error is not None:
+                value, elapsed = None, time.time() - start
+            else:
+                try:
+                    value, error, elapsed = async_result.get()
+                except Exception:
+                    # e.g. the result could not be transferred from the worker
+                    value, error, elapsed = None, traceback.format_exc(), 0.0
+            yield BatchResult(index, job, value, error, elapsed)
+        pool.close()
+    except:
+        # also when the generator is closed before all results are consumed
+        pool.terminate()
+        raise
+    pool.join()
@@ -39,7 +39,7 @@ import numpy, csv
 
 from molmod import boltzmann, kjmol, second, meter, mol, planck
 
-from tamkin.partf import PartFun
+from tamkin.partf import PartFun, _as_temp, _as_result
 
 
 __all__ = [
@@ -176,9 +176,10 @@ class BaseModel(object):
            contribution would be present.
 
            Argument:
-            | ``temp``  -- the temperature
+            | ``temp``  -- the temperature (or an array of temperatures)
         """
-        return sum(pf.chemical_potential(temp)*st for pf, st in self._iter_pfs())
+        temp = _as_temp(temp)
+        return _as_result(sum(pf.chemical_potential(temp)*st for pf, st in self._iter_pfs()))
 
     def energy_difference(self):
         """Compute the electronic energy difference between (+) products and (-) reactants."""
@@ -192,26 +193,32 @@ class BaseModel(object):
         """Compute the internal_heat difference between (+) products and (-) reactants.
 
            Argument:
-            | ``temp`` -- The temperature.
+            | ``temp`` -- The temperature (or an array of temperatures).
         """
-        return sum(pf.internal_heat(temp)*st for pf, st in self._iter_pfs())
+        temp = _as_temp(temp)
+        return _as_result(sum(pf.internal_heat(temp)*st for pf, st in self._iter_pfs()))
 
     def equilibrium_constant(self, temp, do_log=False):
         """Compute the equilibrium constant at the given temperature.
 
            Argument:
-            | ``temp`` -- The temperature.
+            | ``temp`` -- The temperature (or an array of temperatures).
 
            Optional argument:
             | ``do_log`` -- When True, the logarithm of the equilibrium constant
                             is returned instead of just the equilibrium constant
                             itself. [default=False]
+
+           When an array of temperatures is given, the partition functions are
+           evaluated only once for all temperatures and an array with the same
+           shape is returned.
         """
+        temp = _as_temp(temp)
         log_K = sum(pf.logv(temp)*st for pf, st in self._iter_pfs())
         if do_log:
-            return log_K
+            return _as_result(log_K)
         else:
-            return numpy.exp(log_K)
+            return _as_result(numpy.exp(log_K))
 
     def write_table(self, temp, filename):
         """Write a CSV file with the principal energies to a file.
@@ -344,12 +351,16 @@ class BaseKineticModel(BaseModel):
         """Compute the rate constant of the reaction in this analysis
 
            Arguments:
-            | ``temp`` -- The temperature.
+            | ``temp`` -- The temperature (or an array of temperatures).
 
            Optional argument:
             | ``do_log`` -- When True, the logarithm of the rate constant is
                             returned instead of just the rate constant itself.
                             [default=False]
+
+           Implementations must accept arrays of temperatures and return an
+           array with the same shape, such that a grid of temperatures can be
+           processed at once.
         """
         raise NotImplementedError
 
@@ -390,6 +401,7 @@ class KineticModel(BaseKineticModel):
 
            The implementation is based on transition state theory.
         """
+        temp = _as_temp(temp)
         result = self.equilibrium_constant(temp, do_log)
         if do_log:
             result = numpy.log(boltzmann*temp/planck) + result
@@ -399,7 +411,7 @@ class KineticModel(BaseKineticModel):
             result = boltzmann*temp/planck*result
             if self.tunneling is not None:
                 result *= self.tunneling(temp)
-        return result
+        return _as_result(result)
 
     def dump_table(self, temp, c):
         """Write a CSV file with the principal energies to a stream .
@@ -439,6 +451,7 @@ class ActivationKineticModel(BaseKineticModel):
 
     def rate_constant(self, temp, do_log=False):
         """See :meth:`BaseKineticModel.rate_constant`"""
+        temp = _as_temp(temp)
         if do_log:
             return self.tm.equilibrium_constant(temp, True) + \
                    self.km.rate_constant(temp, True)
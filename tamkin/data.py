@@ -53,6 +53,40 @@ __all__ = ["Molecule", "BareNucleus", "Proton", "RotScan",
            "translate_pbc"]
 
 
+def _is_sparse(matrix):
+    """Return True when the matrix is a scipy.sparse matrix."""
+    if not hasattr(matrix, "tocsr"):
+        return False
+    from scipy.sparse import issparse
+    return issparse(matrix)
+
+
+def _dense(matrix):
+    """Return a dense numpy array of a dense or a scipy.sparse matrix."""
+    if _is_sparse(matrix):
+        return matrix.toarray()
+    return matrix
+
+
+class HessianAttribute(ReadOnlyAttribute):
+    """A read-only attribute for a dense or a sparse Hessian.
+
+       Dense Hessians are treated as a regular read-only numpy array attribute.
+       Sparse Hessians (any scipy.sparse format, typically CSR or BSR with 3x3
+       blocks) are stored as given, only the (optional) check is performed.
+    """
+
+    def __set__(self, instance, value, do_check=True):
+        if _is_sparse(value):
+            if value.dtype != float:
+                value = value.astype(float)
+            if do_check:
+                self.check_wrapper(instance, value)
+            setattr(instance, self.attribute_name, value)
+        else:
+            ReadOnlyAttribute.__set__(self, instance, value, do_check)
+
+
 class Molecule(BaseMolecule):
     """A container for a Hessian computation output from QM or MM codes."""
 
@@ -69,7 +103,7 @@ class Molecule(BaseMolecule):
     energy = ReadOnlyAttribute(float, none=False)
     gradient = ReadOnlyAttribute(numpy.ndarray, none=False,
         check=check_gradient, npdim=2, npshape=(None, 3), npdtype=float)
-    hessian = ReadOnlyAttribute(numpy.ndarray, none=False,
+    hessian = HessianAttribute(numpy.ndarray, none=False,
         check=check_hessian, npdim=2, npdtype=float)
     multiplicity = ReadOnlyAttribute(int)
     symmetry_number = ReadOnlyAttribute(int)
@@ -90,7 +124,8 @@ class Molecule(BaseMolecule):
             | ``hessian`` -- The hessian of the energy, i.e. the matrix with
                              second order derivatives towards Cartesian
                              coordinates, in atomic units (float numpy array
-                             with shape 3Nx3N)
+                             with shape 3Nx3N, or a scipy.sparse matrix with
+                             the same shape)
             | ``multiplicity`` -- The spin multiplicity of the electronic system
 
            Optional arguments:
@@ -217,6 +252,10 @@ class Molecule(BaseMolecule):
         """
         selected = numpy.array(selected)
         selected3 = numpy.array( sum( [[3*at, 3*at+1, 3*at+2] for at in selected] ,[]) )
+        if _is_sparse(self.hessian):
+            hessian = self.hessian.tocsr()[selected3,:][:,selected3]
+        else:
+            hessian = self.hessian[selected3,:][:,selected3]
 
         # if the following are none, then use the attributes of the original molecule
         if energy is None: energy = self.energy
@@ -234,7 +273,7 @@ class Molecule(BaseMolecule):
             self.masses[selected],
             energy,
             self.gradient[selected,:],
-            self.hessian[selected3,:][:,selected3],
+            hessian,
             multiplicity,
             symmetry_number = symmetry_number,
             periodic = periodic,
@@ -244,42 +283,55 @@ class Molecule(BaseMolecule):
             unit_cell = unit_cell,
         )
 
-    def write_to_file(self, filename):
+    def write_to_file(self, filename, binary=False):
         """Write the molecule to a human-readable checkpoint file.
 
            Argument:
             | ``filename`` -- the file to write to
+
+           Optional argument:
+            | ``binary`` -- when True, a binary checkpoint file is written
+                            instead. [default=False]
         """
-        from tamkin.io.internal import dump_chk
+        from tamkin.io.internal import dump_chk, dump_bchk
         data = {}
         for key in "numbers", "coordinates", "masses", "energy", "gradient", \
                    "hessian", "multiplicity", "symmetry_number", "periodic", \
                    "title", "symbols":
             value = getattr(self, key, None)
             if value is not None:
-                data[key] = value
+                data[key] = _dense(value)
         if self.graph is not None:
             data["edges"] = numpy.array([tuple(edge) for edge in self.graph.edges])
         if self.unit_cell is not None:
             data["cell_vectors"] = self.unit_cell.matrix
             data["cell_active"] = self.unit_cell.active
-        dump_chk(filename, data)
+        if binary:
+            dump_bchk(filename, data)
+        else:
+            dump_chk(filename, data)
 
     @classmethod
-    def read_from_file(cls, filename):
+    def read_from_file(cls, filename, mmap=False):
         """Construct a Molecule object from a previously saved checkpoint file
 
            Arguments:
             | ``filename`` -- the file to load from
 
+           Optional argument:
+            | ``mmap`` -- when True and the file is a binary checkpoint, the
+                          arrays are memory-mapped instead of loaded into
+                          memory. [default=False]
+
            Usage::
 
              >>> mol = Molecule.read_from_file("mol.chk")
 
+           Text and binary checkpoint files are both recognized.
         """
         from tamkin.io.internal import load_chk
         # load the file
-        data = load_chk(filename)
+        data = load_chk(filename, mmap)
         # check the names of the fields:
         mandatory_fields = set([
             "numbers", "coordinates", "masses", "energy", "gradient", "hessian"
@@ -324,7 +376,7 @@ class Molecule(BaseMolecule):
         proj2 = proj1* (self.masses3.reshape((-1,1)))**(0.5)
 
         # Add the shift to the Hessian. The gradient is not changed I guess TODO check this.
-        hessian = self.hessian + shift*proj2
+        hessian = _dense(self.hessian) + shift*proj2
 
         # Use the attributes of the original molecule if they exist
         if hasattr(self,"title"): # check if attribute exists
@@ -382,7 +434,7 @@ class Molecule(BaseMolecule):
         #print numpy.sum((projL-numpy.dot(projL,projL))**2)
 
         # Project hessian and gradient
-        hessian = numpy.dot(numpy.dot(projL,self.hessian),projR)
+        hessian = numpy.dot(numpy.dot(projL,_dense(self.hessian)),projR)
         gradient = numpy.dot(projL, self.gradient.reshape((-1,1))).reshape((-1,3))
 
         # Use the attributes of the original molecule if they exist
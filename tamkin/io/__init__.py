@@ -34,6 +34,7 @@
 #--
 
 
+from tamkin.io.cache import *
 from tamkin.io.charmm import *
 from tamkin.io.cp2k import *
 from tamkin.io.cpmd import *
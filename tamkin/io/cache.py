@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+# TAMkin is a post-processing toolkit for normal mode analysis, thermochemistry
+# and reaction kinetics.
+# Copyright (C) 2008-2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, An Ghysels
+# <An.Ghysels@UGent.be> and Matthias Vandichel <Matthias.Vandichel@UGent.be>
+# Center for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all
+# rights reserved unless otherwise stated.
+#
+# This file is part of TAMkin.
+#
+# TAMkin is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# In addition to the regulations of the GNU General Public License,
+# publications and communications based in parts on this program or on
+# parts of this program are required to cite the following article:
+#
+# "TAMkin: A Versatile Package for Vibrational Analysis and Chemical Kinetics",
+# An Ghysels, Toon Verstraelen, Karen Hemelsoet, Michel Waroquier and Veronique
+# Van Speybroeck, Journal of Chemical Information and Modeling, 2010, 50,
+# 1736-1750W
+# http://dx.doi.org/10.1021/ci100099g
+#
+# TAMkin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+"""On-disk cache of Molecule objects returned by the loaders
+
+   Parsing large output files of quantum chemistry codes can take much longer
+   than the analysis itself. A :class:`MoleculeCache` stores the Molecule
+   objects returned by a loader in a directory, as binary checkpoint files
+   (see :func:`tamkin.io.internal.dump_bchk`). The key of each entry consists
+   of the name of the loader, the values of all its arguments and the
+   modification time and size (or optionally a hash of the contents) of all
+   arguments that are files. For example::
+
+     >>> cache = MoleculeCache("molecules.cache")
+     >>> molecule = cache.load(load_molecule_g03fchk, "freq.fchk")
+
+   The cache is opt-in. The loaders load_molecule_g03fchk, load_molecule_cp2k,
+   load_molecule_vasp and load_molecule_qchem use a cache automatically after
+   it is activated with::
+
+     >>> set_molecule_cache(MoleculeCache("molecules.cache"))
+
+   The total size of the cache is limited. When it is exceeded, the least
+   recently used entries are removed.
+"""
+
+
+from tamkin.data import Molecule
+
+import functools, hashlib, inspect, os, tempfile
+
+
+__all__ = ["MoleculeCache", "set_molecule_cache", "get_molecule_cache"]
+
+
+class MoleculeCache(object):
+    """A directory with Molecule objects returned by loader functions."""
+
+    def __init__(self, dirname, max_size=2**30, hash_contents=False, mmap=False):
+        """
+           Argument:
+            | ``dirname`` -- the directory with the cache files. It is created
+                             when it does not exist yet.
+
+           Optional arguments:
+            | ``max_size`` -- the maximum total size of the cache files in
+                              bytes [default=1GB]
+            | ``hash_contents`` -- when True, the contents of the input files
+                                   are hashed to construct the key of an entry.
+                                   Otherwise the modification time and the size
+                                   of the input files are used. [default=False]
+            | ``mmap`` -- when True, the arrays of a molecule taken from the
+                          cache are memory-mapped instead of read into memory.
+                          These arrays are read-only, unlike those of a
+                          molecule returned by the loader itself. The entries
+                          may also be removed by :meth:`evict` or :meth:`clear`
+                          while they are still mapped, which is only safe on
+                          POSIX systems. [default=False]
+
+           The attributes ``hits``, ``misses`` and ``evictions`` count the
+           number of molecules taken from the cache, the number of calls to a
+           loader and the number of entries removed from the cache, respectively.
+        """
+        self.dirname = dirname
+        self.max_size = max_size
+        self.hash_contents = hash_contents
+        self.mmap = mmap
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+    def _get_entries(self):
+        """Return a list of (mtime, size, filename) of all entries."""
+        result = []
+        for name in os.listdir(self.dirname):
+            if name.endswith(".bchk"):
+                filename = os.path.join(self.dirname, name)
+                stat = os.stat(filename)
+                result.append((stat.st_mtime, stat.st_size, filename))
+        return result
+
+    size = property(lambda self: sum(entry[1] for entry in self._get_entries()),
+        doc="The total size of the cache files in bytes")
+
+    def get_key(self, loader, args, kwargs):
+        """Return the key of a call to a loader
+
+           Arguments:
+            | ``loader`` -- the loader function
+            | ``args``, ``kwargs`` -- the positional and keyword arguments
+
+           The key is a hexadecimal SHA1 digest of the name of the loader and
+           the values of all arguments, including the default values. For
+           arguments that are names of existing files, also the modification
+           time and size, or a hash of the contents, are included.
+        """
+        loader = getattr(loader, "_uncached", loader)
+        callargs = inspect.getcallargs(loader, *args, **kwargs)
+        parts = ["%s.%s" % (loader.__module__, loader.__name__)]
+        for name, value in sorted(callargs.iteritems()):
+            parts.append("%s=%r" % (name, value))
+            if isinstance(value, str) and os.path.isfile(value):
+                if self.hash_contents:
+                    parts.append(_hash_file(value))
+                else:
+                    stat = os.stat(value)
+                    parts.append("%r %i" % (stat.st_mtime, stat.st_size))
+        return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+    def load(self, loader, *args, **kwargs):
+        """Return the molecule loaded by a loader, using the cache if possible
+
+           Argument:
+            | ``loader`` -- a function that returns a Molecule object
+
+           All other arguments are passed on to the loader.
+        """
+        # the undecorated loader, see _cached_loader
+        loader = getattr(loader, "_uncached", loader)
+        key = self.get_key(loader, args, kwargs)
+        filename = os.path.join(self.dirname, "%s.bchk" % key)
+        if os.path.isfile(filename):
+            try:
+                molecule = Molecule.read_from_file(filename, mmap=self.mmap)
+            except (IOError, ValueError, TypeError, KeyError):
+                # a corrupt entry
+                os.remove(filename)
+            else:
+                self.hits += 1
+                # the modification time is used to find the least recently
+                # used entries.
+                os.utime(filename, None)
+                return molecule
+        self.misses += 1
+        molecule = loader(*args, **kwargs)
+        # write to a temporary file first, such that concurrent processes
+        # never see an incomplete entry.
+        fd, tmp = tempfile.mkstemp(".tmp", key, self.dirname)
+        os.close(fd)
+        try:
+            molecule.write_to_file(tmp, binary=True)
+            os.rename(tmp, filename)
+        except (IOError, OSError, TypeError):
+            os.remove(tmp)
+            return molecule
+        self.evict()
+        return molecule
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is not
+           larger than max_size.
+        """
+        entries = self._get_entries()
+        total = sum(entry[1] for entry in entries)
+        entries.sort()
+        for mtime, size, filename in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                # removed by another process
+                pass
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        for mtime, size, filename in self._get_entries():
+            os.remove(filename)
+
+
+def _hash_file(filename, block_size=2**20):
+    """Return the SHA1 digest of the contents of a file."""
+    result = hashlib.sha1()
+    f = file(filename, "rb")
+    while True:
+        block = f.read(block_size)
+        if len(block) == 0:
+            break
+        result.update(block)
+    f.close()
+    return result.hexdigest()
+
+
+# the cache used by the loaders decorated with _cached_loader
+_molecule_cache = None
+
+
+def set_molecule_cache(cache):
+    """Activate a cache for the loaders of QM/MM output files
+
+       Argument:
+        | ``cache`` -- a MoleculeCache object, or None to deactivate the cache
+
+       The cache is used by load_molecule_g03fchk, load_molecule_cp2k,
+       load_molecule_vasp and load_molecule_qchem.
+    """
+    global _molecule_cache
+    _molecule_cache = cache
+
+
+def get_molecule_cache():
+    """Return the active MoleculeCache object, or None."""
+    return _molecule_cache
+
+
+def _cached_loader(loader):
+    """Decorator for loaders that use the active MoleculeCache, if any."""
+    @functools.wraps(loader)
+    def wrapper(*args, **kwargs):
+        if _molecule_cache is None:
+            return loader(*args, **kwargs)
+        return _molecule_cache.load(loader, *args, **kwargs)
+    wrapper._uncached = loader
+    return wrapper
@@ -35,11 +35,12 @@
 
 
 from tamkin.data import Molecule
+from tamkin.io.internal import load_bchk, dump_bchk
 
 from molmod import angstrom, amu, calorie, avogadro, lightspeed, centimeter
 from molmod.periodic import periodic
 
-import numpy
+import numpy, itertools, os
 
 
 __all__ = [
@@ -48,7 +49,7 @@ __all__ = [
 ]
 
 
-def load_molecule_charmm(charmmfile_cor, charmmfile_hess, is_periodic=False):
+def load_molecule_charmm(charmmfile_cor, charmmfile_hess, is_periodic=False, sparse=False, cache=False):
     """Read from Hessian-CHARMM-file format
 
        Arguments:
@@ -58,46 +59,48 @@ def load_molecule_charmm(charmmfile_cor, charmmfile_hess, is_periodic=False):
        Optional argument:
         | is_periodic  --  True when the system is periodic in three dimensions.
                            False when the systen is aperiodic. [default=True]
+        | sparse  --  When True, the Hessian is stored as a scipy.sparse CSR
+                      matrix. Only the nonzero elements are kept in memory.
+                      [default=False]
+        | cache  --  When True, the parsed contents of the Hessian file are
+                     stored in a binary sidecar file, charmmfile_hess + '.bchk',
+                     that is used instead of the Hessian file as long as the
+                     modification time and the size of the latter do not
+                     change. A filename can be given instead of True to store
+                     the sidecar elsewhere. [default=False]
+
+       The upper triangle of the Hessian is parsed in large chunks into a
+       packed one-dimensional array (or only its nonzero elements when sparse
+       is True), which is then expanded into a symmetric matrix.
     """
-    f = file(charmmfile_hess)
-    # skip lines if they start with a *
-    while True:
-        line = f.readline()
-        if not line.startswith("*"): break
-    N = int(line.split()[-1])
-    assert N > 0   # nb of atoms should be > 0
-
-    energy = float(f.readline().split()[-1]) * 1000*calorie/avogadro
-
-    gradient = numpy.zeros((N,3),float)
-    for i,line in enumerate(f):
-        words = line.split()
-        gradient[i,:] = [float(word) for word in words]
-        if i == (N-1):
-            break
-    gradient *= 1000*calorie/avogadro/angstrom
-    hessian = numpy.zeros((3*N,3*N),float)
-    row = 0
-    col = 0
-    for line in f:
-        element = float(line.split()[-1])
-        hessian[row,col]=element
-        hessian[col,row]=element
-        col += 1
-        if col>=3*N:        #if this new col doesn't exist
-            row += 1        #go to next row
-            col = row       #to diagonal element
-            if row >= 3*N:  #if this new row doesn't exist
-               break
-    hessian = hessian * 1000*calorie/avogadro /angstrom**2
-
-    positions = numpy.zeros((N,3),float)
-    for i,line in enumerate(f):
-        words = line.split()
-        positions[i,:] = [float(word)*angstrom for word in words]
-        if i == (N-1):
-            break
-    f.close()
+    if cache is True:
+        cache = charmmfile_hess + ".bchk"
+    data = None
+    if cache:
+        data = _load_hessian_cache(charmmfile_hess, cache)
+    if data is None:
+        data = _load_hessian_charmm(charmmfile_hess, sparse)
+        if cache:
+            _dump_hessian_cache(charmmfile_hess, cache, data)
+    N = data["size"]
+    energy = data["energy"]
+    gradient = data["gradient"]
+    positions = data["positions"]
+    if sparse:
+        if "packed" in data:
+            indices = data["packed"].nonzero()[0]
+            values = data["packed"][indices]
+        else:
+            indices = data["indices"]
+            values = data["values"]
+        hessian = _unpack_triangle_sparse(indices, values, 3*N)
+    else:
+        if "packed" in data:
+            packed = data["packed"]
+        else:
+            packed = numpy.zeros((9*N*N+3*N)//2, float)
+            packed[data["indices"]] = data["values"]
+        hessian = _unpack_triangle(packed, 3*N)
 
     # Read from coordinates-CHARMM-file
     # format:  header lines, which start with *
@@ -127,9 +130,7 @@ def load_molecule_charmm(charmmfile_cor, charmmfile_hess, is_periodic=False):
         if m2 is None:
             m2 = 200000.0
         mass_table[i] = 0.5*(m1+m2)
-    atomicnumbers = numpy.zeros(N, int)
-    for i,mass in enumerate(masses):
-        atomicnumbers[i] = mass_table.searchsorted(mass)
+    atomicnumbers = mass_table.searchsorted(masses).astype(int)
 
     return Molecule(
         atomicnumbers, positions, masses, energy, gradient, hessian,
@@ -138,6 +139,142 @@ def load_molecule_charmm(charmmfile_cor, charmmfile_hess, is_periodic=False):
     )
 
 
+def _read_columns(f, num_lines, chunk_size=65536):
+    """Read a number of lines with the same number of columns of floats
+
+       Arguments:
+        | f  --  the open file
+        | num_lines  --  the number of lines to read
+
+       Optional argument:
+        | chunk_size  --  the number of lines that are converted at once
+
+       Returns a generator of two-dimensional arrays, one for each chunk.
+       The lines are read by iterating over the file, so the caller must not
+       call ``f.readline()`` afterwards. (Use ``f.next()`` instead.)
+    """
+    done = 0
+    while done < num_lines:
+        size = min(chunk_size, num_lines - done)
+        text = "".join(itertools.islice(f, size))
+        values = numpy.fromstring(text, float, sep=" ")
+        if len(values) % size != 0 or len(values) == 0:
+            raise IOError("Unexpected number of values in %s." % f.name)
+        yield values.reshape(size, -1)
+        done += size
+
+
+def _load_hessian_charmm(filename, sparse):
+    """Parse a Hessian-CHARMM-file
+
+       Arguments:
+        | filename  --  the Hessian file
+        | sparse  --  When True, only the nonzero elements of the upper
+                      triangle of the Hessian are kept.
+
+       Returns a dictionary with the number of atoms ("size"), the energy, the
+       gradient, the positions and the upper triangle of the Hessian, all in
+       atomic units. The upper triangle is stored row by row in the packed
+       array "packed", or by the positions in this packed array and the values
+       of the nonzero elements, "indices" and "values", when sparse is True.
+    """
+    f = file(filename)
+    # skip lines if they start with a *
+    while True:
+        line = f.readline()
+        if not line.startswith("*"): break
+    N = int(line.split()[-1])
+    assert N > 0   # nb of atoms should be > 0
+
+    energy = float(f.readline().split()[-1]) * 1000*calorie/avogadro
+
+    gradient = numpy.concatenate(list(_read_columns(f, N)))
+    gradient *= 1000*calorie/avogadro/angstrom
+
+    # the upper triangle, row by row, with the element in the last column
+    num_elements = (9*N*N+3*N)//2
+    if sparse:
+        indices = []
+        values = []
+    else:
+        packed = numpy.zeros(num_elements, float)
+    begin = 0
+    for chunk in _read_columns(f, num_elements):
+        chunk = chunk[:,-1] * 1000*calorie/avogadro /angstrom**2
+        if sparse:
+            nonzero = chunk.nonzero()[0]
+            indices.append(nonzero + begin)
+            values.append(chunk[nonzero])
+        else:
+            packed[begin:begin+len(chunk)] = chunk
+        begin += len(chunk)
+
+    positions = numpy.concatenate(list(_read_columns(f, N)))*angstrom
+    f.close()
+
+    result = {"size": N, "energy": energy, "gradient": gradient, "positions": positions}
+    if sparse:
+        result["indices"] = numpy.concatenate(indices)
+        result["values"] = numpy.concatenate(values)
+    else:
+        result["packed"] = packed
+    return result
+
+
+def _unpack_triangle(packed, size):
+    """Expand a packed upper triangle (row by row) into a symmetric matrix."""
+    result = numpy.zeros((size, size), float)
+    begin = 0
+    for row in xrange(size):
+        end = begin + size - row
+        result[row,row:] = packed[begin:end]
+        result[row:,row] = packed[begin:end]
+        begin = end
+    return result
+
+
+def _unpack_triangle_sparse(indices, values, size):
+    """Construct a symmetric CSR matrix from the elements of a packed upper
+       triangle (row by row), given by their positions in the packed array.
+    """
+    from scipy.sparse import coo_matrix
+    # the position of the diagonal element of each row in the packed array
+    starts = numpy.arange(size)*size - (numpy.arange(size)*(numpy.arange(size) - 1))//2
+    rows = starts.searchsorted(indices, "right") - 1
+    cols = indices - starts[rows] + rows
+    offdiag = rows != cols
+    return coo_matrix((
+        numpy.concatenate([values, values[offdiag]]),
+        (numpy.concatenate([rows, cols[offdiag]]), numpy.concatenate([cols, rows[offdiag]])),
+    ), (size,size)).tocsr()
+
+
+def _load_hessian_cache(filename, cache):
+    """Load the sidecar file of a Hessian file, if it is still valid."""
+    if not os.path.isfile(cache):
+        return None
+    stat = os.stat(filename)
+    try:
+        data = load_bchk(cache)
+    except (IOError, ValueError):
+        return None
+    if data.get("source_mtime") != stat.st_mtime or data.get("source_size") != stat.st_size:
+        return None
+    return data
+
+
+def _dump_hessian_cache(filename, cache, data):
+    """Write the sidecar file of a Hessian file. Failures are ignored."""
+    stat = os.stat(filename)
+    data = dict(data)
+    data["source_mtime"] = float(stat.st_mtime)
+    data["source_size"] = int(stat.st_size)
+    try:
+        dump_bchk(cache, data)
+    except (IOError, OSError):
+        pass
+
+
 def load_coordinates_charmm(filename):
     """Read coordinates from a standard CHARMM coordinate file
 
@@ -35,6 +35,7 @@
 
 
 from tamkin.data import Molecule
+from tamkin.io.cache import _cached_loader
 
 from molmod.periodic import periodic
 from molmod.unit_cells import UnitCell
@@ -46,6 +47,7 @@ import numpy as np
 __all__ = ["load_molecule_cp2k"]
 
 
+@_cached_loader
 def load_molecule_cp2k(fn_sp, fn_freq, multiplicity=1, is_periodic=True):
     """Load a molecule with the Hessian from a CP2K computation
 
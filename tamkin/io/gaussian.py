@@ -35,6 +35,7 @@
 
 
 from tamkin.data import Molecule, RotScan
+from tamkin.io.cache import _cached_loader
 
 from molmod.io import FCHKFile
 from molmod import dihed_angle, amu, angstrom
@@ -95,6 +96,7 @@ def iter_floats_file(fn):
     f.close()
 
 
+@_cached_loader
 def load_molecule_g03fchk(fn_freq, fn_ener=None, fn_vdw=None, energy=None, fn_punch=None):
     """Load a molecule from Gaussian03 formatted checkpoint files.
 
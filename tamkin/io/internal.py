@@ -34,40 +34,46 @@
 #--
 
 
+import json, struct
+
 import numpy
 
 
 __all__ = [
-    "load_chk", "dump_chk",
+    "load_chk", "dump_chk", "load_bchk", "dump_bchk", "list_chk",
     "load_indices", "dump_indices",
 ]
 
 
 
-def load_chk(filename):
+def load_chk(filename, mmap=False, fields=None):
     """Load a TAMKin checkpoint file
 
        Argument:
         | filename  --  the file to load from
 
+       Optional arguments:
+        | mmap  --  When True and the file is a binary checkpoint, the arrays
+                    are memory-mapped instead of loaded. See load_bchk.
+        | fields  --  A list of field labels to load. The data of all other
+                      fields are skipped without parsing them. When not given,
+                      all fields are loaded.
+
        The return value is a dictionary whose keys are field labels and the
        values can be None, string, integer, float, boolean or an array of
        strings, integers, booleans or floats.
 
        The file format is similar to the Gaussian fchk format, but has the extra
-       feature that the shapes of the arrays are also stored.
+       feature that the shapes of the arrays are also stored. Binary checkpoint
+       files, written with dump_bchk, are recognized automatically.
     """
+    if _is_bchk(filename):
+        return load_bchk(filename, mmap, fields)
     f = file(filename)
     result = {}
-    while True:
-        line = f.readline()
-        if line == "":
-            break
-        if len(line) < 54:
-            raise IOError("Header lines must be at least 54 characters long.")
-        key = line[:40].strip()
-        kind = line[47:52].strip()
-        value = line[53:-1] # discard newline
+    for key, kind, value, begin, end in _index_chk(f):
+        if fields is not None and key not in fields:
+            continue
         if kind == 'str':
             result[key] = value
         elif kind == 'int':
@@ -77,33 +83,24 @@ def load_chk(filename):
         elif kind == 'flt':
             result[key] = float(value)
         elif kind[3:5] == 'ar':
-            if kind[:3] == 'str':
-                dtype = str
-            elif kind[:3] == 'int':
-                dtype = int
+            shape = _parse_chk_shape(value)
+            size = int(numpy.prod(shape))
+            f.seek(begin)
+            text = f.read(end - begin)
+            if kind[:3] in ['int', 'flt']:
+                # bulk conversion in C
+                dtype = {'int': int, 'flt': float}[kind[:3]]
+                array = numpy.fromstring(text, dtype, sep=" ")
+            elif kind[:3] == 'str':
+                array = numpy.array(text.split(), str)
             elif kind[:3] == 'bln':
-                dtype = bool
-            elif kind[:3] == 'flt':
-                dtype = float
+                words = numpy.array(text.lower().split())
+                array = (words == "true") | (words == "1") | (words == "yes")
             else:
                 raise IOError("Unsupported kind: %s" % kind)
-            shape = tuple(int(i) for i in value.split(","))
-            array = numpy.zeros(shape, dtype)
-            work = array.ravel()
-            counter = 0
-            while True:
-                short = f.readline().split()
-                for s in short:
-                    if dtype is bool and s.lower() in ["True", "1", "Yes"]:
-                        work[counter] = True
-                    else:
-                        work[counter] = dtype(s)
-                    counter += 1
-                    if counter == array.size:
-                        break
-                if counter == array.size:
-                    break
-            result[key] = array
+            if array.size != size:
+                raise IOError("Expected %i elements for field %s, found %i." % (size, key, array.size))
+            result[key] = array.reshape(shape)
         elif kind == 'none':
             result[key] = None
         else:
@@ -112,6 +109,87 @@ def load_chk(filename):
     return result
 
 
+def list_chk(filename):
+    """Return the field labels in a TAMKin checkpoint file
+
+       Argument:
+        | filename  --  the file to inspect
+
+       Only the headers of the fields are read, not the data of the arrays.
+       This works for text and binary checkpoint files.
+    """
+    if _is_bchk(filename):
+        f = file(filename, "rb")
+        records = _read_bchk_header(f, filename)[0]
+        f.close()
+        return [_as_str(record["key"]) for record in records]
+    f = file(filename)
+    result = [record[0] for record in _index_chk(f)]
+    f.close()
+    return result
+
+
+def _parse_chk_shape(value):
+    """Convert the shape in the header of an array field to a tuple."""
+    return tuple(int(i) for i in value.split(","))
+
+
+def _is_chk_header(line):
+    """Test if a line from a text checkpoint file is the header of a field."""
+    return len(line) >= 54 and line[42:47] == "kind="
+
+
+def _index_chk(f):
+    """Build an index of all the fields in a text checkpoint file
+
+       Argument:
+        | f  --  the open checkpoint file
+
+       Returns a list of tuples (key, kind, value, begin, end), where value is
+       the last part of the header line and begin and end are the positions of
+       the array data in the file (begin == end for other fields).
+
+       The arrays are skipped without parsing them. Each element is written
+       with a width of 22 characters, followed by a space or a new-line, so the
+       size of the data is normally known in advance. This is verified by
+       checking that a header or the end of the file follows. If not, e.g.
+       due to exponents with three digits, the lines are counted instead.
+    """
+    result = []
+    f.seek(0, 2)
+    end = f.tell()
+    f.seek(0)
+    while True:
+        line = f.readline()
+        if line == "":
+            break
+        if len(line) < 54:
+            raise IOError("Header lines must be at least 54 characters long.")
+        key = line[:40].strip()
+        kind = line[47:52].strip()
+        value = line[53:-1] # discard newline
+        begin = f.tell()
+        if kind[3:5] == 'ar':
+            size = int(numpy.prod(_parse_chk_shape(value)))
+        else:
+            size = 0
+        if size > 0:
+            guess = begin + 23*size
+            skipped = False
+            if guess <= end:
+                f.seek(guess - 1)
+                if f.read(1) == "\n" and (guess == end or _is_chk_header(f.readline())):
+                    f.seek(guess)
+                    skipped = True
+            if not skipped:
+                # the fast skip failed, count the lines instead
+                f.seek(begin)
+                for i in xrange((size+3)//4):
+                    f.readline()
+        result.append((key, kind, value, begin, f.tell()))
+    return result
+
+
 def dump_chk(filename, data):
     """Dump a TAMKin checkpoint file
 
@@ -168,15 +246,7 @@ def dump_chk(filename, data):
                 format_str = "%22.15e"
             else:
                 raise TypeError("Numpy array dtype %s not supported." % value.dtype)
-            short_len = 4
-            short = []
-            for x in value.ravel():
-                short.append(x)
-                if len(short) == 4:
-                    print >> f, " ".join(format_str  % s for s in short)
-                    short = []
-            if len(short) > 0:
-                print >> f, " ".join(format_str  % s for s in short)
+            _write_chk_array(f, value.ravel(), format_str)
         elif value is None:
             print >> f, "%40s  kind=none   None" % key.ljust(40)
         else:
@@ -184,6 +254,180 @@ def dump_chk(filename, data):
     f.close()
 
 
+# The binary checkpoint format consists of:
+#  - the magic string below (8 bytes),
+#  - the length of the header (little-endian unsigned 64-bit integer),
+#  - the header: an ASCII JSON list with one record for each field,
+#  - padding up to a multiple of _bchk_alignment bytes,
+#  - the raw (C-ordered) data of the arrays, each one aligned.
+# The records of arrays contain the dtype, the shape and the offset of the
+# data, relative to the end of the padded header.
+_bchk_magic = b"TAMKBCHK"
+_bchk_alignment = 64
+
+
+def _is_bchk(filename):
+    """Return True if the file is a binary checkpoint file."""
+    f = file(filename, "rb")
+    magic = f.read(len(_bchk_magic))
+    f.close()
+    return magic == _bchk_magic
+
+
+def _align(size):
+    """Round size up to a multiple of _bchk_alignment."""
+    return -(-size//_bchk_alignment)*_bchk_alignment
+
+
+def load_bchk(filename, mmap=False, fields=None):
+    """Load a binary TAMKin checkpoint file
+
+       Argument:
+        | filename  --  the file to load from
+
+       Optional arguments:
+        | mmap  --  When True, the (non-empty) arrays are read-only
+                    numpy.memmap objects. The data are then only read from disk
+                    when they are accessed. [default=False]
+        | fields  --  A list of field labels to load. When not given, all
+                      fields are loaded.
+
+       The return value is a dictionary, just like for load_chk.
+    """
+    f = file(filename, "rb")
+    records, data_start = _read_bchk_header(f, filename)
+    result = {}
+    for record in records:
+        key = _as_str(record["key"])
+        if fields is not None and key not in fields:
+            continue
+        kind = record["kind"]
+        if kind == "none":
+            result[key] = None
+        elif kind == "str":
+            result[key] = _as_str(record["value"])
+        elif kind == "bln":
+            result[key] = bool(record["value"])
+        elif kind == "int":
+            result[key] = int(record["value"])
+        elif kind == "flt":
+            result[key] = float(record["value"])
+        elif kind == "array":
+            dtype = numpy.dtype(_as_str(record["dtype"]))
+            shape = tuple(record["shape"])
+            offset = data_start + record["offset"]
+            size = int(numpy.prod(shape))
+            if size == 0:
+                result[key] = numpy.zeros(shape, dtype)
+            elif mmap:
+                result[key] = numpy.memmap(filename, dtype, "r", offset, shape)
+            else:
+                f.seek(offset)
+                result[key] = numpy.fromfile(f, dtype, size).reshape(shape)
+        else:
+            raise IOError("Unsupported kind: %s" % kind)
+    f.close()
+    return result
+
+
+def _read_bchk_header(f, filename):
+    """Read the header of a binary checkpoint file.
+
+       Returns the list of records and the position of the data.
+    """
+    if f.read(len(_bchk_magic)) != _bchk_magic:
+        raise IOError("%s is not a binary TAMKin checkpoint file." % filename)
+    header_size = struct.unpack("<Q", f.read(8))[0]
+    records = json.loads(f.read(header_size).decode("ascii"))
+    return records, _align(len(_bchk_magic) + 8 + header_size)
+
+
+def _as_str(value):
+    """Convert a string from a JSON header to the native string type."""
+    if not isinstance(value, str):
+        value = value.encode("utf-8")
+    return value
+
+
+def dump_bchk(filename, data):
+    """Dump a binary TAMKin checkpoint file
+
+       Argument:
+        | filename  --  the file to write to
+        | data  -- a dictionary whose keys are field labels and the values can
+                   be None, string, integer, float, boolean, an array/list of
+                   strings, integers, floats or booleans.
+
+       Unlike the text format of dump_chk, the arrays are stored in their
+       binary representation, without loss of precision and with their
+       original dtype. The arrays in the file can be memory-mapped, see
+       load_bchk.
+    """
+    records = []
+    arrays = []
+    data_size = 0
+    for key, value in sorted(data.iteritems()):
+        if not isinstance(key, str):
+            raise TypeError("The keys must be strings.")
+        if value is None:
+            records.append({"key": key, "kind": "none"})
+        elif isinstance(value, str):
+            records.append({"key": key, "kind": "str", "value": value})
+        elif isinstance(value, (bool, numpy.bool_)):
+            records.append({"key": key, "kind": "bln", "value": bool(value)})
+        elif isinstance(value, (int, long, numpy.integer)):
+            records.append({"key": key, "kind": "int", "value": int(value)})
+        elif isinstance(value, (float, numpy.floating)):
+            records.append({"key": key, "kind": "flt", "value": float(value)})
+        elif isinstance(value, numpy.ndarray) or isinstance(value, list) or \
+             isinstance(value, tuple):
+            value = numpy.ascontiguousarray(value)
+            if value.dtype.fields is not None:
+                raise TypeError("Arrays with fields are not supported.")
+            if value.dtype.kind not in "biufcSU":
+                raise TypeError("Numpy array dtype %s not supported." % value.dtype)
+            data_size = _align(data_size)
+            records.append({
+                "key": key, "kind": "array", "dtype": value.dtype.str,
+                "shape": list(value.shape), "offset": data_size,
+            })
+            arrays.append((data_size, value))
+            data_size += value.nbytes
+        else:
+            raise TypeError("Type %s not supported." % type(value))
+    header = json.dumps(records).encode("ascii")
+    data_start = _align(len(_bchk_magic) + 8 + len(header))
+    f = file(filename, "wb")
+    f.write(_bchk_magic)
+    f.write(struct.pack("<Q", len(header)))
+    f.write(header)
+    for offset, array in arrays:
+        f.seek(data_start + offset)
+        array.tofile(f)
+    # make sure the file has its full length, also when the last arrays are
+    # empty
+    f.seek(data_start + data_size)
+    f.truncate()
+    f.close()
+
+
+def _write_chk_array(f, values, format_str, block_size=4096):
+    """Write the elements of a flat array, four per line.
+
+       The lines are formatted in blocks with a single string formatting
+       operation, which gives exactly the same output as formatting each
+       element separately.
+    """
+    num_full = len(values)//4
+    line_format = " ".join([format_str]*4) + "\n"
+    for begin in xrange(0, num_full, block_size):
+        end = min(begin + block_size, num_full)
+        f.write((line_format*(end - begin)) % tuple(values[4*begin:4*end].tolist()))
+    rest = values[4*num_full:].tolist()
+    if len(rest) > 0:
+        f.write(" ".join([format_str]*len(rest)) % tuple(rest) + "\n")
+
+
 def load_indices(filename, shift=-1, groups=False):
     """Load atom indexes from file
 
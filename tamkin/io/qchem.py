@@ -34,6 +34,7 @@
 #--
 
 from tamkin.data import Molecule
+from tamkin.io.cache import _cached_loader
 
 from molmod import angstrom, amu, calorie, avogadro
 from molmod.periodic import periodic
@@ -43,6 +44,7 @@ import numpy
 
 __all__ = ["load_molecule_qchem"]
 
+@_cached_loader
 def load_molecule_qchem(qchemfile, hessfile = None, multiplicity=1, is_periodic = False):
     """Load a molecule from a Q-Chem frequency run
 
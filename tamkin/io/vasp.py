@@ -35,6 +35,7 @@
 
 
 from tamkin.data import Molecule
+from tamkin.io.cache import _cached_loader
 
 from molmod import electronvolt, angstrom, amu
 from molmod.periodic import periodic
@@ -46,6 +47,7 @@ import numpy
 __all__ = ["load_molecule_vasp", "load_fixed_vasp"]
 
 
+@_cached_loader
 def load_molecule_vasp(vaspfile_xyz, vaspfile_out, energy = 0.0, multiplicity=1, is_periodic=True):
     """Load a molecule from VASP output files
 
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+# TAMkin is a post-processing toolkit for normal mode analysis, thermochemistry
+# and reaction kinetics.
+# Copyright (C) 2008-2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, An Ghysels
+# <An.Ghysels@UGent.be> and Matthias Vandichel <Matthias.Vandichel@UGent.be>
+# Center for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all
+# rights reserved unless otherwise stated.
+#
+# This file is part of TAMkin.
+#
+# TAMkin is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# In addition to the regulations of the GNU General Public License,
+# publications and communications based in parts on this program or on
+# parts of this program are required to cite the following article:
+#
+# "TAMkin: A Versatile Package for Vibrational Analysis and Chemical Kinetics",
+# An Ghysels, Toon Verstraelen, Karen Hemelsoet, Michel Waroquier and Veronique
+# Van Speybroeck, Journal of Chemical Information and Modeling, 2010, 50,
+# 1736-1750W
+# http://dx.doi.org/10.1021/ci100099g
+#
+# TAMkin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+"""Microcanonical sums and densities of states
+
+   The number of internal states of a molecule is counted on a grid of energy
+   grains. Harmonic vibrations are added with the Beyer-Swinehart algorithm
+   [1], arbitrary sets of energy levels (e.g. of hindered rotors) with the
+   Stein-Rabinovitch extension of it [2] and the classical external rotation is
+   convolved in at the end. All parameters are taken from the terms in a
+   :class:`tamkin.partf.PartFun` object, such that the Laplace transform of the
+   density of states reproduces (within the discretization error) the
+   canonical partition function of the internal degrees of freedom. For
+   example::
+
+     >>> dos = DensityOfStates(pf, 10*planck*lightspeed/centimeter, 40000*planck*lightspeed/centimeter)
+     >>> print dos.sums[-1]
+
+   [1] T. Beyer, D. F. Swinehart, Commun. ACM 16, 379 (1973)
+   [2] S. E. Stein, B. S. Rabinovitch, J. Chem. Phys. 58, 2438 (1973)
+"""
+
+
+from molmod import boltzmann, planck
+
+import numpy, math
+
+from tamkin.partf import Electronic, ExtTrans, ExtRot, Vibrations, _as_temp, \
+    _as_result
+from tamkin.rotor import Rotor
+
+
+__all__ = [
+    "beyer_swinehart", "stein_rabinovitch", "convolve_classical_rotation",
+    "DensityOfStates",
+]
+
+
+def _freq_to_grains(freq, grain):
+    """Convert a frequency into an integer number of energy grains."""
+    m = int(round(planck*freq/grain))
+    if m <= 0:
+        raise ValueError("The energy grain is too large for a frequency of %s a.u." % freq)
+    return m
+
+
+def beyer_swinehart(counts, freqs, grain):
+    """Add harmonic oscillators to a state count.
+
+       Arguments:
+        | ``counts`` -- an array with the number of states in each energy grain
+        | ``freqs`` -- the frequencies of the oscillators
+        | ``grain`` -- the width of an energy grain
+
+       Returns a new array with state counts. The recursion
+       c[i] += c[i-m], with m the number of grains in one quantum, is carried
+       out for all grains at once as a cumulative sum over the columns of a
+       matrix with m columns. The cost is O(N_freq*N_grain).
+    """
+    counts = numpy.array(counts, float)
+    size = len(counts)
+    for freq in freqs:
+        m = _freq_to_grains(freq, grain)
+        if m >= size:
+            continue
+        padded = numpy.zeros(((size + m - 1)/m)*m, float)
+        padded[:size] = counts
+        counts = padded.reshape(-1, m).cumsum(axis=0).ravel()[:size]
+    return counts
+
+
+def _remove_oscillator(counts, freq, grain):
+    """Undo the effect of beyer_swinehart for a single oscillator."""
+    m = _freq_to_grains(freq, grain)
+    result = counts.copy()
+    if m < len(counts):
+        result[m:] -= counts[:-m]
+    return result
+
+
+def stein_rabinovitch(counts, energy_levels, grain):
+    """Add a degree of freedom with arbitrary energy levels to a state count.
+
+       Arguments:
+        | ``counts`` -- an array with the number of states in each energy grain
+        | ``energy_levels`` -- an array with the energy levels
+        | ``grain`` -- the width of an energy grain
+
+       The energies are measured from the lowest level. Returns a new array with
+       state counts.
+    """
+    counts = numpy.asarray(counts, float)
+    size = len(counts)
+    shifts = numpy.round((energy_levels - min(energy_levels))/grain).astype(int)
+    result = numpy.zeros(size, float)
+    for shift in shifts:
+        if shift < size:
+            result[shift:] += counts[:size-shift]
+    return result
+
+
+def _convolve(a, b, fft):
+    """Convolution of two arrays, truncated to the length of the first."""
+    size = len(a)
+    if fft:
+        # zero padding to a power of two avoids the periodic wrap-around
+        padded = 2**int(numpy.ceil(numpy.log2(2*size)))
+        result = numpy.fft.irfft(numpy.fft.rfft(a, padded)*numpy.fft.rfft(b[:size], padded), padded)
+        return result[:size]
+    else:
+        return numpy.convolve(a, b[:size])[:size]
+
+
+def convolve_classical_rotation(counts, count, factor, grain, fft=False):
+    """Convolve a state count with the density of states of a classical rotor.
+
+       Arguments:
+        | ``counts`` -- an array with the number of states in each energy grain
+        | ``count`` -- the number of rotational degrees of freedom
+        | ``factor`` -- the prefactor of the partition function, i.e.
+                        Z = factor*T**(count/2) (see ExtRot.factor)
+        | ``grain`` -- the width of an energy grain
+
+       Optional argument:
+        | ``fft`` -- When True, the convolution is computed with fast Fourier
+                     transforms, which is much faster for a large number of
+                     grains. The round-off errors are then of the order of the
+                     largest count times the machine precision. [default=False]
+
+       The continuous density of states of the rotor is integrated over each
+       grain. Grain i covers the energies [(i-1/2)*grain, (i+1/2)*grain].
+    """
+    counts = numpy.asarray(counts, float)
+    half = 0.5*count
+    # sum of states of the rotor (inverse Laplace transform of Z/beta)
+    edges = (numpy.arange(len(counts)) + 0.5)*grain
+    sums = factor/boltzmann**half*edges**half/math.gamma(half + 1)
+    weights = numpy.diff(numpy.concatenate([[0.0], sums]))
+    return _convolve(counts, weights, fft)
+
+
+class DensityOfStates(object):
+    """The number of internal states of a molecule on a grid of energy grains."""
+
+    def __init__(self, pf, grain, energy_max, fft=False):
+        """
+           Arguments:
+            | ``pf`` -- a PartFun object
+            | ``grain`` -- the width of an energy grain
+            | ``energy_max`` -- the highest energy to consider, measured from
+                                the ground state
+
+           Optional argument:
+            | ``fft`` -- When True, the classical rotation is convolved in with
+                         fast Fourier transforms. [default=False]
+
+           The following contributions are taken into account: Electronic
+           (degeneracy of the ground state), Vibrations (quantum only),
+           Rotor and ExtRot. The translational contribution is not part of the
+           internal states and is ignored. A Rotor replaces the oscillator with
+           the cancelation frequency by its energy levels, just like in the
+           partition function.
+
+           Useful attributes:
+            | ``energies`` -- the energies of the grains, measured from the
+                              ground state
+            | ``counts`` -- the number of states in each grain
+            | ``ground_energy`` -- the energy of the ground state, i.e. the
+                                   electronic energy plus the zero-point
+                                   energies
+        """
+        self.pf = pf
+        self.grain = grain
+        self.fft = fft
+        num_grains = int(numpy.ceil(energy_max/grain)) + 1
+        self.energies = numpy.arange(num_grains)*grain
+        counts = numpy.zeros(num_grains, float)
+        counts[0] = 1.0
+        ground_energy = 0.0
+
+        # first all discrete contributions, the classical rotation at the end
+        terms = []
+        for term in pf.terms:
+            if isinstance(term, (Electronic, Vibrations)):
+                terms.insert(0, term)
+            elif isinstance(term, Rotor):
+                terms.append(term)
+            elif isinstance(term, ExtTrans):
+                continue
+            elif not isinstance(term, ExtRot):
+                raise NotImplementedError("Contribution %s is not supported in the density of states." % term.name)
+        terms.extend(term for term in pf.terms if isinstance(term, ExtRot))
+
+        for term in terms:
+            if isinstance(term, Electronic):
+                counts *= term.multiplicity
+                ground_energy += term.energy
+            elif isinstance(term, Vibrations):
+                if term.classical:
+                    raise NotImplementedError("Classical vibrations are not supported in the density of states.")
+                counts = beyer_swinehart(counts, term.positive_freqs*term.freq_scaling, grain)
+                ground_energy += 0.5*term.zp_scaling*planck*term.positive_freqs.sum()
+            elif isinstance(term, Rotor):
+                if term.classical:
+                    raise NotImplementedError("Classical vibrations are not supported in the density of states.")
+                counts = _remove_oscillator(counts, term.cancel_freq*term.freq_scaling, grain)
+                ground_energy -= 0.5*term.zp_scaling*planck*term.cancel_freq
+                counts = stein_rabinovitch(counts, term.energy_levels, grain)/term.rotsym
+                ground_energy += term.energy_levels.min()
+            else:
+                counts = convolve_classical_rotation(counts, term.count, term.factor, grain, fft)
+        self.counts = counts
+        self.ground_energy = ground_energy
+
+    densities = property(lambda self: self.counts/self.grain,
+        doc="The density of states in each grain")
+    sums = property(lambda self: self.counts.cumsum(),
+        doc="The sum of states, i.e. the number of states up to each grain")
+
+    def log(self, temp):
+        """The logarithm of the Laplace transform of the density of states.
+
+           Argument:
+            | ``temp`` -- the temperature (or an array of temperatures)
+
+           The result includes the ground state energy, i.e. it is the
+           logarithm of the internal partition function with the same energy
+           reference as the PartFun object. It should be close to the sum of the
+           ``log`` methods of all non-translational terms, provided that the
+           energy range is sufficiently large and the grain sufficiently
+           small.
+        """
+        temp = _as_temp(temp)
+        beta = 1.0/(boltzmann*temp)
+        beta_grid = beta.reshape(beta.shape + (1,))
+        laplace = (self.counts*numpy.exp(-beta_grid*self.energies)).sum(axis=-1)
+        return _as_result(numpy.log(laplace) - beta*self.ground_energy)
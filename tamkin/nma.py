@@ -79,15 +79,16 @@ The second argument is an instance of a class that derives from the
 #   weighted Hessian in the new coordinates.
 
 
-from tamkin.data import Molecule
+from tamkin.data import Molecule, _is_sparse, _dense
 from tamkin.geom import transrot_basis, rank_linearity
-from tamkin.io.internal import load_chk, dump_chk
+from tamkin.io.internal import load_chk, dump_chk, dump_bchk, list_chk
 
 import numpy
 
 
 __all__ = [
-    "NMA", "AtomDivision", "Transform", "MassMatrix", "Treatment",
+    "NMA", "AtomDivision", "Transform", "BlockTransform", "MassMatrix",
+    "Treatment",
     "Full", "ConstrainExt", "PHVA", "VSA", "VSANoMass", "MBH",
     "Blocks","PHVA_MBH", "Constrain", "MBHConstrainExt",
 ]
@@ -102,7 +103,7 @@ class NMA(object):
        reduced coordinates is determined by the treatment argument.
     """
 
-    def __init__(self, molecule, treatment=None, do_modes=True):
+    def __init__(self, molecule, treatment=None, do_modes=True, num_modes=None, freq_window=None):
         """
            Arguments:
             | ``molecule`` -- a molecule object obtained from a routine in
@@ -114,6 +115,21 @@ class NMA(object):
             | ``do_modes`` -- When False, only the frequencies are computed.
                               When True, also the normal modes are computed.
                               [default=True]
+            | ``num_modes`` -- When given, only the num_modes lowest frequencies
+                               (and modes) are computed with an iterative
+                               eigensolver (scipy.sparse.linalg.eigsh). This
+                               includes the zero and the imaginary frequencies.
+                               Sparse reduced Hessians are treated with the
+                               shift-invert mode. [default=all frequencies]
+            | ``freq_window`` -- A tuple (low, high). When given, only the
+                                 frequencies in the interval (low, high] are
+                                 computed. Imaginary frequencies are negative.
+                                 The bounds may be infinite. Dense reduced
+                                 Hessians are treated with the LAPACK subset
+                                 drivers, sparse ones with shift-invert
+                                 Lanczos iterations. This option can not be
+                                 combined with num_modes.
+                                 [default=all frequencies]
 
            Referenced attributes of molecule:
               ``mass``, ``masses``, ``masses3``, ``numbers``, ``coordinates``,
@@ -129,9 +145,22 @@ class NMA(object):
                            coordinates.
             | ``zeros`` -- list of indices of zero frequencies
 
+           When num_modes or freq_window is given, the attributes freqs, modes
+           and zeros only refer to the computed subset of frequencies. The zero
+           frequencies are only searched for when the frequency window includes
+           zero.
         """
         if treatment == None:
             treatment = Full()
+        if freq_window is None:
+            eval_window = None
+        else:
+            if num_modes is not None:
+                raise ValueError("The options num_modes and freq_window can not be combined.")
+            if freq_window[0] >= freq_window[1]:
+                raise ValueError("The lower bound of freq_window must be smaller than the upper bound.")
+            # convert frequencies into eigenvalues of the mass-weighted Hessian
+            eval_window = tuple(numpy.sign(freq)*(2*numpy.pi*freq)**2 for freq in freq_window)
 
         # the treatment object will store the results as attributes
         treatment(molecule, do_modes)
@@ -160,21 +189,13 @@ class NMA(object):
             hessian_small_mw = treatment.mass_matrix_small.get_weighted_hessian(treatment.hessian_small)
         del treatment.hessian_small # save memory
 
-        if hessian_small_mw.size == 0:
+        if hessian_small_mw.shape[0] == 0:
             self.freqs = numpy.array([])
             self.modes = numpy.array([])
             self.zeros = []
         else:
-            if do_modes:
-                evals, modes_small_mw = numpy.linalg.eigh(hessian_small_mw)
-            else:
-                evals = numpy.linalg.eigvalsh(hessian_small_mw)
-                modes_small_mw = None
-
-            # frequencies
-            self.freqs = numpy.sqrt(abs(evals))/(2*numpy.pi)
-            # turn imaginary frequencies into negative frequencies
-            self.freqs *= (evals > 0)*2-1
+            evals, modes_small_mw = _diagonalize(hessian_small_mw, do_modes, num_modes, eval_window)
+            del hessian_small_mw # save memory
 
             if do_modes:
                 # At this point the transform object transforms unweighted reduced
@@ -183,32 +204,52 @@ class NMA(object):
                 # coordinates.
                 if treatment.mass_matrix_small is not None:
                     treatment.transform.make_weighted(treatment.mass_matrix_small)
-                # transform the modes to unweighted Cartesian coordinates.
-                self.modes = treatment.transform(modes_small_mw)
-                # transform the modes to weighted Cartesian coordinates.
-                self.modes *= molecule.masses3.reshape((-1,1))**0.5
-            else:
-                self.modes = None
+            self._init_freqs(molecule, evals, modes_small_mw, treatment, freq_window)
+
+        self._init_molecule(molecule)
 
-            # guess which modes correspond to the zero frequencies
-            if treatment.num_zeros == 0:
-                # don't bother
-                self.zeros = []
+    def _init_freqs(self, molecule, evals, modes_small_mw, treatment, freq_window=None):
+        """Assign the frequencies, modes and zeros from the eigenpairs of the
+           mass-weighted reduced Hessian. When modes are given, the transform
+           of the treatment must be mass-weighted.
+        """
+        do_modes = modes_small_mw is not None
+        # frequencies
+        self.freqs = numpy.sqrt(abs(evals))/(2*numpy.pi)
+        # turn imaginary frequencies into negative frequencies
+        self.freqs *= (evals > 0)*2-1
+
+        if do_modes:
+            # transform the modes to unweighted Cartesian coordinates.
+            self.modes = treatment.transform(modes_small_mw)
+            # transform the modes to weighted Cartesian coordinates.
+            self.modes *= molecule.masses3.reshape((-1,1))**0.5
+        else:
+            self.modes = None
+
+        # guess which modes correspond to the zero frequencies
+        num_zeros = min(treatment.num_zeros, len(self.freqs))
+        if freq_window is not None and not (freq_window[0] < 0 <= freq_window[1]):
+            num_zeros = 0
+        if num_zeros == 0:
+            # don't bother
+            self.zeros = []
+        else:
+            if do_modes:
+                # take the 20 lowest modes and compute the overlap with the
+                # external basis
+                to_try = abs(self.freqs).argsort()[:20]   #indices of lowest 20 modes
+                num_try = len(to_try)
+                overlaps = numpy.zeros(num_try, float)
+                for counter, i in enumerate(to_try):
+                    components = numpy.dot(treatment.external_basis, self.modes[:,i])
+                    overlaps[counter] = numpy.linalg.norm(components)
+                self.zeros = to_try[overlaps.argsort()[-num_zeros:]]
             else:
-                if do_modes:
-                    # take the 20 lowest modes and compute the overlap with the
-                    # external basis
-                    num_try = 20
-                    to_try = abs(self.freqs).argsort()[:num_try]   #indices of lowest 20 modes
-                    overlaps = numpy.zeros(num_try, float)
-                    for counter, i in enumerate(to_try):
-                        components = numpy.dot(treatment.external_basis, self.modes[:,i])
-                        overlaps[counter] = numpy.linalg.norm(components)
-                    self.zeros = to_try[overlaps.argsort()[-treatment.num_zeros:]]
-                else:
-                    self.zeros = abs(self.freqs).argsort()[:treatment.num_zeros]
-
-        # a few more attributes that are worth keeping
+                self.zeros = abs(self.freqs).argsort()[:num_zeros]
+
+    def _init_molecule(self, molecule):
+        """Copy a few more attributes of the molecule that are worth keeping"""
         self.mass = molecule.mass
         self.masses = molecule.masses
         self.masses3 = molecule.masses3
@@ -222,57 +263,179 @@ class NMA(object):
         self.title = molecule.title
         self.chemical_formula = molecule.chemical_formula
 
-    def write_to_file(self, filename, fields='all'):
+    @classmethod
+    def isotopologues(cls, molecule, masses_list, treatment=None, do_modes=True):
+        """Perform the normal mode analysis of several isotopologues at once.
+
+           Arguments:
+            | ``molecule`` -- a molecule object obtained from a routine in
+                              :mod:`tamkin.io`
+            | ``masses_list`` -- a list of arrays with atomic masses, one array
+                                 for each isotopologue
+
+           Optional arguments:
+            | ``treatment`` -- an instance of a Treatment subclass
+                               [default=Full()]
+            | ``do_modes`` -- When False, only the frequencies are computed.
+                              [default=True]
+
+           Returns a list of NMA objects, one for each array of masses.
+
+           The reduced Hessian and the transformation to reduced coordinates of
+           most treatments do not depend on the masses. For such treatments
+           (see :attr:`Treatment.mass_independent`), the treatment is carried
+           out only once and only the reduced mass matrix is recomputed for
+           every isotopologue. The mass-weighted reduced Hessians of all
+           isotopologues are diagonalized with one stacked call to eigh.
+           With other treatments, a separate NMA is performed for every
+           isotopologue.
+        """
+        import copy
+        if treatment == None:
+            treatment = Full()
+        molecules = [molecule.copy_with(masses=numpy.array(masses, float)) for masses in masses_list]
+        if len(molecules) == 0:
+            return []
+        if not treatment.mass_independent:
+            return [cls(other, copy.deepcopy(treatment), do_modes) for other in molecules]
+
+        # the transform is needed to compute the reduced mass matrices. The
+        # zeros are computed for each isotopologue below.
+        treatment.compute_hessian(molecule, True)
+        hessian_small = _dense(treatment.hessian_small)
+        del treatment.hessian_small # save memory
+        transform = treatment.transform
+        if hessian_small.shape[0] == 0:
+            return [cls(other, copy.deepcopy(treatment), do_modes) for other in molecules]
+        mass_matrices = [transform.get_mass_matrix(other.masses3) for other in molecules]
+        hessians_small_mw = numpy.array([
+            mass_matrix.get_weighted_hessian(hessian_small)
+            for mass_matrix in mass_matrices
+        ])
+        if do_modes:
+            all_evals, all_modes_small_mw = numpy.linalg.eigh(hessians_small_mw)
+        else:
+            all_evals = numpy.linalg.eigvalsh(hessians_small_mw)
+        del hessians_small_mw # save memory
+
+        result = []
+        for i, other in enumerate(molecules):
+            nma = cls.__new__(cls)
+            treatment.compute_zeros(other, do_modes)
+            if do_modes:
+                treatment.transform = copy.copy(transform)
+                treatment.transform.make_weighted(mass_matrices[i])
+                nma._init_freqs(other, all_evals[i], all_modes_small_mw[i], treatment)
+            else:
+                nma._init_freqs(other, all_evals[i], None, treatment)
+            nma._init_molecule(other)
+            result.append(nma)
+        return result
+
+    # the selections of attributes in checkpoint files, see write_to_file.
+    _checkpoint_fields = {
+        'modes': ["freqs", "modes", "masses", "numbers", "coordinates", "zeros", "title"],
+        'partf': [
+            "freqs", "mass", "masses3", "inertia_tensor", "multiplicity",
+            "symmetry_number", "periodic", "energy", "zeros", "title",
+            "chemical_formula",
+        ],
+    }
+
+    def __getattr__(self, name):
+        """Load attributes of an NMA from a checkpoint file on first access.
+
+           See read_from_file. This method is only called when the attribute
+           is not found in the usual way.
+        """
+        lazy = self.__dict__.get("_lazy")
+        if lazy is None or name not in lazy[2]:
+            raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, name))
+        filename, mmap, keys = lazy
+        value = load_chk(filename, mmap, [name])[name]
+        self.__dict__[name] = value
+        return value
+
+    def write_to_file(self, filename, fields='all', binary=False):
         """Write the NMA results to a human-readable checkpoint file.
 
            Argument:
             | ``filename`` -- the file to write to
 
-           Optional argument:
+           Optional arguments:
             | ``fields`` -- define the selection of attributes to be written to
                             file. This is one of 'all' (all attributes), 'modes'
                             (only attributes required for nmatools.py), or
                             'partf' (only attributes required for the
                             construction of a partition function)
+            | ``binary`` -- when True, a binary checkpoint file is written
+                            instead. This is much faster and more compact for
+                            large systems and the arrays can be memory-mapped
+                            when the file is read. [default=False]
         """
         if fields == 'all':
-            data = dict((key, val) for key, val in self.__dict__.iteritems())
-        elif fields == 'modes':
-            keys = ["freqs", "modes", "masses", "numbers", "coordinates", "zeros", "title"]
-            data = dict((key, self.__dict__[key]) for key in keys)
-        elif fields == 'partf':
-            keys = [
-                "freqs", "mass", "masses3", "inertia_tensor", "multiplicity",
-                "symmetry_number", "periodic", "energy", "zeros", "title",
-                "chemical_formula",
-            ]
-            data = dict((key, self.__dict__[key]) for key in keys)
-        dump_chk(filename, data)
+            keys = set(self.__dict__)
+            if "_lazy" in keys:
+                keys.remove("_lazy")
+                keys.update(self._lazy[2])
+        else:
+            keys = self._checkpoint_fields[fields]
+        data = dict((key, getattr(self, key)) for key in keys)
+        if binary:
+            dump_bchk(filename, data)
+        else:
+            dump_chk(filename, data)
 
     @classmethod
-    def read_from_file(cls, filename):
+    def read_from_file(cls, filename, mmap=False, fields='all'):
         """Construct an NMA object from a previously saved checkpoint file
 
            Arguments:
             | ``filename`` -- the file to load from
 
+           Optional arguments:
+            | ``mmap`` -- when True and the file is a binary checkpoint, the
+                          arrays (e.g. the modes) are memory-mapped instead of
+                          loaded into memory. [default=False]
+            | ``fields`` -- the attributes that are loaded immediately. This is
+                            one of 'all', 'modes' or 'partf' (see
+                            write_to_file), or a list of attribute names. The
+                            other attributes in the file are only loaded when
+                            they are accessed for the first time. The file
+                            should not be modified in the meantime.
+                            [default='all']
+
            Usage::
 
              >>> nma = NMA.read_from_file("foo.chk")
 
+           Text and binary checkpoint files are both recognized. When only a
+           partition function is needed, the modes are not loaded with::
+
+             >>> nma = NMA.read_from_file("foo.chk", fields='partf')
+
         """
         # ugly way to bypass the default constructor
         result = cls.__new__(cls)
-        # load the file
-        data = load_chk(filename)
         # check the names of the fields:
+        keys = list_chk(filename)
         possible_fields = set([
             "freqs", "modes", "mass", "masses", "masses3", "numbers",
             "coordinates", "inertia_tensor", "multiplicity", "symmetry_number",
             "periodic", "energy", "zeros", "title", "chemical_formula",
         ])
-        if not set(data.iterkeys()).issubset(possible_fields):
+        if not set(keys).issubset(possible_fields):
             raise IOError("The Checkpoint file does not contain the correct fields.")
+        # load the file
+        if fields == 'all':
+            data = load_chk(filename, mmap)
+        else:
+            if isinstance(fields, str):
+                fields = cls._checkpoint_fields[fields]
+            data = load_chk(filename, mmap, fields)
+            lazy_keys = frozenset(keys) - frozenset(data)
+            if len(lazy_keys) > 0:
+                result._lazy = (filename, mmap, lazy_keys)
         # assign the attributes
         result.__dict__.update(data)
         return result
@@ -332,7 +495,8 @@ class Transform(object):
         """
            Arguments:
              | ``matrix`` -- the linear transformation from the transformed
-                             displacements to Cartesian coordinates.
+                             displacements to Cartesian coordinates. (A numpy
+                             array or a scipy.sparse matrix.)
 
            Optional argument
              | ``atom_division`` -- an AtomDivision instance, when not given all
@@ -400,12 +564,12 @@ class Transform(object):
             )
         # Computation
         if self.atom_division is None:
-            return numpy.dot(self.matrix, modes)
+            return self.matrix.dot(modes)
         else:
             result = numpy.zeros((self.atom_division.num_cartesian, modes.shape[1]), float)  # 3NxM
             i1 = 3*len(self.atom_division.transformed)
             i2 = i1 + 3*len(self.atom_division.free)
-            result[:i1] = numpy.dot(self.matrix, modes[:self.matrix.shape[1]])
+            result[:i1] = self.matrix.dot(modes[:self.matrix.shape[1]])
             if self.weighted:
                 result[i1:i2] = modes[self.matrix.shape[1]:]*self.scalars
             else:
@@ -430,10 +594,141 @@ class Transform(object):
         # the transformation matrix always transforms to non-mass-weighted Cartesian coords
         if self.weighted:
             raise Exception("The transformation is already weighted.")
-        self.matrix = numpy.dot(self.matrix, mass_matrix.mass_block_inv_sqrt)
+        self.matrix = self.matrix.dot(mass_matrix.mass_block_inv_sqrt)
         self.scalars = mass_matrix.mass_diag_inv_sqrt.reshape((-1,1))
         self._weighted = True
 
+    def get_mass_matrix(self, masses3):
+        """Compute the mass matrix in the new coordinates: ``T^T M T``
+
+           Argument:
+            | ``masses3`` -- the diagonal of the Cartesian mass matrix
+
+           Returns a MassMatrix instance. The transformation may not be
+           mass-weighted.
+        """
+        if self.weighted:
+            raise Exception("The transformation is already weighted.")
+        if self.atom_division is None:
+            masses3_transformed = masses3
+            mass_diag = numpy.zeros(0, float)
+        else:
+            masses3_transformed = masses3[_cartesian_indices(self.atom_division.transformed)]
+            mass_diag = masses3[_cartesian_indices(self.atom_division.free)]
+        if self.matrix.shape[1] == 0:
+            return MassMatrix(mass_diag)
+        if _is_sparse(self.matrix):
+            from scipy.sparse import diags
+            mass_block = _dense(self.matrix.transpose().dot(diags(masses3_transformed, 0).dot(self.matrix)))
+        else:
+            mass_block = numpy.dot(self.matrix.transpose(), self.matrix*masses3_transformed.reshape((-1,1)))
+        if len(mass_diag) == 0:
+            return MassMatrix(mass_block)
+        return MassMatrix(mass_block, mass_diag)
+
+
+class BlockTransform(Transform):
+    """A transformation from block parameters to Cartesian coordinates.
+
+       The Cartesian displacement of each atom only depends on the parameters of
+       the block to which the atom belongs (or on its own three parameters when
+       the atom is free), see :class:`MBH`. The transformation is never stored
+       as a dense matrix, it is applied atom by atom.
+    """
+
+    def __init__(self, values, offsets, num_params, right=None):
+        """
+           Arguments:
+             | ``values`` -- an array with shape (N,3,6): for each atom, the
+                             derivatives of its Cartesian coordinates towards
+                             the (at most six) parameters of its block. Unused
+                             columns must be zero.
+             | ``offsets`` -- an array with N integers: the index of the first
+                              parameter of the block of each atom.
+             | ``num_params`` -- the total number of block parameters
+
+           Optional argument:
+             | ``right`` -- a dense or sparse (scipy.sparse) matrix that is
+                            applied to the parameters first, e.g. to impose
+                            constraints. [default=identity]
+
+           Attributes:
+             | ``values``, ``offsets``, ``num_params``, ``right`` -- see above
+             | ``matrix`` -- the transformation as a dense matrix, only
+                             computed when requested
+        """
+        self.values = values
+        self.offsets = offsets
+        self.num_params = num_params
+        self.right = right
+        if right is None:
+            self._num_reduced = self.num_params
+        else:
+            self._num_reduced = right.shape[1]
+        self.atom_division = None
+        self.scalars = None
+        self._weighted = False
+
+    def get_matrix(self):
+        """Return the transformation as a dense 3N x M matrix"""
+        return self(numpy.identity(self._num_reduced, float))
+
+    matrix = property(get_matrix)
+
+    def __call__(self, modes):
+        """See :meth:`Transform.__call__`"""
+        # Quality Assurance:
+        if len(modes.shape) != 2:
+            raise ValueError("Modes must be a two-dimensional array.")
+        if modes.shape[0] != self._num_reduced:
+            raise ValueError("The modes argument must be an array with %i rows, got %i." %
+                (self._num_reduced, modes.shape[0])
+            )
+        # Computation
+        if self.right is not None:
+            modes = self.right.dot(modes)
+        # pad with zeros for the unused columns of the last block
+        padded = numpy.zeros((self.num_params+6, modes.shape[1]), float)
+        padded[:self.num_params] = modes
+        params = padded[self.offsets.reshape((-1,1)) + numpy.arange(6)]
+        result = numpy.einsum('niw,nwk->nik', self.values, params)
+        return result.reshape((-1, modes.shape[1]))
+
+    def make_weighted(self, mass_matrix):
+        """See :meth:`Transform.make_weighted`"""
+        if self.weighted:
+            raise Exception("The transformation is already weighted.")
+        if len(mass_matrix.mass_diag) > 0:
+            raise NotImplementedError("A BlockTransform can only be weighted with a full mass block.")
+        if self.right is None:
+            self.right = mass_matrix.mass_block_inv_sqrt
+        else:
+            self.right = self.right.dot(mass_matrix.mass_block_inv_sqrt)
+        self._weighted = True
+
+    def get_mass_matrix(self, masses3):
+        """See :meth:`Transform.get_mass_matrix`"""
+        if self.weighted:
+            raise Exception("The transformation is already weighted.")
+        mass_block = _block_mass_matrix(self.values, self.offsets, masses3, self.num_params)
+        if self.right is not None:
+            mass_block = _congruence(self.right, mass_block)
+        return MassMatrix(mass_block)
+
+    def embed(self, atoms, num_atoms):
+        """Return a transformation for a larger system, in which the other atoms are fixed
+
+           Arguments:
+             | ``atoms`` -- the indices of the current atoms in the larger system
+             | ``num_atoms`` -- the number of atoms in the larger system
+        """
+        if self.weighted:
+            raise Exception("The transformation is already weighted.")
+        values = numpy.zeros((num_atoms, 3, 6), float)
+        values[atoms] = self.values
+        offsets = numpy.zeros(num_atoms, int)
+        offsets[atoms] = self.offsets
+        return BlockTransform(values, offsets, self.num_params, self.right)
 
 class MassMatrix(object):
     """A clever mass matrix object. It is sparse when atom coordinates remain
@@ -482,6 +777,13 @@ class MassMatrix(object):
         self.mass_diag_inv_sqrt = 1/numpy.sqrt(self.mass_diag)
 
     def get_weighted_hessian(self, hessian):
+        if _is_sparse(hessian):
+            if len(self.mass_block) == 0:
+                # diagonal mass matrix: the result remains sparse
+                from scipy.sparse import diags
+                scale = diags(self.mass_diag_inv_sqrt, 0)
+                return scale.dot(hessian).dot(scale)
+            hessian = hessian.toarray()
         hessian_mw = numpy.zeros(hessian.shape,float)
         n = len(self.mass_block)
         # transform block by block:
@@ -498,7 +800,15 @@ class Treatment(object):
        compute_zeros and compute_hessian methods. Parameters specific for the
        treatment are passed to the constructor, see for example the PHVA
        implementation.
+
+       Derived classes set the class attribute ``mass_independent`` to True
+       when the reduced Hessian and the (unweighted) transform do not depend on
+       the masses of the atoms and when the reduced mass matrix is
+       ``T^T M T``, where T is the transform and M the Cartesian mass matrix.
+       The results of such treatments are reused for all isotopologues in
+       :meth:`NMA.isotopologues`.
     """
+    mass_independent = False
 
     def __init__(self):
         self.hessian_small = None
@@ -562,6 +872,8 @@ class Full(Treatment):
     """A full vibrational analysis, without transforming to a new set of
        coordinates.
     """
+    mass_independent = True
+
     def __init__(self, im_threshold=1.0):
         """
            Optional argument:
@@ -624,7 +936,7 @@ class ConstrainExt(Treatment):
        gradient is zero.
     """
 
-    def __init__(self, gradient_threshold=1e-4, im_threshold=1.0):
+    def __init__(self, gradient_threshold=1e-4, im_threshold=1.0, projector=False):
         """
            Optional arguments:
             | ``gradient_threshold`` -- The maximum allowed value of the
@@ -635,18 +947,41 @@ class ConstrainExt(Treatment):
             | ``im_threshold`` -- Threshold for detection of deviations from
                                   linearity. When a moment of inertia is below
                                   this threshold, it is treated as a zero.
+            | ``projector`` -- When True, the external degrees of freedom are
+                               projected out of the full Hessian instead of
+                               transforming it to a basis of internal
+                               coordinates. The frequencies of the external
+                               degrees of freedom are then exactly zero and
+                               they are included in the results, just like
+                               with the Full treatment. This avoids a dense
+                               3Nx3N SVD and a dense basis for the internal
+                               coordinates. [default=False]
         """
         self.gradient_threshold = gradient_threshold
         self.im_threshold = im_threshold
+        self.projector = projector
         Treatment.__init__(self)
 
     def compute_zeros(self, molecule, do_modes):
         """See :meth:`Treatment.compute_zeros`.
 
            The number of zeros is set to 0, because the global translations
-           and rotations are already projected out.
+           and rotations are already projected out. With the projector, the
+           external degrees of freedom remain present as exact zeros.
         """
-        self.num_zeros = 0
+        if self.projector:
+            external_basis = self._get_external_basis(molecule)
+            self.num_zeros = external_basis.shape[0]
+            if do_modes:
+                self.external_basis = external_basis
+        else:
+            self.num_zeros = 0
+
+    def _get_external_basis(self, molecule):
+        """Orthonormal rows that span the mass-weighted external degrees of freedom"""
+        external_basis = molecule.get_external_basis_new(self.im_threshold)*numpy.sqrt(molecule.masses3)
+        U, W, Vt = numpy.linalg.svd(external_basis, full_matrices=False)
+        return Vt
 
     def compute_hessian(self, molecule, do_modes):
         """See :meth:`Treatment.compute_hessian`
@@ -670,6 +1005,9 @@ class ConstrainExt(Treatment):
                     gradmax, self.gradient_threshold
                 )
             )
+        if self.projector:
+            self._compute_hessian_projector(molecule, do_modes)
+            return
         # project the hessian on the orthogonal complement of the basis of small
         # displacements in the external degrees of freedom.
         external_basis = molecule.get_external_basis_new(self.im_threshold)
@@ -677,13 +1015,40 @@ class ConstrainExt(Treatment):
         rank = external_basis.shape[0]
         internal_basis_mw = (Vt[rank:]/numpy.sqrt(molecule.masses3)).transpose()
         # the following hessian is already mass-weighted;
-        self.hessian_small = numpy.dot(internal_basis_mw.transpose(), numpy.dot(molecule.hessian, internal_basis_mw))
+        self.hessian_small = numpy.dot(internal_basis_mw.transpose(), molecule.hessian.dot(internal_basis_mw))
         # we do not define mass_matrix_small since it is useless when the hessian
         # is already mass-weighted
         if do_modes:
             # also mass-weighted because the hessian is mass-weighted too:
             self.transform = Transform(internal_basis_mw)
 
+    def _compute_hessian_projector(self, molecule, do_modes):
+        """Project the external degrees of freedom out of the full Hessian.
+
+           With the orthonormal basis E for the external degrees of freedom in
+           mass-weighted coordinates, the projector is ``P = 1 - E E^T``. The
+           projected mass-weighted Hessian ``P H_mw P`` is expressed in
+           non-mass-weighted coordinates such that the mass matrix and the
+           transform of the Full treatment can be used:
+           ``Q^T H Q`` with ``Q = 1 - F G^T``, ``F = M^-1/2 E`` and
+           ``G = M^1/2 E``. This is worked out as one update of rank 2r (with r
+           the number of external degrees of freedom): ``H - G A^T - A G^T``
+           with ``A = H F - G (F^T H F)/2``.
+        """
+        external_basis = self._get_external_basis(molecule).transpose()
+        sqrt_masses3 = numpy.sqrt(molecule.masses3).reshape((-1,1))
+        F = external_basis/sqrt_masses3
+        G = external_basis*sqrt_masses3
+        HF = molecule.hessian.dot(F)
+        A = HF - 0.5*numpy.dot(G, numpy.dot(F.transpose(), HF))
+        hessian = numpy.array(_dense(molecule.hessian), float)
+        hessian -= numpy.dot(numpy.hstack([G, A]), numpy.hstack([A, G]).transpose())
+        self.hessian_small = hessian
+        self.mass_matrix_small = MassMatrix(molecule.masses3)
+        if do_modes:
+            atom_division = AtomDivision([], numpy.arange(molecule.size), [])
+            self.transform = Transform(None, atom_division)
+
 
 class PHVA(Treatment):
     """Perform the partial Hessian vibrational analysis.
@@ -700,6 +1065,8 @@ class PHVA(Treatment):
        - H. Li and J. Jensen, Theor. Chem. Acc. 107, 211 (2002)
 
     """
+    mass_independent = True
+
     def __init__(self, fixed, svd_threshold=1e-5):
         """
            Argument:
@@ -778,7 +1145,7 @@ class PHVA(Treatment):
                 free3[counter_free*3+2] = i*3+2
                 counter_free += 1
 
-        self.hessian_small = molecule.hessian[free3][:,free3]
+        self.hessian_small = _submatrix(molecule.hessian, free3, free3)
         masses3_small = molecule.masses3[free3]
         self.mass_matrix_small = MassMatrix(masses3_small)
         if do_modes:
@@ -801,23 +1168,38 @@ class VSA(Treatment):
     atoms are allowed to vibrate, while the environment atoms follow the motions
     of the subsystem atoms. The environment atoms are force free.
     """
-    def __init__(self, subs, svd_threshold=1e-5):
+    mass_independent = True
+
+    def __init__(self, subs, svd_threshold=1e-5, solver='direct', cg_tolerance=1e-10):
         """
            One argument:
             | ``subs`` -- a list with the subsystem atoms, counting starts from
                           zero.
 
-           Optional argument:
+           Optional arguments:
             | ``svd_threshold`` -- threshold for detection of deviations for
                                    linearity
+            | ``solver`` -- the method to solve H_ee X = H_es. 'direct': a
+                            Cholesky factorization of a dense H_ee (LDL^T when
+                            H_ee is not positive definite) or a sparse LU
+                            factorization of a sparse H_ee. 'cg': conjugate
+                            gradients with a block-Jacobi preconditioner, which
+                            only needs products with H_ee. This requires a
+                            positive definite H_ee. [default='direct']
+            | ``cg_tolerance`` -- the relative residual at which the conjugate
+                                  gradients are converged [default=1e-10]
         """
         # QA:
         if len(subs) == 0:
             raise ValueError("At least one subsystem atom is required.")
+        if solver not in ('direct', 'cg'):
+            raise ValueError("The solver must be 'direct' or 'cg', got %s." % solver)
         # Rest of init:
         self.subs = numpy.array(subs)
         #self.subs.sort()
         self.svd_threshold = svd_threshold
+        self.solver = solver
+        self.cg_tolerance = cg_tolerance
         Treatment.__init__(self)
 
     def compute_zeros(self, molecule, do_modes):
@@ -831,8 +1213,8 @@ class VSA(Treatment):
         - 3 in periodic calculations
         """
         # determine nb of zeros
-        subs3 = sum([[3*at, 3*at+1, 3*at+2] for at in self.subs],[])
-        U, W, Vt = numpy.linalg.svd(numpy.take(molecule.external_basis,subs3,1), full_matrices=False)
+        subs3 = _cartesian_indices(self.subs)
+        U, W, Vt = numpy.linalg.svd(molecule.external_basis[:,subs3], full_matrices=False)
         rank = (abs(W) > abs(W[0])*self.svd_threshold).sum()
         self.num_zeros = rank
 
@@ -875,20 +1257,16 @@ class VSA(Treatment):
         where the indices ``s`` and ``e`` refer to the subsystem and environment
         atoms respectively.
         """
-        # fill lists with subsystem/environment atoms/coordinates
-        subs = self.subs.tolist()
-        envi = sum([[at] for at in xrange(molecule.size) if at not in subs],[])
-        subs3 = sum([[3*at, 3*at+1, 3*at+2] for at in subs],[])
-        envi3 = sum([[3*at, 3*at+1, 3*at+2] for at in xrange(molecule.size) if at not in subs],[])
+        # fill arrays with subsystem/environment atoms/coordinates
+        mask = numpy.ones(molecule.size, bool)
+        mask[self.subs] = False
+        envi = mask.nonzero()[0]
+        subs3 = _cartesian_indices(self.subs)
+        envi3 = _cartesian_indices(envi)
 
         # 1. Construct Hessian (small: 3Nsubs x 3Nsubs)
-        # construct H_ss, H_ee, H_es
-        hessian_ss = numpy.take(numpy.take(molecule.hessian,subs3,0), subs3,1)
-        hessian_ee = numpy.take(numpy.take(molecule.hessian,envi3,0), envi3,1)
-        hessian_es = numpy.take(numpy.take(molecule.hessian,envi3,0), subs3,1)
-        # construct H_ee**-1 and H_ee**-1 . H_es
-        hessian_e1 = numpy.linalg.inv(hessian_ee)
-        hessian_e1_es = numpy.dot(hessian_e1,hessian_es)
+        # construct H_ss, H_es and H_ee**-1 . H_es
+        hessian_ss, hessian_es, hessian_e1_es = _vsa_blocks(molecule.hessian, subs3, envi3, self.solver, self.cg_tolerance)
         # construct H_ss - H_se . H_ee**-1 . H_es
         self.hessian_small = hessian_ss - numpy.dot( hessian_es.transpose(), hessian_e1_es)
 
@@ -896,7 +1274,6 @@ class VSA(Treatment):
         # with corrected mass matrix
         masses3_subs = molecule.masses3[subs3]               # masses subsystem
         masses3_envi = molecule.masses3[envi3]               # masses environment
-        tempmat = numpy.zeros((len(envi3),len(subs3)),float) # temporary matrix
 
         # construct   M_e . H_ee**-1 . H_es
         tempmat = masses3_envi.reshape((-1,1))*hessian_e1_es
@@ -908,7 +1285,7 @@ class VSA(Treatment):
         self.mass_matrix_small = MassMatrix( massmatrixsmall )
 
         if do_modes:
-            atom_division = AtomDivision(envi+subs,[],[])
+            atom_division = AtomDivision(numpy.concatenate([envi, self.subs]),[],[])
             self.transform = Transform( numpy.concatenate( (- hessian_e1_es, numpy.identity(len(subs3))),0), atom_division)
 
 
@@ -932,23 +1309,36 @@ class VSANoMass(Treatment):
     This version of VSA corresponds to the approximation
     of zero mass for all environment atoms.
     """
-    def __init__(self, subs, svd_threshold=1e-5):
+    def __init__(self, subs, svd_threshold=1e-5, solver='direct', cg_tolerance=1e-10):
         """
            One argument:
             | ``subs`` -- a list with the subsystem atoms, counting starts from
                           zero.
 
-           Optional argument:
+           Optional arguments:
             | ``svd_threshold`` -- threshold for detection of deviations for
                                    linearity
+            | ``solver`` -- the method to solve H_ee X = H_es. 'direct': a
+                            Cholesky factorization of a dense H_ee (LDL^T when
+                            H_ee is not positive definite) or a sparse LU
+                            factorization of a sparse H_ee. 'cg': conjugate
+                            gradients with a block-Jacobi preconditioner, which
+                            only needs products with H_ee. This requires a
+                            positive definite H_ee. [default='direct']
+            | ``cg_tolerance`` -- the relative residual at which the conjugate
+                                  gradients are converged [default=1e-10]
         """
         # QA:
         if len(subs) == 0:
             raise ValueError("At least one subsystem atom is required.")
+        if solver not in ('direct', 'cg'):
+            raise ValueError("The solver must be 'direct' or 'cg', got %s." % solver)
         # Rest of init:
         self.subs = numpy.array(subs)
         #self.subs.sort()
         self.svd_threshold = svd_threshold
+        self.solver = solver
+        self.cg_tolerance = cg_tolerance
         Treatment.__init__(self)
 
     def compute_zeros(self, molecule, do_modes):
@@ -963,8 +1353,8 @@ class VSANoMass(Treatment):
         - 3 in periodic calculations
         """
         # determine nb of zeros
-        subs3 = sum([[3*at, 3*at+1, 3*at+2] for at in self.subs],[])
-        U, W, Vt = numpy.linalg.svd(numpy.take(molecule.external_basis,subs3,1), full_matrices=False)
+        subs3 = _cartesian_indices(self.subs)
+        U, W, Vt = numpy.linalg.svd(molecule.external_basis[:,subs3], full_matrices=False)
         rank = (abs(W) > abs(W[0])*self.svd_threshold).sum()
         self.num_zeros = rank
 
@@ -1007,29 +1397,25 @@ class VSANoMass(Treatment):
         where the indices ``s`` and ``e`` refer to the subsystem and environment
         atoms respectively.
         """
-        # fill lists with subsystem/environment atoms/coordinates
-        subs = self.subs.tolist()
-        envi = sum([[at] for at in xrange(molecule.size) if at not in subs],[])
-        subs3 = sum([[3*at, 3*at+1, 3*at+2] for at in subs],[])
-        envi3 = sum([[3*at, 3*at+1, 3*at+2] for at in xrange(molecule.size) if at not in subs],[])
+        # fill arrays with subsystem/environment atoms/coordinates
+        mask = numpy.ones(molecule.size, bool)
+        mask[self.subs] = False
+        envi = mask.nonzero()[0]
+        subs3 = _cartesian_indices(self.subs)
+        envi3 = _cartesian_indices(envi)
 
         # 1. Construct Hessian (small: 3Nsubs x 3Nsubs)
-        # construct H_ss, H_ee, H_es
-        hessian_ss = numpy.take(numpy.take(molecule.hessian,subs3,0), subs3,1)
-        hessian_ee = numpy.take(numpy.take(molecule.hessian,envi3,0), envi3,1)
-        hessian_es = numpy.take(numpy.take(molecule.hessian,envi3,0), subs3,1)
-        # construct H_ee**-1 and H_ee**-1 . H_es
-        hessian_e1 = numpy.linalg.inv(hessian_ee)
-        hessian_e1_es = numpy.dot(hessian_e1,hessian_es)
+        # construct H_ss, H_es and H_ee**-1 . H_es
+        hessian_ss, hessian_es, hessian_e1_es = _vsa_blocks(molecule.hessian, subs3, envi3, self.solver, self.cg_tolerance)
         # construct H_ss - H_se . H_ee**-1 . H_es
         self.hessian_small = hessian_ss - numpy.dot( hessian_es.transpose(), hessian_e1_es)
 
         # 2. Construct mass matrix (small: 3Nsubs x 3Nsubs)
         # with plain submatrix M_s
-        self.mass_matrix_small = MassMatrix( numpy.diag(numpy.take(molecule.masses3,subs3)) )
+        self.mass_matrix_small = MassMatrix( numpy.diag(molecule.masses3[subs3]) )
 
         if do_modes:
-            atom_division = AtomDivision(envi+subs,[],[])
+            atom_division = AtomDivision(numpy.concatenate([envi, self.subs]),[],[])
             self.transform = Transform( numpy.concatenate( (- hessian_e1_es, numpy.identity(len(subs3))),0), atom_division)
 
 
@@ -1077,6 +1463,8 @@ class MBH(Treatment):
     block should be optimized. This make MBH an appropriate method to perform
     NMA in partially optimized structures.
     """
+    mass_independent = True
+
     def __init__(self, blocks, do_gradient_correction=True, svd_threshold=1e-5):
         """
            One argument:
@@ -1180,10 +1568,12 @@ class MBH(Treatment):
         mbhdim1 = 6*blkinfo.nb_nlin + 5*blkinfo.nb_lin + 3*len(blkinfo.free)
 
         # TRANSFORM from CARTESIAN to BLOCK PARAMETERS
-        U = self._construct_U(molecule,mbhdim1,blkinfo)
+        # U is never constructed as a dense matrix. For each atom, only its
+        # 3x6 block of U and the first column of that block are stored.
+        values, offsets = self._construct_U(molecule,blkinfo)
 
         # Construct Hessian in block parameters: Hp = U**T . H . U + correction
-        Hp = numpy.dot(numpy.dot( U.transpose(), molecule.hessian) , U)
+        Hp = _mbh_hessian(molecule.hessian, values, offsets, mbhdim1)
 
         # gradient correction
         if self.do_gradient_correction:
@@ -1222,15 +1612,15 @@ class MBH(Treatment):
                 Hp[col:(col+dim),col:(col+dim)] += numpy.take(numpy.take(corr,alphas,0),alphas,1)
 
         # Construct mass matrix in block parameters: Mp = U**T . M . U
-        Mp = numpy.dot(U.transpose(),  U * molecule.masses3.reshape((-1,1)))
+        Mp = _block_mass_matrix(values, offsets, molecule.masses3, mbhdim1)
 
         if blkinfo.is_linked:
             # SECOND TRANSFORM: from BLOCK PARAMETERS to Y VARIABLES
             # Necessary if blocks are linked to each other.
             nullspace = self._construct_nullspace_K(molecule,mbhdim1,blkinfo)
 
-            My = numpy.dot(nullspace.transpose(), numpy.dot( Mp,nullspace) )
-            Hy = numpy.dot(nullspace.transpose(), numpy.dot( Hp,nullspace) )
+            My = _congruence(nullspace, Mp)
+            Hy = _congruence(nullspace, Hp)
 
             # TODO
             # gradient correction of the second transform...
@@ -1240,11 +1630,11 @@ class MBH(Treatment):
             if not blkinfo.is_linked:
                 self.hessian_small = Hp
                 self.mass_matrix_small = MassMatrix(Mp)
-                self.transform = Transform(U)
+                self.transform = BlockTransform(values, offsets, mbhdim1)
             else:
                 self.hessian_small = Hy
                 self.mass_matrix_small = MassMatrix(My)
-                self.transform = Transform(numpy.dot(U, nullspace))
+                self.transform = BlockTransform(values, offsets, mbhdim1, nullspace)
         else:
             if not blkinfo.is_linked:
                 self.hessian_small = Hp
@@ -1253,85 +1643,158 @@ class MBH(Treatment):
                 self.hessian_small = Hy
                 self.mass_matrix_small = MassMatrix(My)
 
-    def _construct_U(self,molecule,mbhdim1,blkinfo):
-        # Construct first transformation matrix
+    def _construct_U(self,molecule,blkinfo):
+        # Construct first transformation matrix in block form: for each atom,
+        # the 3x6 block with the derivatives of its Cartesian coordinates
+        # towards the block parameters, and the index of the first parameter.
+        # Linear blocks and free atoms only use the first five or three columns.
         D = transrot_basis(molecule.coordinates)   # is NOT mass-weighted
+        D = D.reshape((6, molecule.size, 3)).transpose(1,2,0)
 
-        U = numpy.zeros((3*molecule.size, mbhdim1),float)
+        values = numpy.zeros((molecule.size, 3, 6), float)
+        offsets = numpy.zeros(molecule.size, int)
 
         for b,block in enumerate(blkinfo.blocks_nlin_strict):
-            for at in block:
-                for alpha in range(6):
-                    U[3*at:3*(at+1), 6*b+alpha] = D[alpha,3*at:3*(at+1)]
+            values[block] = D[block]
+            offsets[block] = 6*b
 
         for b,block in enumerate(blkinfo.blocks_lin_strict):
-            for at in block:
-                alphas = [index for index in range(6) if index != blkinfo.skip_axis_lin[b]]
-                for i,alpha in enumerate(alphas):
-                    col = 6*blkinfo.nb_nlin + 5*b + i
-                    U[3*at:3*(at+1), col] = D[alpha,3*at:3*(at+1)]
+            alphas = [index for index in range(6) if index != blkinfo.skip_axis_lin[b]]
+            values[block,:,:5] = D[block][:,:,alphas]
+            offsets[block] = 6*blkinfo.nb_nlin + 5*b
 
-        for i,at in enumerate(blkinfo.free):
-            for mu in range(3):
-                U[3*at+mu, 6*blkinfo.nb_nlin+5*blkinfo.nb_lin+3*i +mu] = 1.0
-        return U
+        free = numpy.array(blkinfo.free, int)
+        values[free,:,:3] = numpy.identity(3)
+        offsets[free] = 6*blkinfo.nb_nlin + 5*blkinfo.nb_lin + 3*numpy.arange(len(free))
+        return values, offsets
 
     def _construct_nullspace_K(self,molecule,mbhdim1,blkinfo):
         # SECOND TRANSFORM: from BLOCK PARAMETERS to Y VARIABLES
         # Necessary if blocks are linked to each other.
-            # Construct K matrix, with constraints
-            D = transrot_basis(molecule.coordinates)   # is NOT mass-weighted
-            nbrows = (numpy.sum(blkinfo.sharenbs)-molecule.size)*3
-            K = numpy.zeros(( nbrows, mbhdim1-3*len(blkinfo.free)), float)
-            row = 0
-            for (at,apps) in blkinfo.appearances.iteritems():
-                if len(apps) >= 2:
-                    # the first block
-                    b0 = apps[0]
-                    D0 = D[:,3*at:3*(at+1)]
-
-                    if b0 < blkinfo.nb_nlin:  # if b0 is nonlinear block
-                        sta0 = 6*b0
-                        end0 = 6*(b0+1)
-                        D0 = D[:,3*at:3*(at+1)]
-
-                    else:   # if b0 is a linear block
-                        b0 = b0 - blkinfo.nb_nlin     # reset
-                        sta0 = 6*blkinfo.nb_nlin + 5*b0       # offset
-                        end0 = 6*blkinfo.nb_nlin + 5*(b0+1)
-                        alphas = [index for index in range(6) if index != blkinfo.skip_axis_lin[b0]]
-                        D0 = numpy.take(D[:,3*at:3*(at+1)],alphas,0)
-
-                    for b1 in apps[1:]:
-                        # add 3 rows to K, for each block connected to b0
-                        K[row:row+3, sta0:end0] = D0.transpose()
-
-                        if b1 < blkinfo.nb_nlin:  # if b1 is nonlinear block
-                            sta1 = 6*b1
-                            end1 = 6*(b1+1)
-                            D1 = D[:,3*at:3*(at+1)]
-
-                        else:   # if b1 is a linear block
-                            b1 = b1 - blkinfo.nb_nlin     # reset
-                            sta1 = 6*blkinfo.nb_nlin + 5*b1       # offset
-                            end1 = 6*blkinfo.nb_nlin + 5*(b1+1)
-                            alphas = [index for index in range(6) if index != blkinfo.skip_axis_lin[b1]]
-                            D1 = numpy.take(D[:,3*at:3*(at+1)],alphas,0)
-
-                        K[row:row+3,sta1:end1] = -D1.transpose()
-                        row += 3
-
-            # Do SVD of matrix K
-            u,s,vh = numpy.linalg.svd(K)
-
-            # construct nullspace of K
-            rank = sum(s>max(s)*self.svd_threshold)
-            nullspace = vh[rank:,:].transpose()
-            [r_null,c_null] = nullspace.shape
-            n = numpy.zeros((mbhdim1,c_null+3*len(blkinfo.free)),float)
-            n[:r_null,:c_null] = nullspace
-            n[r_null:,c_null:] = numpy.identity(3*len(blkinfo.free),float)
-            return n
+        #
+        # The linking constraints K require that the copies of a shared atom
+        # in different blocks move identically. The null space of K is built
+        # block by block (a block elimination along the chains of linked
+        # blocks): the parameters of a new block are expressed in terms of the
+        # Y variables introduced so far (through the atoms it shares with the
+        # previous blocks), and a few new Y variables. Only small SVDs of the
+        # constraints of a single block are needed. The result is returned as
+        # a sparse matrix.
+        #
+        # Internally, the rotations of each block are taken about the center of
+        # the block, which makes the rank decisions independent of the position
+        # of the origin. At the end, the null space is transformed back to the
+        # block parameters used for the matrix U.
+        from scipy.sparse import coo_matrix, block_diag, identity
+        centers = [molecule.coordinates[list(block)].mean(axis=0) for block in blkinfo.blocks]
+        def local_basis(at, b):
+            # derivatives of the Cartesian coordinates of atom at towards
+            # the local parameters of block b
+            return transrot_basis((molecule.coordinates[at] - centers[b]).reshape((1,3)))[alphas[b]].transpose()
+
+        # offsets and parameter indices for each block
+        offsets = []
+        alphas = []
+        for b in xrange(len(blkinfo.blocks)):
+            if b < blkinfo.nb_nlin:   # nonlinear block
+                offsets.append(6*b)
+                alphas.append(range(6))
+            else:                     # linear block
+                offsets.append(6*blkinfo.nb_nlin + 5*(b-blkinfo.nb_nlin))
+                alphas.append([index for index in range(6) if index != blkinfo.skip_axis_lin[b-blkinfo.nb_nlin]])
+
+        # The rows of the null space that belong to one block are stored as a
+        # dense array, together with the index of the first column. All other
+        # columns are zero. Independent chains of linked blocks therefore have
+        # no nonzero columns in common.
+        firsts = numpy.zeros(len(blkinfo.blocks), int)
+        rows = [None]*len(blkinfo.blocks)
+        def get_rows(b, begin, end):
+            # the rows of block b, for the columns in range(begin, end)
+            result = numpy.zeros((len(alphas[b]), end-begin), float)
+            width = rows[b].shape[1]
+            lo = max(firsts[b], begin)
+            hi = min(firsts[b]+width, end)
+            if hi > lo:
+                result[:,lo-begin:hi-begin] = rows[b][:,lo-firsts[b]:hi-firsts[b]]
+            return result
+
+        ncols = 0   # the number of Y variables so far
+        for b,block in enumerate(blkinfo.blocks):
+            dim = len(alphas[b])
+            # the blocks linked to the previous blocks through shared atoms
+            links = [(at, blkinfo.appearances[at][0]) for at in block if blkinfo.appearances[at][0] < b]
+            if len(links) == 0:
+                # a block without links to previous blocks
+                firsts[b] = ncols
+                rows[b] = numpy.identity(dim)
+                ncols += dim
+                continue
+            first = min(firsts[b0] for at, b0 in links)
+
+            # collect the constraints with the previous blocks: A.y + B.p = 0,
+            # where y are the Y variables and p are the parameters of block b
+            A = []
+            B = []
+            for at, b0 in links:
+                A.append(numpy.dot(local_basis(at, b0), get_rows(b0, first, ncols)))
+                B.append(-local_basis(at, b))
+            A = numpy.concatenate(A)
+            B = numpy.concatenate(B)
+
+            # p = - V1 . S1**-1 . U1**T . A . y + V2 . z, where z are new Y variables
+            u,s,vh = numpy.linalg.svd(B)
+            rank = (s > s[0]*self.svd_threshold).sum()
+            firsts[b] = first
+            rows[b] = numpy.concatenate([
+                -numpy.dot(vh[:rank].transpose()/s[:rank], numpy.dot(u[:,:rank].transpose(), A)),
+                vh[rank:].transpose(),
+            ], axis=1)
+
+            # the remaining constraints only involve the previous Y variables.
+            # They are only relevant for closed loops of blocks.
+            R = numpy.dot(u[:,rank:].transpose(), A)
+            old = ncols
+            ncols += dim-rank
+            if R.size > 0:
+                u,s_R,vh = numpy.linalg.svd(R, full_matrices=False)
+                rank = (s_R > s[0]*self.svd_threshold).sum()
+                if rank > 0:
+                    # restrict the previous Y variables to the null space of R
+                    q = numpy.linalg.qr(vh[:rank].transpose(), mode='complete')[0]
+                    for b1 in xrange(b+1):
+                        if firsts[b1] + rows[b1].shape[1] > first:
+                            begin = min(firsts[b1], first)
+                            tmp = get_rows(b1, begin, ncols)
+                            rows[b1] = numpy.concatenate([
+                                tmp[:,:first-begin],
+                                numpy.dot(tmp[:,first-begin:old-begin], q[:,rank:]),
+                                tmp[:,old-begin:],
+                            ], axis=1)
+                            firsts[b1] = begin
+                    ncols -= rank
+
+        # assemble the sparse null space
+        indices_row = []
+        indices_col = []
+        values = []
+        for b in xrange(len(blkinfo.blocks)):
+            # transform from rotations about the center to rotations about the
+            # origin: only the translations change.
+            shift = numpy.identity(6)
+            shift[:3,3:] = -transrot_basis(centers[b].reshape((1,3)))[3:].transpose()
+            rows[b] = numpy.dot(shift[alphas[b]][:,alphas[b]], rows[b])
+            i, j = rows[b].nonzero()
+            indices_row.append(i + offsets[b])
+            indices_col.append(j + firsts[b])
+            values.append(rows[b][i,j])
+        nbparams = mbhdim1-3*len(blkinfo.free)
+        nullspace = coo_matrix((
+            numpy.concatenate(values), (numpy.concatenate(indices_row), numpy.concatenate(indices_col))
+        ), (nbparams, ncols))
+
+        # add the free atoms
+        return block_diag([nullspace, identity(3*len(blkinfo.free))], format='csr')
 
 
 class MBHConstrainExt(MBH):
@@ -1355,7 +1818,7 @@ class MBHConstrainExt(MBH):
         for i in range(D.shape[1]):
             D[:,i] /= numpy.sqrt(numpy.sum(D[:,i]**2))
         proj = numpy.identity(D.shape[0]) - numpy.dot(D,D.transpose())
-        hessian = numpy.dot(proj,molecule.hessian)
+        hessian = numpy.dot(proj,_dense(molecule.hessian))
         gradient = (numpy.dot(proj,molecule.gradient.reshape(3*molecule.size,-1))).reshape(molecule.size,3)
         # construct a new Molecule instance
         mol = Molecule(molecule.numbers, molecule.coordinates, molecule.masses,
@@ -1573,7 +2036,7 @@ class PHVA_MBH(MBH):
             numpy.take(molecule.masses, selectedatoms),
             molecule.energy,
             numpy.take(molecule.gradient,selectedatoms,0),
-            numpy.take(numpy.take(molecule.hessian,selectedcoords,0),selectedcoords,1),
+            _submatrix(molecule.hessian, selectedcoords, selectedcoords),
             molecule.multiplicity,
             0, # undefined molecule.symmetry_number
             molecule.periodic
@@ -1590,19 +2053,18 @@ class PHVA_MBH(MBH):
         MBH.compute_hessian(self, submolecule, do_modes)
 
         if do_modes:   # adapt self.transform to include the fixed atom rows/cols
-            transf = numpy.zeros((3*molecule.size, self.transform.matrix.shape[1]),float)
-            transf[selectedcoords,:] = self.transform.matrix
-            self.transform = Transform(transf)
+            self.transform = self.transform.embed(selectedatoms, molecule.size)
 
 
 class Constrain(Treatment):
     """Perform a normal mode analysis where part of the internal coordinates are
        constrained to a fixed value.
 
-       The gradient corrections are taken into account correctly. At present, only
-       distance constraints are implemented. In principle, the routine can be
-       adapted to angle and dihedral angle constraints.
+       The gradient corrections are taken into account correctly. Distances,
+       bending angles and dihedral angles can be constrained.
     """
+    mass_independent = True
+
     def __init__(self, constraints, do_gradient_correction=True, svd_threshold=1e-5):
         """
            One argument:
@@ -1619,6 +2081,9 @@ class Constrain(Treatment):
         # QA:
         if len(constraints) == 0:
             raise ValueError("At least one constraint is required.")
+        for constraint in constraints:
+            if len(constraint) not in (2, 3, 4):
+                raise ValueError("A constraint must contain two, three or four atoms, got %s." % (constraint,))
         # Rest of init:
         self.constraints = constraints
         self.do_gradient_correction = do_gradient_correction
@@ -1654,19 +2119,13 @@ class Constrain(Treatment):
     def compute_hessian(self, molecule, do_modes):
         """See :meth:`Treatment.compute_hessian`"""
 
-        # make constraint matrix
+        # make constraint matrix: the Wilson B-matrix of the constrained
+        # internal coordinates, with one column per constraint.
+        derivatives = _constraint_derivatives(molecule.coordinates, self.constraints)
         constrmat = numpy.zeros((3*molecule.size,len(self.constraints)))
-        count = 0
-        for i,constraint in enumerate(self.constraints):
-            # constrain a distance
-            if len(constraint) == 2:
-                at1 = constraint[0]
-                at2 = constraint[1]
-                dist = numpy.sqrt(numpy.sum((molecule.coordinates[at1] - molecule.coordinates[at2])**2))
-                dist = 1.0
-                constrmat[3*at1:3*at1+3, count] = (molecule.coordinates[at1] - molecule.coordinates[at2])/dist
-                constrmat[3*at2:3*at2+3, count] = (molecule.coordinates[at2] - molecule.coordinates[at1])/dist
-                count += 1
+        for indexes, atoms, grad, hess in derivatives:
+            cart = (3*atoms.reshape((len(atoms),-1,1)) + numpy.arange(3)).reshape((len(atoms),-1))
+            constrmat[cart, indexes.reshape((-1,1))] = grad
         # determine the orthogonal complement of the basis of small
         # displacements determined by the constraints.
         U, W, Vt = numpy.linalg.svd(constrmat.transpose(), full_matrices=True)
@@ -1676,58 +2135,518 @@ class Constrain(Treatment):
         # mass matrix small = nullspace^T . M . nullspace
         # hessian     small = nullspace^T . H . nullspace + gradient correction
         self.mass_matrix_small = MassMatrix(numpy.dot(nullspace.transpose(),nullspace * molecule.masses3.reshape((-1,1))) )
-        self.hessian_small     = numpy.dot(nullspace.transpose(), numpy.dot(molecule.hessian, nullspace))
+        self.hessian_small     = numpy.dot(nullspace.transpose(), molecule.hessian.dot(nullspace))
 
         # check if gradient is small enough in this complement: overlap with nullspace should be small enough
         # print  numpy.sum(numpy.dot(nullspace.transpose(), numpy.ravel(molecule.gradient))**2)
 
         if self.do_gradient_correction:
-            self._do_the_gradient_correction(constrmat.transpose(), U,W,Vt, rank, nullspace, molecule.gradient)
+            self._do_the_gradient_correction(U,W,Vt, rank, nullspace, molecule.gradient, derivatives)
 
         if do_modes:
             self.transform = Transform(nullspace)
 
 
-    def _do_the_gradient_correction(self, K,u,s,vh, rank, nullspace, gradient):
-
+    def _do_the_gradient_correction(self, u,s,vh, rank, nullspace, gradient, derivatives):
         # GRADIENT CORRECTION
-        # construct generalized inverse L of K
-        # zero rows for free atoms not included in L
-
-        # construct generalized inverse
-        L = numpy.zeros((K.shape[1],K.shape[0]),float)
-        for i,sigma in enumerate(s[:rank]):
-           L[i,:] = 1/sigma*u[:,i]
-        L = numpy.dot(vh.transpose(),L)
-
-        # construct right hand side of the equation
-        Y = numpy.zeros((K.shape[0],len(self.hessian_small)**2))
-        y = numpy.zeros((K.shape[0],1))
-        count = 0
-        for i in xrange(len(self.hessian_small)):
-            for j in xrange(len(self.hessian_small)):
-                for k,constraint in enumerate(self.constraints):
-                    if len(constraint) == 2:
-                        at1 = constraint[0]
-                        at2 = constraint[1]
-                        dist = 1.0
-                        for a in range(3*at1,3*at1+3):
-                            y[k] += 2 * nullspace[a,i]*nullspace[a,j]/dist
-                        for b in range(3*at2,3*at2+3):
-                            y[k] += 2 * nullspace[b,i]*nullspace[b,j]/dist
-                        for (a,b) in zip(range(3*at1,3*at1+3),range(3*at2,3*at2+3)):
-                            y[k] -= 2 * nullspace[a,i]*nullspace[b,j]/dist
-
-                Y[:,count] = y[:,0]
-                count += 1
-
-        # solve equation
-        X = -numpy.dot(L, Y)
+        # The Cartesian coordinates on the constrained surface are expanded
+        # up to second order in the new coordinates y:
+        #     x = x0 + nullspace . y + 1/2 sum_ij X_ij y_i y_j
+        # The second order terms X_ij are fixed by the constraints:
+        #     K . X_ij = - nullspace_i^T . hess_k . nullspace_j
+        # where K is the B-matrix (one row per constraint) and hess_k the
+        # Cartesian Hessian of constraint k. With the generalized inverse L of K,
+        # X_ij = -L . Y_ij and the gradient contributes g^T . X_ij to the Hessian
+        # in y. The contraction over the Cartesian coordinates is carried out
+        # first: with the multipliers lambda = L^T . g, the correction becomes
+        #     - nullspace^T . (sum_k lambda_k hess_k) . nullspace
+        from scipy.sparse import coo_matrix
+
+        # lambda = L^T . g with the generalized inverse L = V . S^-1 . U^T
+        lagrange = numpy.dot(u[:,:rank], numpy.dot(vh[:rank], numpy.ravel(gradient))/s[:rank])
+
+        # sum of the Hessians of the constraints, weighted with lambda
+        size = nullspace.shape[0]
+        rows = []
+        cols = []
+        values = []
+        for indexes, atoms, grad, hess in derivatives:
+            cart = (3*atoms.reshape((len(atoms),-1,1)) + numpy.arange(3)).reshape((len(atoms),-1))
+            rows.append(numpy.repeat(cart, cart.shape[1], axis=1).ravel())
+            cols.append(numpy.tile(cart, (1, cart.shape[1])).ravel())
+            values.append((hess*lagrange[indexes].reshape((-1,1,1))).ravel())
+        weighted = coo_matrix((
+            numpy.concatenate(values), (numpy.concatenate(rows), numpy.concatenate(cols))
+        ), (size, size)).tocsr()
 
         # apply correction
-        count = 0
-        for i in xrange(len(self.hessian_small)):
-            for j in xrange(len(self.hessian_small)):
+        self.hessian_small -= numpy.dot(nullspace.transpose(), weighted.dot(nullspace))
+
+
+def _diagonalize(hessian, do_modes, num_modes=None, eval_window=None):
+    """Compute (a subset of) the eigenvalues and eigenvectors of a (mass-weighted) Hessian.
+
+       Arguments:
+        | ``hessian`` -- a symmetric matrix (dense or scipy.sparse)
+        | ``do_modes`` -- When False, only the eigenvalues are computed.
+
+       Optional arguments (at most one of both):
+        | ``num_modes`` -- the number of lowest eigenvalues to compute.
+        | ``eval_window`` -- a tuple (lower, upper). Only the eigenvalues in
+                             the half-open interval (lower, upper] are
+                             computed.
+
+       When no optional argument is given, all eigenvalues are computed with a
+       dense solver.
+
+       Returns: the eigenvalues in ascending order and the corresponding
+       eigenvectors (columns) or None if do_modes is False.
+
+       A subset of the spectrum is computed with the Lanczos method
+       (scipy.sparse.linalg.eigsh). Sparse matrices are treated with the
+       shift-invert mode. The shift is put just below the lowest eigenvalue
+       because the (nearly) zero eigenvalues of the external degrees of freedom
+       would make the shifted matrix singular for a shift of zero. Dense
+       matrices are only multiplied with trial vectors, which costs O(n**2) per
+       iteration instead of the O(n**3) of a full diagonalization.
+    """
+    if eval_window is not None:
+        return _diagonalize_window(hessian, do_modes, eval_window)
+    size = hessian.shape[0]
+    if num_modes is None or num_modes >= size-1:
+        hessian = _dense(hessian)
+        if do_modes:
+            return numpy.linalg.eigh(hessian)
+        else:
+            return numpy.linalg.eigvalsh(hessian), None
+
+    if num_modes <= 0:
+        raise ValueError("num_modes must be strictly positive.")
+    from scipy.sparse.linalg import eigsh
+    v0 = _lanczos_start(size)
+    if _is_sparse(hessian):
+        hessian = hessian.tocsc()
+        lowest = eigsh(hessian, 1, which='SA', v0=v0, tol=1e-8, return_eigenvectors=False)[0]
+        sigma = min(lowest, 0.0) - _shift_margin(hessian)
+        result = eigsh(hessian, num_modes, sigma=sigma, which='LM', v0=v0, return_eigenvectors=do_modes)
+    else:
+        result = eigsh(hessian, num_modes, which='SA', v0=v0, return_eigenvectors=do_modes)
+    return _sort_eigen(result, do_modes)
+
+
+def _diagonalize_window(hessian, do_modes, eval_window):
+    """Compute the eigenpairs of a Hessian in a window of eigenvalues.
+
+       See :func:`_diagonalize` for the arguments. For dense matrices, the
+       indexes of the eigenvalues at the bounds of the window are counted with
+       :func:`_count_evals_below` and the eigenpairs with these indexes are
+       computed with the LAPACK subset drivers. For sparse matrices, the
+       shift-invert Lanczos method is used with a shift in the center of the
+       window. The number of computed eigenvalues is doubled until the window
+       is completely covered.
+    """
+    lower, upper = eval_window
+    if not _is_sparse(hessian):
+        from scipy.linalg import eigh
+        hessian = numpy.asarray(hessian, float)
+        # the indexes of the eigenvalues in the window, in ascending order
+        begin = 0 if numpy.isinf(lower) else _count_evals_below(hessian, lower)
+        end = len(hessian) if numpy.isinf(upper) else _count_evals_below(hessian, upper)
+        if begin >= end:
+            evals = numpy.zeros(0, float)
+            evecs = numpy.zeros((len(hessian), 0), float) if do_modes else None
+            return evals, evecs
+        result = eigh(hessian, eigvals_only=(not do_modes), eigvals=(begin, end-1))
+        if do_modes:
+            return result
+        else:
+            return result, None
+
+    from scipy.sparse.linalg import eigsh
+    size = hessian.shape[0]
+    hessian = hessian.tocsc()
+    v0 = _lanczos_start(size)
+    # replace infinite bounds by the extremal eigenvalues to put the shift
+    center_lower = lower
+    if numpy.isinf(lower):
+        center_lower = eigsh(hessian, 1, which='SA', v0=v0, tol=1e-8, return_eigenvectors=False)[0] - _shift_margin(hessian)
+    center_upper = upper
+    if numpy.isinf(upper):
+        center_upper = eigsh(hessian, 1, which='LA', v0=v0, tol=1e-8, return_eigenvectors=False)[0] + _shift_margin(hessian)
+    sigma = 0.5*(center_lower + center_upper)
+    radius = 0.5*(center_upper - center_lower)
+    num = 10
+    while True:
+        if num >= size-1:
+            # fall back to the dense solver
+            return _diagonalize_window(hessian.toarray(), do_modes, eval_window)
+        result = eigsh(hessian, num, sigma=sigma, which='LM', v0=v0, return_eigenvectors=do_modes)
+        evals = result[0] if do_modes else result
+        # the eigenvalues closest to the shift are found first. When the most
+        # distant one is outside the window, the window is covered.
+        if abs(evals - sigma).max() > radius:
+            break
+        num *= 2
+    mask = (evals > lower) & (evals <= upper)
+    if do_modes:
+        return _sort_eigen((evals[mask], result[1][:,mask]), do_modes)
+    else:
+        return _sort_eigen(evals[mask], do_modes)
+
+
+def _count_evals_below(hessian, value):
+    """Count the eigenvalues of a dense symmetric matrix that are <= value.
+
+       According to Sylvester's law of inertia, the number of non-positive
+       eigenvalues of H - value*I is equal to that of the block diagonal
+       matrix D in its LDL^T factorization. D consists of 1x1 and 2x2 blocks.
+    """
+    from scipy.linalg import ldl
+    shifted = hessian - value*numpy.identity(len(hessian))
+    d = ldl(shifted, overwrite_a=True)[1]
+    diag = d.diagonal()
+    offdiag = d.diagonal(-1)
+    # first rows of the 2x2 blocks
+    pairs = offdiag.nonzero()[0]
+    single = numpy.ones(len(diag), bool)
+    single[pairs] = False
+    single[pairs+1] = False
+    result = (diag[single] <= 0).sum()
+    a = diag[pairs]
+    c = diag[pairs+1]
+    det = a*c - offdiag[pairs]**2
+    # a negative determinant means one negative and one positive eigenvalue.
+    # Otherwise both eigenvalues have the sign of the trace, or one is zero.
+    result += (det < 0).sum()
+    result += 2*((det > 0) & (a + c <= 0)).sum()
+    result += ((det == 0)*(1 + (a + c <= 0))).sum()
+    return int(result)
+
+
+def _lanczos_start(size):
+    """A fixed starting vector for the Lanczos method for reproducible results"""
+    return numpy.random.RandomState(1).uniform(-1, 1, size)
+
+
+def _shift_margin(hessian):
+    """The distance between the shift and the extremal eigenvalues"""
+    return 1e-3*abs(hessian.diagonal()).max()
+
+
+def _sort_eigen(result, do_modes):
+    """Sort the output of eigsh by increasing eigenvalue"""
+    if do_modes:
+        evals, evecs = result
+        order = evals.argsort()
+        return evals[order], evecs[:,order]
+    else:
+        return numpy.sort(result), None
+
+
+def _pair_indices(offsets0, offsets1):
+    """Indices of the 6x6 blocks of parameters for pairs of atoms.
+
+       The result can be used to add an array with shape (n,6,6) to a matrix of
+       block parameters. The matrix must be padded with six rows and columns
+       for the unused columns of the last blocks.
+    """
+    rows = offsets0.reshape((-1,1,1)) + numpy.arange(6).reshape((1,-1,1))
+    cols = offsets1.reshape((-1,1,1)) + numpy.arange(6).reshape((1,1,-1))
+    return tuple(numpy.broadcast_arrays(rows, cols))
+
+
+def _block_mass_matrix(values, offsets, masses3, size):
+    """Compute U^T . M . U for a transformation U in block form.
+
+       Arguments:
+        | ``values``, ``offsets`` -- the transformation U in block form, see
+                                     :class:`BlockTransform`
+        | ``masses3`` -- the diagonal of the Cartesian mass matrix
+        | ``size`` -- the number of block parameters
+    """
+    result = numpy.zeros((size+6, size+6), float)
+    contributions = numpy.einsum('niw,ni,niv->nwv', values, masses3.reshape((-1,3)), values)
+    numpy.add.at(result, _pair_indices(offsets, offsets), contributions)
+    return result[:size,:size]
+
+
+def _mbh_hessian(hessian, values, offsets, size):
+    """Compute U^T . H . U for the block transformation of MBH.
+
+       Arguments:
+        | ``hessian`` -- the Cartesian Hessian (dense or scipy.sparse)
+        | ``values``, ``offsets`` -- the transformation U in block form, see
+                                     :class:`BlockTransform`
+        | ``size`` -- the number of block parameters
+
+       U is converted to a sparse matrix with at most 18 nonzero elements per
+       atom. For a sparse Hessian, the product only involves the nonzero 3x3
+       blocks of the Hessian, i.e. the contributions of all pairs of
+       interacting atoms are added to the corresponding pair of blocks. For a
+       dense Hessian, the cost is proportional to the size of the Hessian
+       instead of the size of the Hessian times the number of block
+       parameters.
+    """
+    from scipy.sparse import coo_matrix
+    rows = numpy.arange(3*len(offsets)).reshape((-1,3,1))
+    cols = offsets.reshape((-1,1,1)) + numpy.arange(6).reshape((1,1,-1))
+    rows, cols = numpy.broadcast_arrays(rows, cols)
+    mask = values != 0
+    U = coo_matrix((values[mask], (rows[mask], cols[mask])), (3*len(offsets), size)).tocsr()
+    if _is_sparse(hessian):
+        return U.transpose().dot(hessian.dot(U)).toarray()
+    else:
+        return _congruence(U, hessian)
+
+
+def _congruence(transform, matrix):
+    """Compute transform^T . matrix . transform for a sparse transform and a dense symmetric matrix"""
+    # T^T . M, followed by (T^T . (T^T . M)^T)^T, using that M is symmetric
+    tmp = transform.transpose().dot(matrix)
+    return transform.transpose().dot(tmp.transpose()).transpose()
+
+
+def _submatrix(matrix, rows, cols):
+    """Take a submatrix from a dense or a sparse (scipy.sparse) matrix.
+
+       The result has the same type as the input, sparse matrices are returned
+       in the CSR format.
+    """
+    if _is_sparse(matrix):
+        return matrix.tocsr()[rows][:,cols]
+    return numpy.take(numpy.take(matrix,rows,0),cols,1)
+
+
+def _cartesian_indices(atoms):
+    """The indices of the Cartesian coordinates of the given atoms"""
+    return (3*numpy.asarray(atoms, int).reshape((-1,1)) + numpy.arange(3)).ravel()
+
+
+def _vsa_blocks(hessian, subs3, envi3, solver='direct', cg_tolerance=1e-10):
+    """Compute the blocks of the Hessian needed in the VSA treatments.
+
+       Arguments:
+        | ``hessian`` -- the full Hessian (dense or scipy.sparse)
+        | ``subs3`` -- the Cartesian indices of the subsystem
+        | ``envi3`` -- the Cartesian indices of the environment
+
+       Optional arguments:
+        | ``solver`` -- 'direct' or 'cg', see :class:`VSA`
+        | ``cg_tolerance`` -- the convergence criterion for 'cg'
+
+       Returns the dense matrices H_ss, H_es and H_ee**-1 . H_es. The inverse
+       of H_ee is never formed. With the direct solver, a dense H_ee is
+       factorized with Cholesky (or LDL^T when H_ee is not positive definite)
+       and a sparse H_ee with a sparse LU decomposition. The conjugate
+       gradient solver only computes products with H_ee.
+    """
+    hessian_ss = _dense(_submatrix(hessian, subs3, subs3))
+    hessian_es = _dense(_submatrix(hessian, envi3, subs3))
+    hessian_ee = _submatrix(hessian, envi3, envi3)
+    if len(envi3) == 0:
+        hessian_e1_es = hessian_es
+    elif solver == 'cg':
+        hessian_e1_es = _block_pcg(hessian_ee, hessian_es, cg_tolerance)
+    elif _is_sparse(hessian_ee):
+        from scipy.sparse.linalg import splu
+        # a symmetric ordering gives less fill-in than the default one
+        hessian_e1_es = splu(hessian_ee.tocsc(), permc_spec='MMD_AT_PLUS_A').solve(hessian_es)
+    else:
+        from scipy.linalg import cho_factor, cho_solve, solve, LinAlgError
+        try:
+            hessian_e1_es = cho_solve(cho_factor(hessian_ee), hessian_es)
+        except LinAlgError:
+            # H_ee is not positive definite, e.g. for a transition state.
+            hessian_e1_es = solve(hessian_ee, hessian_es, assume_a='sym')
+    return hessian_ss, hessian_es, hessian_e1_es
+
+
+def _block_pcg(matrix, rhs, tolerance, max_iter=None):
+    """Solve matrix X = rhs with preconditioned conjugate gradients.
+
+       Arguments:
+        | ``matrix`` -- a positive definite matrix (dense or scipy.sparse)
+        | ``rhs`` -- the right-hand sides, one per column
+        | ``tolerance`` -- the relative residual at which a column is
+                           converged
+
+       Optional argument:
+        | ``max_iter`` -- the maximum number of iterations [default=size of
+                          the matrix]
+
+       All columns are iterated at once, such that every iteration only needs
+       one product of the matrix with a block of vectors. Converged columns are
+       dropped from the block. The preconditioner is the inverse of the 3x3
+       blocks on the diagonal (one per atom).
+    """
+    size = matrix.shape[0]
+    if max_iter is None:
+        max_iter = size
+    # block-Jacobi preconditioner
+    rows = numpy.arange(size).reshape((-1,3,1)).repeat(3, axis=2)
+    cols = rows.transpose(0,2,1)
+    if _is_sparse(matrix):
+        matrix = matrix.tocsr()
+    precond = numpy.linalg.inv(numpy.asarray(matrix[rows.ravel(), cols.ravel()]).reshape((-1,3,3)))
+    def apply_precond(vectors):
+        return numpy.einsum('aij,ajk->aik', precond, vectors.reshape((-1,3,vectors.shape[1]))).reshape(vectors.shape)
+
+    solution = numpy.zeros(rhs.shape, float)
+    # the columns that are not converged yet
+    active = numpy.arange(rhs.shape[1])
+    x = solution
+    residual = rhs.copy()
+    threshold = tolerance*numpy.sqrt((rhs**2).sum(axis=0))
+    z = apply_precond(residual)
+    direction = z.copy()
+    rz = (residual*z).sum(axis=0)
+    for counter in xrange(max_iter+1):
+        converged = numpy.sqrt((residual**2).sum(axis=0)) <= threshold
+        if converged.any():
+            solution[:,active] = x
+            if converged.all():
+                return solution
+            keep = ~converged
+            active = active[keep]
+            x = x[:,keep]
+            residual = residual[:,keep]
+            direction = direction[:,keep]
+            rz = rz[keep]
+            threshold = threshold[keep]
+        if counter == max_iter:
+            break
+        product = matrix.dot(direction)
+        step = rz/(direction*product).sum(axis=0)
+        x = x + direction*step
+        residual -= product*step
+        z = apply_precond(residual)
+        rz_new = (residual*z).sum(axis=0)
+        direction *= rz_new/rz
+        direction += z
+        rz = rz_new
+    raise ValueError("The conjugate gradients did not converge in %i iterations. Is H_ee positive definite?" % max_iter)
+
+
+def _constraint_derivatives(coordinates, constraints):
+    """Compute the derivatives of the constrained internal coordinates.
+
+       Arguments:
+        | ``coordinates`` -- the Cartesian coordinates of the molecule
+        | ``constraints`` -- a list of constraints, see :class:`Constrain`
+
+       The constraints are grouped by type (distance, bending angle, dihedral
+       angle) and all constraints of one type are treated at once. Returns a
+       list with a tuple (indexes, atoms, grad, hess) for each type:
+        | ``indexes`` -- the positions of the constraints in the list
+        | ``atoms`` -- the atoms in each constraint, shape (n, k)
+        | ``grad`` -- the derivatives towards the Cartesian coordinates of
+                      these atoms, shape (n, 3k)
+        | ``hess`` -- the second order derivatives, shape (n, 3k, 3k)
+    """
+    result = []
+    for num in 2, 3, 4:
+        indexes = numpy.array([i for i, constraint in enumerate(constraints) if len(constraint) == num], int)
+        if len(indexes) == 0:
+            continue
+        atoms = numpy.array([constraints[i] for i in indexes], int)
+        pos = coordinates[atoms]
+        # relative vectors between the atoms: rel(i,j) = pos_j - pos_i
+        def rel(i, j):
+            d = numpy.zeros((len(indexes), 3, 3*num), float)
+            d[:,:,3*j:3*j+3] = numpy.identity(3)
+            d[:,:,3*i:3*i+3] -= numpy.identity(3)
+            return pos[:,j] - pos[:,i], d, numpy.zeros((len(indexes), 3, 3*num, 3*num), float)
+        if num == 2:
+            delta = rel(0, 1)
+            q = _jet_func(_jet_dot(delta, delta), numpy.sqrt, lambda x: 0.5/numpy.sqrt(x), lambda x: -0.25/x**1.5)
+        elif num == 3:
+            delta0 = rel(1, 0)
+            delta1 = rel(1, 2)
+            norms = _jet_mul(_jet_dot(delta0, delta0), _jet_dot(delta1, delta1))
+            cosine = _jet_mul(
+                _jet_dot(delta0, delta1),
+                _jet_func(norms, lambda x: x**-0.5, lambda x: -0.5*x**-1.5, lambda x: 0.75*x**-2.5),
+            )
+            q = _jet_func(cosine, numpy.arccos,
+                lambda x: -1/numpy.sqrt(1-x*x), lambda x: -x/(1-x*x)**1.5)
+        else:
+            delta0 = rel(0, 1)
+            delta1 = rel(1, 2)
+            delta2 = rel(2, 3)
+            normal0 = _jet_cross(delta0, delta1)
+            normal1 = _jet_cross(delta1, delta2)
+            length1 = _jet_func(_jet_dot(delta1, delta1), numpy.sqrt, lambda x: 0.5/numpy.sqrt(x), lambda x: -0.25/x**1.5)
+            q = _jet_atan2(_jet_mul(_jet_dot(delta0, normal1), length1), _jet_dot(normal0, normal1))
+        result.append((indexes, atoms, q[1], q[2]))
+    return result
+
+
+# Derivatives of the internal coordinates are propagated with the chain rule
+# through tuples (value, first derivatives, second derivatives). The first
+# axis runs over all constraints of one type. Vectors have an additional axis
+# for the three Cartesian components, after the first axis.
+
+def _jet_dot(a, b):
+    """Dot product of two vectors with derivatives"""
+    return (
+        numpy.einsum('nc,nc->n', a[0], b[0]),
+        numpy.einsum('nc,ncx->nx', a[0], b[1]) + numpy.einsum('nc,ncx->nx', b[0], a[1]),
+        numpy.einsum('nc,ncxy->nxy', a[0], b[2]) + numpy.einsum('nc,ncxy->nxy', b[0], a[2])
+        + _symmetrize(numpy.einsum('ncx,ncy->nxy', a[1], b[1])),
+    )
+
+
+def _jet_cross(a, b):
+    """Cross product of two vectors with derivatives"""
+    eps = numpy.zeros((3,3,3), float)
+    eps[0,1,2] = eps[1,2,0] = eps[2,0,1] = 1
+    eps[0,2,1] = eps[2,1,0] = eps[1,0,2] = -1
+    return (
+        numpy.einsum('ijk,nj,nk->ni', eps, a[0], b[0]),
+        numpy.einsum('ijk,nj,nkx->nix', eps, a[0], b[1]) + numpy.einsum('ijk,njx,nk->nix', eps, a[1], b[0]),
+        numpy.einsum('ijk,nj,nkxy->nixy', eps, a[0], b[2]) + numpy.einsum('ijk,njxy,nk->nixy', eps, a[2], b[0])
+        + numpy.einsum('ijk,njx,nky->nixy', eps, a[1], b[1]) + numpy.einsum('ijk,njy,nkx->nixy', eps, a[1], b[1]),
+    )
+
+
+def _jet_mul(a, b):
+    """Product of two scalars with derivatives"""
+    v0 = a[0].reshape((-1,1))
+    v1 = b[0].reshape((-1,1))
+    return (
+        a[0]*b[0],
+        v0*b[1] + v1*a[1],
+        v0.reshape((-1,1,1))*b[2] + v1.reshape((-1,1,1))*a[2]
+        + _symmetrize(numpy.einsum('nx,ny->nxy', a[1], b[1])),
+    )
+
+
+def _jet_func(a, f, df, ddf):
+    """Apply a function f, with derivatives df and ddf, to a scalar with derivatives"""
+    d1 = df(a[0])
+    d2 = ddf(a[0])
+    return (
+        f(a[0]),
+        d1.reshape((-1,1))*a[1],
+        d1.reshape((-1,1,1))*a[2] + d2.reshape((-1,1,1))*numpy.einsum('nx,ny->nxy', a[1], a[1]),
+    )
+
+
+def _jet_atan2(y, x):
+    """The angle atan2(y, x) of two scalars with derivatives"""
+    rho = (x[0]**2 + y[0]**2).reshape((-1,1))
+    # g = x dy - y dx, the derivative of the angle is g/rho
+    g = x[0].reshape((-1,1))*y[1] - y[0].reshape((-1,1))*x[1]
+    drho = 2*(x[0].reshape((-1,1))*x[1] + y[0].reshape((-1,1))*y[1])
+    dg = (
+        numpy.einsum('nx,ny->nxy', y[1], x[1]) - numpy.einsum('nx,ny->nxy', x[1], y[1])
+        + x[0].reshape((-1,1,1))*y[2] - y[0].reshape((-1,1,1))*x[2]
+    )
+    hess = dg/rho.reshape((-1,1,1)) - numpy.einsum('nx,ny->nxy', g, drho)/(rho**2).reshape((-1,1,1))
+    return numpy.arctan2(y[0], x[0]), g/rho, 0.5*_symmetrize(hess)
+
+
+def _symmetrize(a):
+    """Return a + a^T for a stack of square matrices (first axis)"""
+    return a + a.transpose(0,2,1)
 
-                self.hessian_small[i,j] += numpy.sum( numpy.ravel(gradient)*X[:,count] )
-                count += 1
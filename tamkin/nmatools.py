@@ -530,7 +530,7 @@ def plot_spectrum_dos(filename, all_freqs, low=None, high=None, imax=None,
 
 
 def create_enm_molecule(molecule, selected=None, numbers=None, masses=None,
-                        rcut=8.0*angstrom, K=1.0, periodic=None):
+                        rcut=8.0*angstrom, K=1.0, periodic=None, sparse=False):
     """Create a molecule according to the Elastic Network Model
 
        Argument:
@@ -554,6 +554,9 @@ def create_enm_molecule(molecule, selected=None, numbers=None, masses=None,
          | rcut  --  cutoff distance between interacting pairs in atomic units
          | K  --  strength of the interaction in atomic units (Hartree/Bohr**2).
                   The interaction strength is the same for all interacting pairs.
+         | sparse  --  When True, the Hessian is stored as a scipy.sparse CSR
+                       matrix. This is recommended for large systems because
+                       the memory usage scales with the number of pairs.
     """
     if isinstance(molecule, Molecule):
         coordinates = molecule.coordinates
@@ -579,19 +582,39 @@ def create_enm_molecule(molecule, selected=None, numbers=None, masses=None,
         numbers = numbers[selected]
         masses = masses[selected]
 
-    rcut2 = rcut**2
     N = len(coordinates)
-    hessian = numpy.zeros((3*N,3*N),float)
-    for i in range(N):
-        for j in range(i+1,N):
-            x = numpy.reshape( (coordinates[i,:]-coordinates[j,:]), (3,1))
-            dist2 = numpy.sum(x**2)
-            if dist2 < rcut2:
-                corr = K * numpy.dot( x, x.transpose() ) / dist2
-                hessian[3*i:3*(i+1), 3*i:3*(i+1)] += corr
-                hessian[3*i:3*(i+1), 3*j:3*(j+1)] -= corr
-                hessian[3*j:3*(j+1), 3*i:3*(i+1)] -= corr
-                hessian[3*j:3*(j+1), 3*j:3*(j+1)] += corr
+    # find all interacting pairs
+    from scipy.spatial import cKDTree
+    pairs = numpy.array(sorted(cKDTree(coordinates).query_pairs(rcut)), int).reshape(-1,2)
+    deltas = coordinates[pairs[:,0]] - coordinates[pairs[:,1]]
+    dists2 = (deltas**2).sum(axis=1)
+    mask = dists2 < rcut**2
+    pairs = pairs[mask]
+    deltas = deltas[mask]
+    dists2 = dists2[mask]
+    # the 3x3 blocks K * x.x^T / |x|^2 for each pair
+    corrs = K*deltas[:,:,None]*deltas[:,None,:]/dists2[:,None,None]
+
+    # diagonal blocks
+    diagonal = numpy.zeros((N,3,3), float)
+    numpy.add.at(diagonal, pairs[:,0], corrs)
+    numpy.add.at(diagonal, pairs[:,1], corrs)
+
+    if sparse:
+        from scipy.sparse import coo_matrix
+        brows = numpy.concatenate([numpy.arange(N), pairs[:,0], pairs[:,1]])
+        bcols = numpy.concatenate([numpy.arange(N), pairs[:,1], pairs[:,0]])
+        blocks = numpy.concatenate([diagonal, -corrs, -corrs])
+        rows = 3*brows[:,None,None] + numpy.arange(3)[None,:,None]
+        cols = 3*bcols[:,None,None] + numpy.arange(3)[None,None,:]
+        rows, cols = numpy.broadcast_arrays(rows, cols)
+        hessian = coo_matrix((blocks.ravel(), (rows.ravel(), cols.ravel())), (3*N,3*N)).tocsr()
+    else:
+        hessian = numpy.zeros((3*N,3*N),float)
+        blocks = hessian.reshape(N,3,N,3)
+        blocks[numpy.arange(N),:,numpy.arange(N),:] = diagonal
+        blocks[pairs[:,0],:,pairs[:,1],:] = -corrs
+        blocks[pairs[:,1],:,pairs[:,0],:] = -corrs
 
     return Molecule(
         numbers,
@@ -52,8 +52,9 @@
        * Vibrations
        * Rotor (see rotor.py)
    * **Helper functions:**
-       * helper_levels, helpert_levels, helpertt_levels,
-       * helper_vibrations, helpert_vibrations, helpertt_vibrations
+       * helper_levels, helpert_levels, helpertt_levels, helpers_levels
+       * helper_vibrations, helpert_vibrations, helpertt_vibrations,
+         helpers_vibrations
 
    **Important**: Partition functions can be constructed for NpT gases, NVT
    gases and many other systems. The return values of methods such as
@@ -73,6 +74,23 @@
 
    Don't say we did not warn you. Terminology can be very confusing.
 
+   All methods that take a temperature argument also accept a numpy array of
+   temperatures. The result is then an array with the same shape as the
+   temperature array. (The methods with the suffix ``_terms`` return arrays
+   where the first index runs over the terms and the remaining indexes
+   correspond to the temperatures.) For example::
+
+     >>> temps = numpy.arange(100, 3001, 10.0)
+     >>> free_energies = pf.free_energy(temps)
+
+   When several quantities are needed on the same temperature grid, the method
+   ``evaluate`` computes them in a single pass. The intermediate results (e.g.
+   the Boltzmann factors of the vibrational modes) are then shared among all
+   quantities::
+
+     >>> results = pf.evaluate(temps, ["free_energy", "entropy"])
+     >>> print results["entropy"]/(joule/mol/kelvin)
+
    All the extensive thermodynamic quantities computed here are in atomic units
    per molecule. If you want to express the Gibbs free energy at 300 Kelvin of a
    system in kJ/mol, use the molmod module to perform unit conversions. For
@@ -86,15 +104,18 @@
 from molmod import boltzmann, lightspeed, atm, bar, amu, centimeter, kjmol, \
     planck, mol, meter, newton
 
+import hashlib
 import numpy
+from collections import OrderedDict
 
 
 __all__ = [
     "Info", "StatFys", "StatFysTerms",
-    "helper_levels", "helpert_levels", "helpertt_levels",
+    "helper_levels", "helpert_levels", "helpertt_levels", "helpers_levels",
     "Electronic", "ExtTrans", "ExtRot", "PCMCorrection",
     "Vibrations",
     "helper_vibrations", "helpert_vibrations", "helpertt_vibrations",
+    "helpers_vibrations",
     "PartFun",
 ]
 
@@ -475,6 +496,43 @@ class StatFys(object):
             helpern = self.helpern
         return -boltzmann*helpern(temp, 1)
 
+    def helpers(self, temp, kinds):
+        """Evaluate several helper functions (with n=0) in one pass.
+
+           Arguments:
+            | ``temp`` -- the temperature (or an array of temperatures)
+            | ``kinds`` -- a list with names of helper functions: ``helper``,
+                           ``helpert``, ``helpertt``, ``helpern`` and/or
+                           ``helperv``
+
+           Returns a dictionary with the results for each kind of helper.
+           Derived classes may override this method to share intermediate
+           results among the different kinds of helpers.
+        """
+        return dict((kind, getattr(self, kind)(temp, 0)) for kind in kinds)
+
+    def evaluate(self, temps, quantities=None):
+        """Compute several thermodynamic quantities in one pass.
+
+           Arguments:
+            | ``temps`` -- the temperature (or an array of temperatures)
+
+           Optional argument:
+            | ``quantities`` -- a list with names of methods, e.g.
+                                ``["free_energy", "entropy"]``. [default:
+                                all methods that depend on the temperature]
+
+           Returns a dictionary with the results for each quantity. The results
+           are the same as those of the corresponding methods, but the helper
+           functions are only evaluated once for all quantities. Zero
+           temperatures are not supported.
+        """
+        quantities, kinds = _parse_quantities(quantities)
+        temps = _as_temp(temps)
+        if (temps <= 0).any():
+            raise ValueError("The temperatures must be strictly positive.")
+        return _derive_quantities(temps, self.helpers(temps, kinds), quantities)
+
 
 class StatFysTerms(StatFys):
     """Abstract class for (contributions to) the parition function with multiple terms.
@@ -495,28 +553,31 @@ class StatFysTerms(StatFys):
 
     def helper(self, temp, n):
         """See :meth:`StatFys.helper`."""
-        return self.helper_terms(temp, n).sum()
+        return self.helper_terms(temp, n).sum(axis=0)
 
     def helpert(self, temp, n):
         """See :meth:`StatFys.helpert`."""
-        return self.helpert_terms(temp, n).sum()
+        return self.helpert_terms(temp, n).sum(axis=0)
 
     def helpertt(self, temp, n):
         """See :meth:`StatFys.helpertt`."""
-        return self.helpertt_terms(temp, n).sum()
+        return self.helpertt_terms(temp, n).sum(axis=0)
 
     def helpern(self, temp, n):
         """See :meth:`StatFys.helpern`."""
-        return self.helpern_terms(temp, n).sum()
+        return self.helpern_terms(temp, n).sum(axis=0)
 
     def helperv(self, temp, n):
         """See :meth:`StatFys.helperv`."""
-        return self.helperv_terms(temp, n).sum()
+        return self.helperv_terms(temp, n).sum(axis=0)
 
     def helper_terms(self, temp, n):
         """Returns an array with all the helper results for the distinct terms.
 
-           This is just an array version of :meth:`StatFys.helper`.
+           This is just an array version of :meth:`StatFys.helper`. The first
+           index of the returned array runs over the terms. When an array of
+           temperatures is given, the remaining indexes correspond to the
+           temperatures.
         """
         raise NotImplementedError
 
@@ -627,6 +688,149 @@ class StatFysTerms(StatFys):
         """
         return self.chemical_potential(temp, self.helpern_terms)
 
+    def helpers(self, temp, kinds):
+        """See :meth:`StatFys.helpers`."""
+        terms = self.helpers_terms(temp, kinds)
+        return dict((kind, value.sum(axis=0)) for kind, value in terms.iteritems())
+
+    def helpers_terms(self, temp, kinds):
+        """Returns a dictionary with helper results for the distinct terms.
+
+           This is just an array version of :meth:`StatFys.helpers`.
+        """
+        return dict(
+            (kind, getattr(self, "%s_terms" % kind)(temp, 0)) for kind in kinds
+        )
+
+    def evaluate_terms(self, temps, quantities=None):
+        """Returns a dictionary with evaluate results for the distinct terms.
+
+           This is just an array version of :meth:`StatFys.evaluate`.
+        """
+        quantities, kinds = _parse_quantities(quantities)
+        temps = _as_temp(temps)
+        if (temps <= 0).any():
+            raise ValueError("The temperatures must be strictly positive.")
+        return _derive_quantities(temps, self.helpers_terms(temps, kinds), quantities)
+
+
+def _as_temp(temp):
+    """Convert a temperature or an array of temperatures to a float array."""
+    return numpy.asarray(temp, float)
+
+
+def _as_result(result):
+    """Turn zero-dimensional arrays into scalars, leave the rest untouched."""
+    return numpy.asarray(result)[()]
+
+
+# For each temperature dependent quantity, the helper functions it depends on.
+_quantity_helpers = {
+    "log": ["helper"],
+    "logt": ["helpert"],
+    "logtt": ["helpertt"],
+    "logn": ["helpern"],
+    "logv": ["helperv"],
+    "internal_heat": ["helpert"],
+    "heat_capacity": ["helpert", "helpertt"],
+    "entropy": ["helper", "helpert"],
+    "free_energy": ["helper"],
+    "chemical_potential": ["helpern"],
+}
+
+
+def _parse_quantities(quantities):
+    """Check the quantities and find out which helpers are needed.
+
+       Returns the (sorted) list of quantities and the list of helper kinds.
+    """
+    if quantities is None:
+        quantities = sorted(_quantity_helpers)
+    kinds = set([])
+    for quantity in quantities:
+        if quantity not in _quantity_helpers:
+            raise ValueError("Unknown thermodynamic quantity: %s" % quantity)
+        kinds.update(_quantity_helpers[quantity])
+    return quantities, sorted(kinds)
+
+
+def _derive_quantities(temp, helpers, quantities):
+    """Compute thermodynamic quantities from the helper results with n=0.
+
+       Arguments:
+        | ``temp`` -- an array with temperatures (see :func:`_as_temp`)
+        | ``helpers`` -- a dictionary with helper results, see
+                         :meth:`StatFys.helpers`
+        | ``quantities`` -- a list with names of quantities
+
+       The helper results may have additional leading axes, e.g. one that
+       runs over the terms.
+    """
+    h = helpers.get("helper")
+    ht = helpers.get("helpert")
+    htt = helpers.get("helpertt")
+    result = {}
+    for quantity in quantities:
+        if quantity == "log":
+            value = h
+        elif quantity == "logt":
+            value = ht
+        elif quantity == "logtt":
+            value = htt
+        elif quantity == "logn":
+            value = helpers["helpern"]
+        elif quantity == "logv":
+            value = helpers["helperv"]
+        elif quantity == "internal_heat":
+            value = boltzmann*temp**2*ht
+        elif quantity == "heat_capacity":
+            value = boltzmann*(2*temp*ht + temp**2*htt)
+        elif quantity == "entropy":
+            value = boltzmann*(h + temp*ht)
+        elif quantity == "free_energy":
+            value = -boltzmann*temp*h
+        elif quantity == "chemical_potential":
+            value = -boltzmann*temp*helpers["helpern"]
+        result[quantity] = _as_result(value)
+    return result
+
+
+_snapshot_types = (int, long, float, bool, numpy.generic)
+
+
+def _snapshot(obj):
+    """Return a comparable snapshot of all numerical attributes of an object.
+
+       This is used to detect changes in the parameters of a partition function
+       term, e.g. to invalidate cached results. Arrays are represented by a
+       SHA1 digest of their contents, such that also in-place modifications
+       are detected without keeping a copy of the arrays.
+    """
+    result = []
+    for key, value in sorted(obj.__dict__.iteritems()):
+        if isinstance(value, numpy.ndarray):
+            digest = hashlib.sha1(numpy.ascontiguousarray(value)).digest()
+            result.append((key, value.dtype.str, value.shape, digest))
+        elif value is None or isinstance(value, _snapshot_types):
+            result.append((key, value))
+        elif isinstance(value, tuple) and all(isinstance(item, _snapshot_types) for item in value):
+            result.append((key, value))
+    return tuple(result)
+
+
+def _expand(values, temp):
+    """Append axes to values such that it broadcasts with the temperatures.
+
+       Arguments:
+        | ``values`` -- an array (or a scalar) with properties of the terms
+        | ``temp`` -- an array with temperatures (see :func:`_as_temp`)
+
+       The first axes of the result correspond to the axes of values, the
+       remaining (dummy) axes correspond to the axes of the temperature array.
+    """
+    values = numpy.asarray(values)
+    return values.reshape(values.shape + (1,)*temp.ndim)
+
 
 def helper_levels(temp, n, energy_levels):
     """Helper 0 function for a system with the given energy levels.
@@ -634,20 +838,24 @@ def helper_levels(temp, n, energy_levels):
        Returns T^n ln(Z), where Z is the partition function
 
        Arguments:
-        | ``temp`` -- the temperature
+        | ``temp`` -- the temperature (or an array of temperatures)
         | ``n`` -- the power for the temperature factor
         | ``energy_levels`` -- an array with energy levels
     """
     # this is defined as a function because multiple classes need it
-    if temp == 0:
+    temp = _as_temp(temp)
+    zero = (temp == 0)
+    safe = numpy.where(zero, 1.0, temp)
+    es = _expand(energy_levels, temp)
+    Z = numpy.exp(-es/(boltzmann*safe)).sum(axis=0)
+    result = safe**n*numpy.log(Z)
+    if zero.any():
         energy = energy_levels[0]
         degeneracy = 1
         while (degeneracy<len(energy_levels) and energy_levels[0]==energy_levels[degeneracy]):
             degeneracy += 1
-        return temp**n*numpy.log(degeneracy) - temp**(n-1)*energy
-    else:
-        Z = numpy.exp(-energy_levels/(boltzmann*temp)).sum()
-        return temp**n*numpy.log(Z)
+        result = numpy.where(zero, 0.0**n*numpy.log(degeneracy) - 0.0**(n-1)*energy, result)
+    return _as_result(result)
 
 def helpert_levels(temp, n, energy_levels):
     """Helper 1 function for a system with the given energy levels.
@@ -655,18 +863,18 @@ def helpert_levels(temp, n, energy_levels):
        Returns T^n (d ln(Z) / dT), where Z is the partition function
 
        Arguments:
-        | ``temp`` -- the temperature
+        | ``temp`` -- the temperature (or an array of temperatures)
         | ``n`` -- the power for the temperature factor
         | ``energy_levels`` -- an array with energy levels
     """
     # this is defined as a function because multiple classes need it
-    if temp == 0:
+    temp = _as_temp(temp)
+    if (temp == 0).any():
         raise NotImplementedError
-    else:
-        es = energy_levels
-        bfs = numpy.exp(-es/(boltzmann*temp))
-        Z = bfs.sum()
-        return temp**(n-2)*(bfs*es).sum()/Z/boltzmann
+    es = _expand(energy_levels, temp)
+    bfs = numpy.exp(-es/(boltzmann*temp))
+    Z = bfs.sum(axis=0)
+    return _as_result(temp**(n-2)*(bfs*es).sum(axis=0)/Z/boltzmann)
 
 def helpertt_levels(temp, n, energy_levels):
     """Helper 2 function for a system with the given energy levels.
@@ -674,20 +882,52 @@ def helpertt_levels(temp, n, energy_levels):
        Returns T^n (d^2 ln(Z) / dT^2), where Z is the partition function
 
        Arguments:
-        | ``temp`` -- the temperature
+        | ``temp`` -- the temperature (or an array of temperatures)
         | ``n`` -- the power for the temperature factor
         | ``energy_levels`` -- an array with energy levels
     """
     # this is defined as a function because multiple classes need it
-    if temp == 0:
+    temp = _as_temp(temp)
+    if (temp == 0).any():
         raise NotImplementedError
-    else:
-        es = energy_levels
-        bfs = numpy.exp(-es/(boltzmann*temp))
-        Z = bfs.sum()
-        return temp**(n-4)/boltzmann**2*((bfs*es**2).sum()/Z) \
-               -2*temp**(n-3)/boltzmann*((bfs*es).sum()/Z) \
-               -temp**(n-4)/boltzmann**2*((bfs*es).sum()/Z)**2
+    es = _expand(energy_levels, temp)
+    bfs = numpy.exp(-es/(boltzmann*temp))
+    Z = bfs.sum(axis=0)
+    return _as_result(
+        temp**(n-4)/boltzmann**2*((bfs*es**2).sum(axis=0)/Z)
+        -2*temp**(n-3)/boltzmann*((bfs*es).sum(axis=0)/Z)
+        -temp**(n-4)/boltzmann**2*((bfs*es).sum(axis=0)/Z)**2
+    )
+
+def helpers_levels(temp, kinds, energy_levels):
+    """Fused helper functions (with n=0) for a system with the given energy levels.
+
+       Returns a dictionary with the results of helper_levels, helpert_levels
+       and helpertt_levels. The Boltzmann factors are computed only once.
+
+       Arguments:
+        | ``temp`` -- the temperature (or an array of temperatures)
+        | ``kinds`` -- a list of helper names, see :meth:`StatFys.helpers`
+        | ``energy_levels`` -- an array with energy levels
+    """
+    temp = _as_temp(temp)
+    if (temp == 0).any():
+        raise NotImplementedError
+    es = _expand(energy_levels, temp)
+    bfs = numpy.exp(-es/(boltzmann*temp))
+    Z = bfs.sum(axis=0)
+    e1 = (bfs*es).sum(axis=0)/Z
+    result = {}
+    for kind in kinds:
+        if kind == "helpert":
+            value = e1/(boltzmann*temp**2)
+        elif kind == "helpertt":
+            e2 = (bfs*es**2).sum(axis=0)/Z
+            value = (e2 - e1**2)/(boltzmann*temp**2)**2 - 2*e1/(boltzmann*temp**3)
+        else:
+            value = numpy.log(Z)
+        result[kind] = _as_result(value)
+    return result
 
 
 class Electronic(Info, StatFys):
@@ -722,35 +962,32 @@ class Electronic(Info, StatFys):
 
     def helper(self, temp, n):
         """See :meth:`StatFys.helper`."""
+        temp = _as_temp(temp)
+        zero = (temp == 0)
+        if n < 1 and zero.any():
+            raise NotImplementedError
+        safe = numpy.where(zero, 1.0, temp)
         result = temp**n*numpy.log(self.multiplicity)
-        if temp == 0.0:
-            if n < 1:
-                raise NotImplementedError
-            else:
-                result -= self.energy/boltzmann
-        else:
-            result -= temp**(n-1)*self.energy/boltzmann
-        return result
+        result -= numpy.where(zero, 1.0, safe**(n-1))*self.energy/boltzmann
+        return _as_result(result)
 
     def helpert(self, temp, n):
         """See :meth:`StatFys.helpert`."""
-        if temp == 0.0:
-            if n < 2:
-                raise NotImplementedError
-            else:
-                return self.energy/boltzmann
-        else:
-            return temp**(n-2)*self.energy/boltzmann
+        temp = _as_temp(temp)
+        zero = (temp == 0)
+        if n < 2 and zero.any():
+            raise NotImplementedError
+        safe = numpy.where(zero, 1.0, temp)
+        return _as_result(numpy.where(zero, 1.0, safe**(n-2))*self.energy/boltzmann)
 
     def helpertt(self, temp, n):
         """See :meth:`StatFys.helpertt`."""
-        if temp == 0.0:
-            if n < 3:
-                raise NotImplementedError
-            else:
-                return -2.0*self.energy/boltzmann
-        else:
-            return -2.0*temp**(n-3)*self.energy/boltzmann
+        temp = _as_temp(temp)
+        zero = (temp == 0)
+        if n < 3 and zero.any():
+            raise NotImplementedError
+        safe = numpy.where(zero, 1.0, temp)
+        return _as_result(-2.0*numpy.where(zero, 1.0, safe**(n-3))*self.energy/boltzmann)
 
 
 class ExtTrans(Info, StatFys):
@@ -897,63 +1134,60 @@ class ExtTrans(Info, StatFys):
 
     def helper(self, temp, n):
         """See :meth:`StatFys.helper`."""
-        if temp == 0:
-            if n > 0:
-                return 0.0
-            else:
-                raise NotImplementedError
+        temp = _as_temp(temp)
+        zero = (temp == 0)
+        if n <= 0 and zero.any():
+            raise NotImplementedError
+        safe = numpy.where(zero, 1.0, temp)
+        result = self._z1(safe)
+        if self.cp:
+            result += numpy.log(boltzmann*safe/self._pressure)
         else:
-            result = self._z1(temp)
-            if self.cp:
-                result += numpy.log(boltzmann*temp/self._pressure)
-            else:
-                result += 1.0 - numpy.log(self.density)
-            return result*temp**n
+            result += 1.0 - numpy.log(self.density)
+        return _as_result(numpy.where(zero, 0.0, result*safe**n))
 
     def helpert(self, temp, n):
         """See :meth:`StatFys.helpert`."""
-        if temp == 0:
+        temp = _as_temp(temp)
+        if (temp == 0).any():
             raise NotImplementedError
-        else:
-            result = 0.5*self.dim
-            if self.cp:
-                result += 1
-            return result*temp**(n-1)
+        result = 0.5*self.dim
+        if self.cp:
+            result += 1
+        return _as_result(result*temp**(n-1))
 
     def helpertt(self, temp, n):
         """See :meth:`StatFys.helpertt`."""
-        if temp == 0:
+        temp = _as_temp(temp)
+        if (temp == 0).any():
             raise NotImplementedError
-        else:
-            result = -0.5*self.dim
-            if self.cp:
-                result -= 1
-            return result*temp**(n-2)
+        result = -0.5*self.dim
+        if self.cp:
+            result -= 1
+        return _as_result(result*temp**(n-2))
 
     def helpern(self, temp, n):
         """See :meth:`StatFys.helpern`."""
-        if temp == 0:
-            if n > 0:
-                return 0.0
-            else:
-                raise NotImplementedError
+        temp = _as_temp(temp)
+        zero = (temp == 0)
+        if n <= 0 and zero.any():
+            raise NotImplementedError
+        safe = numpy.where(zero, 1.0, temp)
+        result = self._z1(safe)
+        if self.cp:
+            result += numpy.log(boltzmann*safe/self._pressure)
         else:
-            result = self._z1(temp)
-            if self.cp:
-                result += numpy.log(boltzmann*temp/self._pressure)
-            else:
-                result += -numpy.log(self._density)
-            return result*temp**n
+            result += -numpy.log(self._density)
+        return _as_result(numpy.where(zero, 0.0, result*safe**n))
 
     def helperv(self, temp, n):
         r"""See :meth:`StatFys.helperv`."""
-        if temp == 0:
-            if n > 0:
-                return 0.0
-            else:
-                raise NotImplementedError
-        else:
-            return self._z1(temp)*temp**n
+        temp = _as_temp(temp)
+        zero = (temp == 0)
+        if n <= 0 and zero.any():
+            raise NotImplementedError
+        safe = numpy.where(zero, 1.0, temp)
+        return _as_result(numpy.where(zero, 0.0, self._z1(safe)*safe**n))
 
 
 class ExtRot(Info, StatFys):
@@ -1007,21 +1241,21 @@ class ExtRot(Info, StatFys):
 
     def helper(self, temp, n):
         """See :meth:`StatFys.helper`."""
-        if temp == 0:
-            if n > 0:
-                return 0.0
-            else:
-                raise NotImplementedError
-        else:
-            return temp**n*(numpy.log(temp)*0.5*self.count + numpy.log(self.factor))
+        temp = _as_temp(temp)
+        zero = (temp == 0)
+        if n <= 0 and zero.any():
+            raise NotImplementedError
+        safe = numpy.where(zero, 1.0, temp)
+        result = safe**n*(numpy.log(safe)*0.5*self.count + numpy.log(self.factor))
+        return _as_result(numpy.where(zero, 0.0, result))
 
     def helpert(self, temp, n):
         """See :meth:`StatFys.helpert`."""
-        return temp**(n-1)*0.5*self.count
+        return _as_result(_as_temp(temp)**(n-1)*0.5*self.count)
 
     def helpertt(self, temp, n):
         """See :meth:`StatFys.helpertt`."""
-        return -temp**(n-2)*0.5*self.count
+        return _as_result(-_as_temp(temp)**(n-2)*0.5*self.count)
 
 
 class PCMCorrection(Info, StatFys):
@@ -1079,18 +1313,21 @@ class PCMCorrection(Info, StatFys):
 
     def helper(self, temp, n):
         """See :meth:`StatFys.helper`."""
+        temp = _as_temp(temp)
         F, Fp, Fpp = self._eval_free(temp)
-        return -F*temp**(n-1)/boltzmann
+        return _as_result(-F*temp**(n-1)/boltzmann)
 
     def helpert(self, temp, n):
         """See :meth:`StatFys.helpert`."""
+        temp = _as_temp(temp)
         F, Fp, Fpp = self._eval_free(temp)
-        return (F*temp**(n-2) - Fp*temp**(n-1))/boltzmann
+        return _as_result((F*temp**(n-2) - Fp*temp**(n-1))/boltzmann)
 
     def helpertt(self, temp, n):
         """See :meth:`StatFys.helpertt`."""
+        temp = _as_temp(temp)
         F, Fp, Fpp = self._eval_free(temp)
-        return (-Fpp*temp**(n-1) + 2*(Fp*temp**(n-2) - F*temp**(n-3)))/boltzmann
+        return _as_result((-Fpp*temp**(n-1) + 2*(Fp*temp**(n-2) - F*temp**(n-3)))/boltzmann)
 
 
 def helper_vibrations(temp, n, freqs, classical=False, freq_scaling=1, zp_scaling=1):
@@ -1099,7 +1336,7 @@ def helper_vibrations(temp, n, freqs, classical=False, freq_scaling=1, zp_scalin
        Returns T^n ln(Z), where Z is the partition function.
 
        Arguments:
-        | ``temp`` -- the temperature
+        | ``temp`` -- the temperature (or an array of temperatures)
         | ``n`` -- the power for the temperature factor
         | ``freqs`` -- an array with frequencies
 
@@ -1112,28 +1349,27 @@ def helper_vibrations(temp, n, freqs, classical=False, freq_scaling=1, zp_scalin
                          factor [default=1]
     """
     # this is defined as a function because multiple classes need it
+    temp = _as_temp(temp)
+    freqs = _expand(freqs, temp)
+    zero = (temp == 0)
+    if n < 1 and zero.any():
+        raise NotImplementedError
+    safe = numpy.where(zero, 1.0, temp)
     if classical:
-        if temp == 0:
-            if n >= 1:
-                return numpy.zeros(len(freqs))
-            else:
-                raise NotImplementedError
-        else:
-            Af = planck*freqs*freq_scaling/(boltzmann*temp)
-            return -temp**n*numpy.log(Af)
+        Af = planck*freqs*freq_scaling/(boltzmann*safe)
+        result = -safe**n*numpy.log(Af)
+        if zero.any():
+            result = numpy.where(zero, 0.0, result)
     else:
         # The zero point correction is included in the vibrational partition
         # function.
-        if temp == 0:
+        A = freqs*(planck/(boltzmann*safe))
+        B = numpy.exp(-freq_scaling*A)
+        result = -((0.5*zp_scaling)*A + numpy.log(1 - B))*safe**n
+        if zero.any():
             Abis = freqs*(0.5*planck*zp_scaling/boltzmann)
-            if n >= 1:
-                return -Abis*temp**(n-1)
-            else:
-                raise NotImplementedError
-        else:
-            A = freqs*(planck/(boltzmann*temp))
-            B = numpy.exp(-freq_scaling*A)
-            return -((0.5*zp_scaling)*A + numpy.log(1 - B))*temp**n
+            result = numpy.where(zero, -Abis*0.0**(n-1), result)
+    return _as_result(result)
 
 def helpert_vibrations(temp, n, freqs, classical=False, freq_scaling=1, zp_scaling=1):
     """Helper 1 function for a set of harmonic oscillators.
@@ -1141,7 +1377,7 @@ def helpert_vibrations(temp, n, freqs, classical=False, freq_scaling=1, zp_scali
        Returns T^n (d ln(Z) / dT), where Z is the partition function.
 
        Arguments:
-        | ``temp`` -- the temperature
+        | ``temp`` -- the temperature (or an array of temperatures)
         | ``n`` -- the power for the temperature factor
         | ``energy_levels`` -- an array with energy levels
 
@@ -1154,22 +1390,17 @@ def helpert_vibrations(temp, n, freqs, classical=False, freq_scaling=1, zp_scali
                          factor [default=1]
     """
     # this is defined as a function because multiple classes need it
+    temp = _as_temp(temp)
+    freqs = _expand(freqs, temp)
+    if (temp == 0).any():
+        raise NotImplementedError
     if classical:
-        if temp == 0:
-            raise NotImplementedError
-        else:
-            result = temp**(n-1)
-            if hasattr(freqs, "__len__"):
-                result *= numpy.ones(len(freqs))
-            return result
+        return _as_result(temp**(n-1)*numpy.ones(freqs.shape))
     else:
-        if temp == 0:
-            raise NotImplementedError
-        else:
-            A = freqs*(planck/(boltzmann*temp))
-            B = numpy.exp(-freq_scaling*A)
-            C = B/(1 - B)
-            return A*temp**(n-1)*(0.5*zp_scaling + freq_scaling*C)
+        A = freqs*(planck/(boltzmann*temp))
+        B = numpy.exp(-freq_scaling*A)
+        C = B/(1 - B)
+        return _as_result(A*temp**(n-1)*(0.5*zp_scaling + freq_scaling*C))
 
 def helpertt_vibrations(temp, n, freqs, classical=False, freq_scaling=1, zp_scaling=1):
     """Helper 2 function for a set of harmonic oscillators.
@@ -1177,7 +1408,7 @@ def helpertt_vibrations(temp, n, freqs, classical=False, freq_scaling=1, zp_scal
        Returns T^n (d^2 ln(Z) / dT^2), where Z is the partition function.
 
        Arguments:
-        | ``temp`` -- the temperature
+        | ``temp`` -- the temperature (or an array of temperatures)
         | ``n`` -- the power for the temperature factor
         | ``energy_levels`` -- an array with energy levels
 
@@ -1190,23 +1421,67 @@ def helpertt_vibrations(temp, n, freqs, classical=False, freq_scaling=1, zp_scal
                          factor [default=1]
     """
     # this is defined as a function because multiple classes need it
+    temp = _as_temp(temp)
+    freqs = _expand(freqs, temp)
+    if (temp == 0).any():
+        raise NotImplementedError
     if classical:
-        if temp == 0:
-            raise NotImplementedError
-        else:
-            result = -temp**(n-2)
-            if hasattr(freqs, "__len__"):
-                result *= numpy.ones(len(freqs))
-            return result
+        return _as_result(-temp**(n-2)*numpy.ones(freqs.shape))
     else:
-        if temp == 0:
-            raise NotImplementedError
-        else:
-            A = freqs*(planck/(boltzmann*temp))
-            Af = freq_scaling*A
-            B = numpy.exp(-Af)
-            C = B/(1.0 - B)
-            return -A*temp**(n-2)*(zp_scaling + freq_scaling*C*(2 - Af/(1-B)))
+        A = freqs*(planck/(boltzmann*temp))
+        Af = freq_scaling*A
+        B = numpy.exp(-Af)
+        C = B/(1.0 - B)
+        return _as_result(-A*temp**(n-2)*(zp_scaling + freq_scaling*C*(2 - Af/(1-B))))
+
+
+def helpers_vibrations(temp, kinds, freqs, classical=False, freq_scaling=1, zp_scaling=1):
+    """Fused helper functions (with n=0) for a set of vibrations.
+
+       Returns a dictionary with the results of helper_vibrations,
+       helpert_vibrations and helpertt_vibrations for each frequency. The
+       intermediate results (A, B=exp(-A) and C=B/(1-B)) are computed only
+       once.
+
+       Arguments:
+        | ``temp`` -- the temperature (or an array of temperatures)
+        | ``kinds`` -- a list of helper names, see :meth:`StatFys.helpers`
+        | ``freqs`` -- the frequencies
+
+       Optional arguments:
+        | ``classical`` -- boolean that indicates if the vibrations should be
+                           treated classically
+        | ``freq_scaling`` -- a scaling factor for the frequencies
+        | ``zp_scaling`` -- a scaling factor for the zero-point energy
+    """
+    temp = _as_temp(temp)
+    freqs = _expand(freqs, temp)
+    if (temp == 0).any():
+        raise NotImplementedError
+    result = {}
+    if classical:
+        for kind in kinds:
+            if kind == "helpert":
+                value = numpy.ones(freqs.shape)/temp
+            elif kind == "helpertt":
+                value = -numpy.ones(freqs.shape)/temp**2
+            else:
+                value = -numpy.log(planck*freqs*freq_scaling/(boltzmann*temp))
+            result[kind] = _as_result(value)
+    else:
+        A = freqs*(planck/(boltzmann*temp))
+        Af = freq_scaling*A
+        B = numpy.exp(-Af)
+        C = B/(1 - B)
+        for kind in kinds:
+            if kind == "helpert":
+                value = A/temp*(0.5*zp_scaling + freq_scaling*C)
+            elif kind == "helpertt":
+                value = -A/temp**2*(zp_scaling + freq_scaling*C*(2 - Af/(1-B)))
+            else:
+                value = -((0.5*zp_scaling)*A + numpy.log(1 - B))
+            result[kind] = _as_result(value)
+    return result
 
 
 class Vibrations(Info, StatFysTerms):
@@ -1281,6 +1556,13 @@ class Vibrations(Info, StatFysTerms):
             self.zp_scaling
         )
 
+    def helpers_terms(self, temp, kinds):
+        """See :meth:`StatFysTerms.helpers_terms`."""
+        return helpers_vibrations(
+            temp, kinds, self.positive_freqs, self.classical, self.freq_scaling,
+            self.zp_scaling
+        )
+
 
 class PartFun(Info, StatFys):
     """The partition function.
@@ -1292,13 +1574,29 @@ class PartFun(Info, StatFys):
     """
     __reserved_names__ = set(["terms"])
 
-    def __init__(self, nma, terms=None):
+    def __init__(self, nma, terms=None, cache_size=0):
         """
            Arguments:
             | ``nma`` -- NMA object
            Optional arguments:
             | ``terms`` -- list to select the contributions to the partition
                            function e.g. [Vibrations(classical=True), ExtRot(1)]
+            | ``cache_size`` -- the maximum number of results of the helper
+                                functions that are kept in memory. When zero,
+                                nothing is cached. [default=0]
+
+           When the cache is enabled, the results of the helper functions are
+           memorized for each combination of (method, temperature, n). The
+           least recently used results are dropped when the cache is full. The
+           cache is cleared automatically as soon as one of the numerical
+           attributes of the terms changes, e.g. when the frequencies are
+           altered with :meth:`tamkin.chemmod.BaseModel.alter_freqs` or in
+           place, or when the electronic energy, the pressure or the density
+           are modified. To detect such changes, each lookup computes a SHA1
+           digest of the arrays of the terms, which is cheap compared to the
+           evaluation of the helper functions. The attributes ``cache_hits``
+           and ``cache_misses`` count the number of successful and failed
+           lookups.
         """
         if terms is None:
             terms = []
@@ -1330,25 +1628,119 @@ class PartFun(Info, StatFys):
         self.chemical_formula = nma.chemical_formula
         Info.__init__(self, "total")
 
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.clear_cache()
+
+    def clear_cache(self):
+        """Drop all cached results of the helper functions."""
+        self._cache = OrderedDict()
+        self._cache_state = None
+
+    def _get_cache_state(self):
+        """Return a snapshot of all numerical attributes of the terms."""
+        return tuple((term.name, _snapshot(term)) for term in self.terms)
+
+    def _cached(self, kind, temp, n):
+        """Return the sum of a helper function over all terms, using the cache."""
+        if self.cache_size <= 0:
+            return sum(getattr(term, kind)(temp, n) for term in self.terms)
+        state = self._get_cache_state()
+        if state != self._cache_state:
+            self.clear_cache()
+            self._cache_state = state
+        temp = _as_temp(temp)
+        key = (kind, n, temp.shape, temp.tostring())
+        result = self._cache.pop(key, None)
+        if result is None:
+            self.cache_misses += 1
+            result = sum(getattr(term, kind)(temp, n) for term in self.terms)
+            while len(self._cache) >= self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self.cache_hits += 1
+        self._cache[key] = result
+        if isinstance(result, numpy.ndarray):
+            return result.copy()
+        return result
+
     def helper(self, temp, n):
         """See :meth:`StatFys.helper`."""
-        return sum(term.helper(temp, n) for term in self.terms)
+        return self._cached("helper", temp, n)
 
     def helpert(self, temp, n):
         """See :meth:`StatFys.helpert`."""
-        return sum(term.helpert(temp, n) for term in self.terms)
+        return self._cached("helpert", temp, n)
 
     def helpertt(self, temp, n):
         """See :meth:`StatFys.helpertt`."""
-        return sum(term.helpertt(temp, n) for term in self.terms)
+        return self._cached("helpertt", temp, n)
 
     def helpern(self, temp, n):
         """See :meth:`StatFys.helpern`."""
-        return sum(term.helpern(temp, n) for term in self.terms)
+        return self._cached("helpern", temp, n)
 
     def helperv(self, temp, n):
         """See :meth:`StatFys.helperv`."""
-        return sum(term.helperv(temp, n) for term in self.terms)
+        return self._cached("helperv", temp, n)
+
+    def helpers(self, temp, kinds):
+        """See :meth:`StatFys.helpers`."""
+        result = dict((kind, 0.0) for kind in kinds)
+        for term in self.terms:
+            for kind, value in term.helpers(temp, kinds).iteritems():
+                result[kind] = result[kind] + value
+        return result
+
+    def evaluate_contributions(self, temps, quantities=None):
+        """Compute thermodynamic quantities for the total and all contributions.
+
+           Arguments:
+            | ``temps`` -- an array of temperatures
+
+           Optional argument:
+            | ``quantities`` -- a list with names of methods, see
+                                :meth:`StatFys.evaluate`
+
+           Returns ``keys, results``. The list ``keys`` describes the
+           contributions: the total partition function, each term and (for
+           terms with multiple contributions) the individual contributions of
+           each term. The dictionary ``results`` contains for each quantity an
+           array whose rows correspond to the keys and whose columns
+           correspond to the temperatures. The helper functions of each term
+           are evaluated only once.
+        """
+        quantities, kinds = _parse_quantities(quantities)
+        temps = _as_temp(temps)
+        if (temps <= 0).any():
+            raise ValueError("The temperatures must be strictly positive.")
+        keys = [self.name]
+        totals = dict((kind, 0.0) for kind in kinds)
+        rows = dict((kind, []) for kind in kinds)
+        for term in self.terms:
+            keys.append(term.name)
+            if isinstance(term, StatFysTerms):
+                helpers = term.helpers_terms(temps, kinds)
+                for i in xrange(term.num_terms):
+                    keys.append("%s (%i)" % (term.name, i))
+                for kind in kinds:
+                    term_total = helpers[kind].sum(axis=0)
+                    totals[kind] = totals[kind] + term_total
+                    rows[kind].append(term_total)
+                    rows[kind].extend(helpers[kind])
+            else:
+                helpers = term.helpers(temps, kinds)
+                for kind in kinds:
+                    totals[kind] = totals[kind] + helpers[kind]
+                    rows[kind].append(helpers[kind])
+        helpers = {}
+        for kind in kinds:
+            helpers[kind] = numpy.zeros((len(keys),) + temps.shape)
+            helpers[kind][0] = totals[kind]
+            for i, row in enumerate(rows[kind]):
+                helpers[kind][i+1] = row
+        return keys, _derive_quantities(temps, helpers, quantities)
 
     def dump(self, f):
         """See :meth:`Info.dump`."""
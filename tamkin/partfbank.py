@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+# TAMkin is a post-processing toolkit for normal mode analysis, thermochemistry
+# and reaction kinetics.
+# Copyright (C) 2008-2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, An Ghysels
+# <An.Ghysels@UGent.be> and Matthias Vandichel <Matthias.Vandichel@UGent.be>
+# Center for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all
+# rights reserved unless otherwise stated.
+#
+# This file is part of TAMkin.
+#
+# TAMkin is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# In addition to the regulations of the GNU General Public License,
+# publications and communications based in parts on this program or on
+# parts of this program are required to cite the following article:
+#
+# "TAMkin: A Versatile Package for Vibrational Analysis and Chemical Kinetics",
+# An Ghysels, Toon Verstraelen, Karen Hemelsoet, Michel Waroquier and Veronique
+# Van Speybroeck, Journal of Chemical Information and Modeling, 2010, 50,
+# 1736-1750W
+# http://dx.doi.org/10.1021/ci100099g
+#
+# TAMkin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+"""Batch evaluation of many partition functions
+
+   A :class:`PartFunBank` packs the parameters of a list of :class:`PartFun`
+   objects into (padded) arrays. Thermodynamic quantities are then computed for
+   all partition functions and all temperatures with a few array operations,
+   instead of a chain of method calls for each partition function. For example::
+
+     >>> bank = PartFunBank([pf1, pf2, pf3])
+     >>> temps = numpy.arange(300, 1001, 10.0)
+     >>> free_energies = bank.free_energy(temps)  # shape (3, len(temps))
+
+   The contributions :class:`tamkin.partf.Electronic`,
+   :class:`tamkin.partf.ExtTrans`, :class:`tamkin.partf.ExtRot` and
+   :class:`tamkin.partf.Vibrations` are vectorized over all partition functions.
+   Other contributions (e.g. hindered rotors) are supported, but they are
+   evaluated for each partition function separately.
+
+   The parameters are copied when the bank is created. Call the method
+   ``refresh`` after modifying one of the partition functions.
+"""
+
+
+from molmod import boltzmann, planck
+
+import numpy
+
+from tamkin.partf import Electronic, ExtTrans, ExtRot, Vibrations, \
+    _as_temp, _parse_quantities, _derive_quantities
+
+
+__all__ = ["PartFunBank"]
+
+
+class PartFunBank(object):
+    """A collection of partition functions that are evaluated in batch."""
+
+    def __init__(self, pfs):
+        """
+           Argument:
+            | ``pfs`` -- a list of PartFun objects
+
+           All results are arrays whose first index runs over the partition
+           functions, in the same order as the list ``pfs``. The remaining
+           indexes correspond to the temperatures.
+        """
+        self.pfs = list(pfs)
+        self.refresh()
+
+    num_pfs = property(lambda self: len(self.pfs))
+
+    def refresh(self):
+        """Copy the parameters of all partition functions into arrays."""
+        size = len(self.pfs)
+        # electronic
+        self.energies = numpy.zeros(size, float)
+        self.log_multiplicities = numpy.zeros(size, float)
+        # translational
+        self.trans_mask = numpy.zeros(size, bool)
+        self.trans_cp = numpy.zeros(size, bool)
+        self.trans_dims = numpy.zeros(size, float)
+        self.trans_masses = numpy.ones(size, float)
+        self.trans_log_pds = numpy.zeros(size, float)
+        # rotational
+        self.rot_counts = numpy.zeros(size, float)
+        self.rot_log_factors = numpy.zeros(size, float)
+        # vibrational
+        max_freqs = 0
+        for pf in self.pfs:
+            for term in pf.terms:
+                if term.__class__ is Vibrations:
+                    max_freqs = max(max_freqs, len(term.positive_freqs))
+        self.freqs = numpy.ones((size, max_freqs), float)
+        self.freq_mask = numpy.zeros((size, max_freqs), bool)
+        self.classical = numpy.zeros(size, bool)
+        self.freq_scalings = numpy.ones(size, float)
+        self.zp_scalings = numpy.ones(size, float)
+        # all other terms are evaluated one by one
+        self.others = []
+
+        for i, pf in enumerate(self.pfs):
+            for term in pf.terms:
+                if term.__class__ is Electronic:
+                    self.energies[i] = term.energy
+                    self.log_multiplicities[i] = numpy.log(term.multiplicity)
+                elif term.__class__ is ExtTrans:
+                    self.trans_mask[i] = True
+                    self.trans_cp[i] = term.cp
+                    self.trans_dims[i] = term.dim
+                    self.trans_masses[i] = term.mass
+                    if term.cp:
+                        self.trans_log_pds[i] = numpy.log(term.pressure)
+                    else:
+                        self.trans_log_pds[i] = numpy.log(term.density)
+                elif term.__class__ is ExtRot:
+                    self.rot_counts[i] = term.count
+                    self.rot_log_factors[i] = numpy.log(term.factor)
+                elif term.__class__ is Vibrations:
+                    num = len(term.positive_freqs)
+                    self.freqs[i,:num] = term.positive_freqs
+                    self.freq_mask[i,:num] = True
+                    self.classical[i] = term.classical
+                    self.freq_scalings[i] = term.freq_scaling
+                    self.zp_scalings[i] = term.zp_scaling
+                else:
+                    self.others.append((i, term))
+
+    def index(self, pf):
+        """Return the position of a partition function in the bank."""
+        for i, other in enumerate(self.pfs):
+            if other is pf:
+                return i
+        raise ValueError("The partition function is not part of the bank.")
+
+    def helpers(self, temps, kinds):
+        """Evaluate helper functions (with n=0) for all partition functions.
+
+           Arguments:
+            | ``temps`` -- the temperature (or an array of temperatures)
+            | ``kinds`` -- a list of helper names, see
+                           :meth:`tamkin.partf.StatFys.helpers`
+
+           Returns a dictionary with an array for each kind of helper.
+        """
+        temps = _as_temp(temps)
+        if (temps <= 0).any():
+            raise ValueError("The temperatures must be strictly positive.")
+        shape = (len(self.pfs),) + temps.shape
+
+        def column(values):
+            # add dummy axes for the temperatures
+            return values.reshape(values.shape + (1,)*temps.ndim)
+
+        # Electronic
+        energies = column(self.energies/boltzmann)
+        log_multiplicities = column(self.log_multiplicities)
+        electronic = {
+            "helper": log_multiplicities - energies/temps,
+            "helpert": energies/temps**2,
+            "helpertt": -2*energies/temps**3,
+        }
+        # ExtTrans
+        dims = column(self.trans_dims)
+        cp = column(self.trans_cp)
+        z1 = 0.5*dims*numpy.log(
+            2*numpy.pi*column(self.trans_masses)*boltzmann*temps/planck**2)
+        extra = numpy.where(cp, numpy.log(boltzmann*temps) - column(self.trans_log_pds), -column(self.trans_log_pds))
+        trans = {
+            "helper": z1 + extra + numpy.where(cp, 0.0, 1.0),
+            "helpert": (0.5*dims + cp)/temps,
+            "helpertt": -(0.5*dims + cp)/temps**2,
+            "helpern": z1 + extra,
+            "helperv": z1,
+        }
+        trans_mask = column(self.trans_mask)
+        # ExtRot
+        rot_counts = column(self.rot_counts)
+        rot = {
+            "helper": 0.5*rot_counts*numpy.log(temps) + column(self.rot_log_factors),
+            "helpert": 0.5*rot_counts/temps,
+            "helpertt": -0.5*rot_counts/temps**2,
+        }
+        # Vibrations
+        vib = self._helpers_vibrations(temps, kinds)
+
+        result = {}
+        for kind in kinds:
+            if kind in ("helpern", "helperv"):
+                base = "helper"
+            else:
+                base = kind
+            value = numpy.zeros(shape, float)
+            value += electronic[base]
+            value += rot[base]
+            value += numpy.where(trans_mask, trans.get(kind, trans[base]), 0.0)
+            value += vib[base]
+            result[kind] = value
+
+        for i, term in self.others:
+            for kind, value in term.helpers(temps, kinds).iteritems():
+                result[kind][i] += value
+        return result
+
+    def _helpers_vibrations(self, temps, kinds):
+        """Compute the vibrational helpers for all partition functions."""
+        shape = (len(self.pfs),) + temps.shape
+        kinds = set(kind if kind in ("helpert", "helpertt") else "helper" for kind in kinds)
+        result = dict((kind, numpy.zeros(shape, float)) for kind in kinds)
+        extra = (1,)*temps.ndim
+        for classical in False, True:
+            select = (self.classical == classical)
+            if not select.any():
+                continue
+            freqs = self.freqs[select].reshape(self.freqs[select].shape + extra)
+            mask = self.freq_mask[select].reshape(freqs.shape)
+            freq_scaling = self.freq_scalings[select].reshape((-1, 1) + extra)
+            zp_scaling = self.zp_scalings[select].reshape((-1, 1) + extra)
+            if classical:
+                values = {
+                    "helper": -numpy.log(planck*freqs*freq_scaling/(boltzmann*temps)),
+                    "helpert": numpy.ones(freqs.shape)/temps,
+                    "helpertt": -numpy.ones(freqs.shape)/temps**2,
+                }
+            else:
+                A = freqs*(planck/(boltzmann*temps))
+                Af = freq_scaling*A
+                B = numpy.exp(-Af)
+                C = B/(1 - B)
+                values = {}
+                if "helper" in kinds:
+                    values["helper"] = -((0.5*zp_scaling)*A + numpy.log(1 - B))
+                if "helpert" in kinds:
+                    values["helpert"] = A/temps*(0.5*zp_scaling + freq_scaling*C)
+                if "helpertt" in kinds:
+                    values["helpertt"] = -A/temps**2*(zp_scaling + freq_scaling*C*(2 - Af/(1-B)))
+            for kind in kinds:
+                result[kind][select] = numpy.where(mask, values[kind], 0.0).sum(axis=1)
+        return result
+
+    def evaluate(self, temps, quantities=None):
+        """Compute thermodynamic quantities for all partition functions.
+
+           Arguments:
+            | ``temps`` -- the temperature (or an array of temperatures)
+
+           Optional argument:
+            | ``quantities`` -- a list with names of methods, see
+                                :meth:`tamkin.partf.StatFys.evaluate`
+
+           Returns a dictionary with an array for each quantity.
+        """
+        quantities, kinds = _parse_quantities(quantities)
+        temps = _as_temp(temps)
+        return _derive_quantities(temps, self.helpers(temps, kinds), quantities)
+
+    def unpack(self, results):
+        """Assign the results of ``evaluate`` to the partition functions.
+
+           Argument:
+            | ``results`` -- a dictionary as returned by :meth:`evaluate`
+
+           Returns a list of ``(pf, values)`` tuples, where ``values`` is a
+           dictionary with the results for the partition function ``pf``.
+        """
+        return [
+            (pf, dict((quantity, value[i]) for quantity, value in results.iteritems()))
+            for i, pf in enumerate(self.pfs)
+        ]
+
+    def _quantity(self, quantity, temps):
+        return self.evaluate(temps, [quantity])[quantity]
+
+    def log(self, temps):
+        """See :meth:`tamkin.partf.StatFys.log`."""
+        return self._quantity("log", temps)
+
+    def logt(self, temps):
+        """See :meth:`tamkin.partf.StatFys.logt`."""
+        return self._quantity("logt", temps)
+
+    def logtt(self, temps):
+        """See :meth:`tamkin.partf.StatFys.logtt`."""
+        return self._quantity("logtt", temps)
+
+    def logn(self, temps):
+        """See :meth:`tamkin.partf.StatFys.logn`."""
+        return self._quantity("logn", temps)
+
+    def logv(self, temps):
+        """See :meth:`tamkin.partf.StatFys.logv`."""
+        return self._quantity("logv", temps)
+
+    def internal_heat(self, temps):
+        """See :meth:`tamkin.partf.StatFys.internal_heat`."""
+        return self._quantity("internal_heat", temps)
+
+    def heat_capacity(self, temps):
+        """See :meth:`tamkin.partf.StatFys.heat_capacity`."""
+        return self._quantity("heat_capacity", temps)
+
+    def entropy(self, temps):
+        """See :meth:`tamkin.partf.StatFys.entropy`."""
+        return self._quantity("entropy", temps)
+
+    def free_energy(self, temps):
+        """See :meth:`tamkin.partf.StatFys.free_energy`."""
+        return self._quantity("free_energy", temps)
+
+    def chemical_potential(self, temps):
+        """See :meth:`tamkin.partf.StatFys.chemical_potential`."""
+        return self._quantity("chemical_potential", temps)
@@ -40,10 +40,15 @@ import sys, numpy, types, csv
 from molmod.units import kjmol, mol, kelvin, joule, centimeter
 from molmod.constants import boltzmann, lightspeed
 
-from tamkin.partf import PartFun
+from tamkin.partf import PartFun, helper_vibrations, _as_temp
+from tamkin.chemmod import KineticModel
+from tamkin.nma import NMA, Full
 
 
-__all__ = ["ThermoAnalysis", "ThermoTable", "ReactionAnalysis"]
+__all__ = [
+    "ThermoAnalysis", "ThermoTable", "ReactionAnalysis", "monte_carlo_reactions",
+    "kinetic_isotope_effects",
+]
 
 
 class ThermoAnalysis(object):
@@ -63,20 +68,27 @@ class ThermoAnalysis(object):
 
            The results can be written to a csv file with the method
            write_to_file.
+
+           All quantities are computed in a single pass with
+           :meth:`tamkin.partf.PartFun.evaluate_contributions`.
         """
         self.pf = pf
         self.temps = temps
+        keys, results = pf.evaluate_contributions(temps)
+        def table(label, unit, unit_name, method_name):
+            return ThermoTable(label, unit, unit_name, method_name, pf, temps,
+                               keys=keys, data=results[method_name])
         self.tables = [
-            ThermoTable("Internal heat", kjmol, "kJ/mol", "internal_heat", pf, temps),
-            ThermoTable("Heat capacity", joule/mol/kelvin, "J/(mol*K)", "heat_capacity", pf, temps),
-            ThermoTable("Free energy", kjmol, "kJ/mol", "free_energy", pf, temps),
-            ThermoTable("Chemical potential", kjmol, "kJ/mol", "chemical_potential", pf, temps),
-            ThermoTable("Entropy", joule/mol/kelvin, "J/(mol*K)", "entropy", pf, temps),
-            ThermoTable("ln(Z_N)/N", 1.0, "1", "log", pf, temps),
-            ThermoTable("1/N d ln(Z_N) / dT", 1.0/kelvin, "1/K", "logt", pf, temps),
-            ThermoTable("1/N d^2 ln(Z_N) / dT^2", 1.0/kelvin**2, "1/K^2", "logtt", pf, temps),
-            ThermoTable("d ln(Z_N) / dN", 1.0, "1", "logn", pf, temps),
-            ThermoTable("d ln(Z_N) / dN - log(V/N)", 1.0, "mixed: 1 or ln(bohr^-dim)", "logv", pf, temps),
+            table("Internal heat", kjmol, "kJ/mol", "internal_heat"),
+            table("Heat capacity", joule/mol/kelvin, "J/(mol*K)", "heat_capacity"),
+            table("Free energy", kjmol, "kJ/mol", "free_energy"),
+            table("Chemical potential", kjmol, "kJ/mol", "chemical_potential"),
+            table("Entropy", joule/mol/kelvin, "J/(mol*K)", "entropy"),
+            table("ln(Z_N)/N", 1.0, "1", "log"),
+            table("1/N d ln(Z_N) / dT", 1.0/kelvin, "1/K", "logt"),
+            table("1/N d^2 ln(Z_N) / dT^2", 1.0/kelvin**2, "1/K^2", "logtt"),
+            table("d ln(Z_N) / dN", 1.0, "1", "logn"),
+            table("d ln(Z_N) / dN - log(V/N)", 1.0, "mixed: 1 or ln(bohr^-dim)", "logv"),
         ]
 
     def write_to_file(self, filename):
@@ -105,7 +117,7 @@ class ThermoTable(object):
        specific thermodynamic quantity.
     """
 
-    def __init__(self, label, unit, unit_name, method_name, pf, temps, pf_method_name=None):
+    def __init__(self, label, unit, unit_name, method_name, pf, temps, pf_method_name=None, keys=None, data=None):
         """This object is used by the ThermoAnalysis class and should probably
            never be used directly.
 
@@ -126,6 +138,10 @@ class ThermoTable(object):
                                     compute to quantity of interest. This
                                     workaround is required due to poor naming
                                     conventions in statistical physics.
+            | ``keys``, ``data`` -- Precomputed keys and data, e.g. obtained
+                                    with PartFun.evaluate_contributions. When
+                                    given, the methods of the partition
+                                    function are not called.
 
            The results are stored in an array self.data of which the columns
            correspond to the given temperatures and the rows correspond to the
@@ -145,6 +161,11 @@ class ThermoTable(object):
         self.temps = temps
         self.pf_method_name = pf_method_name
 
+        if keys is not None and data is not None:
+            self.keys = list(keys)
+            self.data = numpy.array(data, ndmin=2)
+            return
+
         self.keys = []
         data =  []
         for term in [pf] + pf.terms:
@@ -154,18 +175,12 @@ class ThermoTable(object):
             else:
                 method = getattr(term, method_name, None)
             if isinstance(method, types.MethodType):
-                row = []
-                for temp in temps:
-                    row.append(method(temp))
-                data.append(numpy.array(row,ndmin=2))
+                data.append(numpy.array(method(temps),ndmin=2))
             method = getattr(term, "%s_terms" % method_name, None)
             if isinstance(method, types.MethodType):
-                columns = []
                 for i in xrange(term.num_terms):
                     self.keys.append("%s (%i)" % (term.name, i))
-                for temp in temps:
-                    columns.append(method(temp))
-                data.append(numpy.array(columns).transpose())
+                data.append(numpy.array(method(temps),ndmin=2))
         self.data = numpy.concatenate(data)
 
     def dump(self, f):
@@ -224,10 +239,7 @@ class ReactionAnalysis(object):
         # make sure that the final temperature is included
         self.temps = numpy.arange(self.temp_low,self.temp_high+0.5*self.temp_step,self.temp_step,dtype=float)
         self.temps_inv = 1/self.temps
-        self.ln_rate_consts = numpy.array([
-            self.kinetic_model.rate_constant(temp, do_log=True)
-            for temp in self.temps
-        ])
+        self.ln_rate_consts = self.kinetic_model.rate_constant(self.temps, do_log=True)
         self.rate_consts = numpy.exp(self.ln_rate_consts)
 
         design_matrix = numpy.zeros((len(self.temps),2), float)
@@ -346,7 +358,7 @@ class ReactionAnalysis(object):
             pylab.savefig(filename)
 
 
-    def monte_carlo(self, freq_error=1*(lightspeed/centimeter), energy_error=0.00, num_iter=100):
+    def monte_carlo(self, freq_error=1*(lightspeed/centimeter), energy_error=0.00, num_iter=100, batched=False, executor=None, seed=None, block_size=1000):
         """Estimate the uncertainty on the parameters
 
            The uncertainties are modeled by stochastic errors in the frequencies
@@ -363,35 +375,111 @@ class ReactionAnalysis(object):
                                   the energy barrier [default=0.00]
             | ``num_iter`` -- The number of Monte Carlo iterations
                               [default=1000]
+            | ``batched`` -- When True, all Monte Carlo samples are processed
+                             at once with array operations, without altering
+                             the kinetic model. See
+                             :meth:`_monte_carlo_batched`. [default=False]
+            | ``executor`` -- An object with a ``map`` method, e.g. a
+                              ``multiprocessing.Pool`` or a
+                              ``concurrent.futures.ProcessPoolExecutor``. When
+                              given, the samples are computed in blocks by
+                              the workers of the executor. [default=None]
+            | ``seed`` -- When given, each block of samples gets its own random
+                          stream, derived from this seed and the index of the
+                          block, instead of the global ``numpy.random`` state.
+                          [default=None]
+            | ``block_size`` -- The number of samples in one block, only used
+                                with an executor or a seed. [default=1000]
+
+           With an executor or a seed, the samples are computed in the batched
+           mode. For a given seed and block_size, the results are bit-identical,
+           no matter how many workers the executor has or whether an executor
+           is used at all. When an executor is given without a seed, a seed is
+           drawn from the global ``numpy.random`` state.
         """
-        if freq_error < 0.0 or freq_error >= 1.0:
-            raise ValueError("The argument freq_error must be in the range [0,1[.")
-        if energy_error < 0.0 or freq_error >= 1.0:
-            raise ValueError("The argument energy_error must be in the range [0,1[.")
-        if num_iter <= 0:
-            raise ValueError("The number of iterations must be strictly positive.")
+        _check_monte_carlo_args(freq_error, energy_error, num_iter)
+        if executor is not None or seed is not None:
+            if seed is None:
+                seed = numpy.random.randint(2**31)
+            tasks = _monte_carlo_tasks(
+                self._monte_carlo_data(), freq_error, energy_error,
+                num_iter, (seed,), block_size
+            )
+            solutions = numpy.concatenate(_map(executor, _monte_carlo_task, tasks))
+        elif batched:
+            solutions = self._monte_carlo_batched(freq_error, energy_error, num_iter)
+        else:
+            self.kinetic_model.backup_freqs()
+
+            solutions = numpy.zeros((num_iter, 2), float)
+            for i in xrange(num_iter):
+                scale_energy = 1.0 + numpy.random.normal(0.0, 1.0)*energy_error
+                self.kinetic_model.alter_freqs(freq_error, scale_energy)
+                altered_ra = ReactionAnalysis(
+                    self.kinetic_model, self.temp_low, self.temp_high,
+                    self.temp_step
+                )
+                solutions[i] = altered_ra.parameters
+
+            self.kinetic_model.restore_freqs()
+        self._set_monte_carlo(freq_error, energy_error, solutions)
+
+    def _set_monte_carlo(self, freq_error, energy_error, solutions):
+        """Store the Monte Carlo samples and the derived covariance matrix."""
         self.freq_error = freq_error
         self.energy_error = energy_error
-        self.monte_carlo_iter = num_iter
-
+        self.monte_carlo_iter = len(solutions)
+        self.monte_carlo_samples = solutions.copy()
+        solutions = solutions - self.parameters
+        self.covariance = numpy.dot(solutions.transpose(), solutions)/len(solutions)
 
-        self.kinetic_model.backup_freqs()
+    def _monte_carlo_data(self):
+        """Collect the data needed to compute Monte Carlo samples.
 
-        solutions = numpy.zeros((num_iter, 2), float)
-        for i in xrange(num_iter):
-            scale_energy = 1.0 + numpy.random.normal(0.0, 1.0)*energy_error
-            self.kinetic_model.alter_freqs(freq_error, scale_energy)
-            altered_ra = ReactionAnalysis(
-                self.kinetic_model, self.temp_low, self.temp_high,
-                self.temp_step
-            )
-            solutions[i] = altered_ra.parameters
+           The result only contains numbers and arrays, such that it can be
+           sent to other processes without pickling the partition functions.
+        """
+        vibrations = []
+        for pf, st in self.kinetic_model._iter_pfs():
+            vib = pf.vibrational
+            vibrations.append((
+                st, vib.positive_freqs, vib.classical, vib.freq_scaling,
+                vib.zp_scaling
+            ))
+        return (
+            self.temps, self.ln_rate_consts,
+            self.kinetic_model.energy_difference(), vibrations
+        )
 
-        self.monte_carlo_samples = solutions.copy()
-        solutions -= self.parameters
-        self.covariance = numpy.dot(solutions.transpose(), solutions)/num_iter
+    def _monte_carlo_batched(self, freq_error, energy_error, num_iter):
+        """Compute the Monte Carlo samples of the kinetic parameters at once.
 
-        self.kinetic_model.restore_freqs()
+           Arguments:
+            | ``freq_error``, ``energy_error``, ``num_iter`` -- See
+                :meth:`monte_carlo`.
+
+           The distortions are the same as in
+           :meth:`tamkin.chemmod.BaseModel.alter_freqs`, but they are drawn
+           for all iterations up front: one matrix of frequency shifts (with
+           shape (num_iter, number of frequencies)) for each partition
+           function and one vector with energy scale factors. The distortions
+           only affect the vibrational and the electronic contribution to
+           the rate constant, so the altered logarithms of the rate constants
+           are obtained by adding the corresponding changes to
+           ``ln_rate_consts``. (The imaginary frequencies do not contribute
+           to the partition functions, so they are not distorted.) All
+           parameters are fitted with a single least-squares solve.
+
+           The kinetic model is never modified, so this method may be used on
+           models that are shared with other (concurrent) computations.
+
+           Returns an array with shape (num_iter, 2) with the kinetic
+           parameters of each sample.
+        """
+        return _monte_carlo_samples(
+            self._monte_carlo_data(), freq_error, energy_error, num_iter,
+            numpy.random
+        )
 
     def plot_parameters(self, filename=None, label=None, color="red", marker="o", error=True):
         """Plot the kinetic parameters.
@@ -460,3 +548,193 @@ class ReactionAnalysis(object):
             pylab.legend(loc=0, numpoints=1)
         if filename is not None:
             pylab.savefig(filename)
+
+
+def _check_monte_carlo_args(freq_error, energy_error, num_iter):
+    """Validate the arguments of the Monte Carlo methods."""
+    if freq_error < 0.0 or freq_error >= 1.0:
+        raise ValueError("The argument freq_error must be in the range [0,1[.")
+    if energy_error < 0.0 or energy_error >= 1.0:
+        raise ValueError("The argument energy_error must be in the range [0,1[.")
+    if num_iter <= 0:
+        raise ValueError("The number of iterations must be strictly positive.")
+
+
+def _monte_carlo_samples(data, freq_error, energy_error, num_iter, random_state, max_size=2**22):
+    """Compute Monte Carlo samples of the kinetic parameters.
+
+       Arguments:
+        | ``data`` -- The result of :meth:`ReactionAnalysis._monte_carlo_data`
+        | ``freq_error``, ``energy_error``, ``num_iter`` -- See
+            :meth:`ReactionAnalysis.monte_carlo`.
+        | ``random_state`` -- The source of random numbers, e.g. the module
+                              ``numpy.random`` or a ``RandomState`` object.
+
+       Optional argument:
+        | ``max_size`` -- The maximum number of elements in the intermediate
+                          arrays. The samples are processed in chunks to
+                          respect this limit. [default=2**22]
+
+       See :meth:`ReactionAnalysis._monte_carlo_batched` for the details.
+    """
+    temps, ln_rate_consts_ref, energy_difference, vibrations = data
+    scale_energies = 1.0 + random_state.normal(0.0, 1.0, num_iter)*energy_error
+    shifts = []
+    for st, freqs, classical, freq_scaling, zp_scaling in vibrations:
+        shifts.append(random_state.normal(0, freq_error, (num_iter, len(freqs))))
+
+    ln_rate_consts = numpy.outer(
+        1.0 - scale_energies, energy_difference/(boltzmann*temps)
+    )
+    ln_rate_consts += ln_rate_consts_ref
+    for (st, positive_freqs, classical, freq_scaling, zp_scaling), shift in zip(vibrations, shifts):
+        if shift.size == 0:
+            continue
+        def log_vibrations(freqs):
+            return helper_vibrations(
+                temps, 0, freqs, classical, freq_scaling, zp_scaling
+            ).sum(axis=-2)
+        reference = log_vibrations(positive_freqs)
+        chunk = max(1, max_size/(shift.shape[1]*len(temps)))
+        for begin in xrange(0, num_iter, chunk):
+            freqs = positive_freqs + shift[begin:begin+chunk]
+            freqs[freqs<=0] = 0.01
+            ln_rate_consts[begin:begin+chunk] += st*(log_vibrations(freqs) - reference)
+
+    if not numpy.isfinite(ln_rate_consts).all():
+        raise ValueError("non-finite rate constants. check your partition functions for errors.")
+    design_matrix = numpy.zeros((len(temps),2), float)
+    design_matrix[:,0] = 1
+    design_matrix[:,1] = -1/(boltzmann*temps)
+    return numpy.linalg.lstsq(design_matrix, ln_rate_consts.transpose())[0].transpose()
+
+
+def _monte_carlo_tasks(data, freq_error, energy_error, num_iter, key, block_size):
+    """Split a Monte Carlo computation into blocks with their own random streams.
+
+       The random stream of each block is seeded with the given key (a tuple
+       of integers) extended with the index of the block.
+    """
+    tasks = []
+    for index, begin in enumerate(xrange(0, num_iter, block_size)):
+        size = min(block_size, num_iter - begin)
+        tasks.append((data, freq_error, energy_error, size, key + (index,)))
+    return tasks
+
+
+def _monte_carlo_task(task):
+    """Compute one block of Monte Carlo samples, see :func:`_monte_carlo_tasks`."""
+    data, freq_error, energy_error, size, key = task
+    random_state = numpy.random.RandomState(list(key))
+    return _monte_carlo_samples(data, freq_error, energy_error, size, random_state)
+
+
+def _map(executor, function, tasks):
+    """Apply the function to all tasks, with the executor if one is given."""
+    if executor is None:
+        return [function(task) for task in tasks]
+    else:
+        return list(executor.map(function, tasks))
+
+
+def monte_carlo_reactions(analyses, freq_error=1*(lightspeed/centimeter), energy_error=0.00, num_iter=100, executor=None, seed=None, block_size=1000):
+    """Estimate the uncertainty on the parameters of multiple reactions.
+
+       Arguments:
+        | ``analyses`` -- A list of ReactionAnalysis objects
+
+       Optional arguments:
+        | ``freq_error``, ``energy_error``, ``num_iter``, ``executor``,
+          ``block_size`` -- See :meth:`ReactionAnalysis.monte_carlo`.
+        | ``seed`` -- The random streams of the blocks of reaction ``i`` are
+                      derived from the seed, the index ``i`` and the index of
+                      the block. When not given, a seed is drawn from the
+                      global ``numpy.random`` state. [default=None]
+
+       The blocks of all reactions are submitted to the executor at once, such
+       that all workers are kept busy. The results are stored in the reaction
+       analysis objects, as with :meth:`ReactionAnalysis.monte_carlo`. For a
+       given seed and block_size, they do not depend on the number of workers.
+    """
+    _check_monte_carlo_args(freq_error, energy_error, num_iter)
+    if seed is None:
+        seed = numpy.random.randint(2**31)
+    tasks = []
+    for i, ra in enumerate(analyses):
+        tasks.extend(_monte_carlo_tasks(
+            ra._monte_carlo_data(), freq_error, energy_error, num_iter,
+            (seed, i), block_size
+        ))
+    blocks = _map(executor, _monte_carlo_task, tasks)
+    num_blocks = len(blocks)/len(analyses)
+    for i, ra in enumerate(analyses):
+        solutions = numpy.concatenate(blocks[i*num_blocks:(i+1)*num_blocks])
+        ra._set_monte_carlo(freq_error, energy_error, solutions)
+
+
+def kinetic_isotope_effects(reactants, transition_state, substitutions, temps, make_pf, treatment=None, tunneling=None):
+    """Compute the kinetic isotope effects of several substitution patterns.
+
+       Arguments:
+        | ``reactants`` -- a list of molecule objects for the reactants
+        | ``transition_state`` -- a molecule object for the transition state
+        | ``substitutions`` -- a list of substitution patterns. Each pattern is
+                               a dictionary {atom index: mass} that is applied
+                               to all reactants and the transition state, or
+                               a list with such a dictionary for each reactant,
+                               followed by one for the transition state.
+        | ``temps`` -- a temperature or an array of temperatures
+        | ``make_pf`` -- a function that constructs a partition function from
+                         an NMA object, e.g.
+                         ``lambda nma: PartFun(nma, [ExtTrans(), ExtRot()])``
+
+       Optional arguments:
+        | ``treatment`` -- the NMA treatment, a copy is used for every
+                           molecule [default=Full()]
+        | ``tunneling`` -- a function that constructs a tunneling correction
+                           from the partition function of the transition
+                           state, e.g. ``Wigner`` [default=no tunneling]
+
+       Returns an array with the ratios k/k' of the rate constant with the
+       original masses and the rate constants of the substituted species. The
+       first index runs over the substitution patterns, the remaining indexes
+       follow the shape of temps.
+
+       The normal mode analyses of all isotopologues of one molecule are
+       carried out at once with :meth:`tamkin.nma.NMA.isotopologues`.
+    """
+    import copy
+    if treatment is None:
+        treatment = Full()
+    temps = _as_temp(temps)
+    molecules = list(reactants) + [transition_state]
+    # the masses of all isotopologues of each molecule, the first one is the
+    # original molecule.
+    masses_lists = [[molecule.masses] for molecule in molecules]
+    for pattern in substitutions:
+        if isinstance(pattern, dict):
+            pattern = [pattern]*len(molecules)
+        elif len(pattern) != len(molecules):
+            raise ValueError("A substitution pattern must contain one dictionary, or one for each reactant and one for the transition state.")
+        for masses_list, molecule, changes in zip(masses_lists, molecules, pattern):
+            masses = molecule.masses.copy()
+            for index, mass in changes.iteritems():
+                masses[index] = mass
+            masses_list.append(masses)
+    # a partition function for each isotopologue of each molecule
+    pfs = [
+        [make_pf(nma) for nma in NMA.isotopologues(molecule, masses_list, copy.deepcopy(treatment), do_modes=False)]
+        for molecule, masses_list in zip(molecules, masses_lists)
+    ]
+    log_rate_consts = []
+    for i in xrange(len(substitutions)+1):
+        pf_trans = pfs[-1][i]
+        if tunneling is None:
+            km = KineticModel([pfs_react[i] for pfs_react in pfs[:-1]], pf_trans)
+        else:
+            km = KineticModel([pfs_react[i] for pfs_react in pfs[:-1]], pf_trans, tunneling(pf_trans))
+        log_rate_consts.append(km.rate_constant(temps, do_log=True))
+    return numpy.array([
+        numpy.exp(log_rate_consts[0] - log_rate_const)
+        for log_rate_const in log_rate_consts[1:]
+    ])
@@ -43,7 +43,7 @@
 
 from tamkin.partf import Info, StatFysTerms, helper_vibrations, \
     helpert_vibrations, helpertt_vibrations, helper_levels, helpert_levels, \
-    helpertt_levels
+    helpertt_levels, helpers_vibrations, helpers_levels, _as_temp
 from tamkin.nma import NMA, MBH
 from tamkin.geom import transrot_basis
 
@@ -607,6 +607,7 @@ class Rotor(Info, StatFysTerms):
 
     def helper_terms(self, temp, n):
         """See :meth:`tamkin.partf.StatFysTerms.helper_terms`"""
+        temp = _as_temp(temp)
         return numpy.array([
             -helper_vibrations(temp, n, self.cancel_freq, self.classical,
                                  self.freq_scaling, self.zp_scaling),
@@ -628,3 +629,17 @@ class Rotor(Info, StatFysTerms):
                                    self.freq_scaling, self.zp_scaling),
             helpertt_levels(temp, n, self.energy_levels),
         ])
+
+    def helpers_terms(self, temp, kinds):
+        """See :meth:`tamkin.partf.StatFysTerms.helpers_terms`"""
+        vibrations = helpers_vibrations(temp, kinds, self.cancel_freq,
+            self.classical, self.freq_scaling, self.zp_scaling)
+        levels = helpers_levels(temp, kinds, self.energy_levels)
+        result = {}
+        for kind in kinds:
+            if kind in ("helpert", "helpertt"):
+                rotor = levels[kind]
+            else:
+                rotor = levels[kind] - numpy.log(self.rotsym)
+            result[kind] = numpy.array([-vibrations[kind], rotor])
+        return result
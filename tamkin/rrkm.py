@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+# TAMkin is a post-processing toolkit for normal mode analysis, thermochemistry
+# and reaction kinetics.
+# Copyright (C) 2008-2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, An Ghysels
+# <An.Ghysels@UGent.be> and Matthias Vandichel <Matthias.Vandichel@UGent.be>
+# Center for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all
+# rights reserved unless otherwise stated.
+#
+# This file is part of TAMkin.
+#
+# TAMkin is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# In addition to the regulations of the GNU General Public License,
+# publications and communications based in parts on this program or on
+# parts of this program are required to cite the following article:
+#
+# "TAMkin: A Versatile Package for Vibrational Analysis and Chemical Kinetics",
+# An Ghysels, Toon Verstraelen, Karen Hemelsoet, Michel Waroquier and Veronique
+# Van Speybroeck, Journal of Chemical Information and Modeling, 2010, 50,
+# 1736-1750W
+# http://dx.doi.org/10.1021/ci100099g
+#
+# TAMkin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+"""RRKM theory and a master equation for pressure-dependent rate constants
+
+   The class :class:`RRKM` computes microcanonical rate constants k(E) for a
+   unimolecular :class:`tamkin.chemmod.KineticModel`, based on the densities
+   and sums of states from :mod:`tamkin.microcanonical`. The class
+   :class:`MasterEquation` adds collisional energy transfer with a bath gas
+   (exponential-down model) and computes the thermal rate constants k(T,p) in
+   the fall-off regime. The results can be summarized with a :class:`PLOG`
+   table or a :class:`Troe` fit. For example::
+
+     >>> rrkm = RRKM(km, 10*planck*lightspeed/centimeter, 60000*planck*lightspeed/centimeter)
+     >>> me = MasterEquation(rrkm, 39.95*amu, 3.5*angstrom, 100*kelvin*boltzmann,
+     ...                     200*planck*lightspeed/centimeter)
+     >>> temps = numpy.arange(600, 1501, 100.0)
+     >>> pressures = 10**numpy.arange(-3, 3.1, 0.5)*bar
+     >>> rate_consts = me.falloff(temps, pressures)
+     >>> troe = Troe(temps, pressures, rate_consts, me.low_pressure_limit(temps),
+     ...             rrkm.canonical_rate_constant(temps))
+
+   Tunneling corrections are not included in the microcanonical rate constants.
+"""
+
+
+from molmod import boltzmann, planck, kelvin
+
+import numpy
+
+from tamkin.partf import _as_temp, _as_result
+from tamkin.microcanonical import DensityOfStates
+
+
+__all__ = ["RRKM", "MasterEquation", "fit_arrhenius", "PLOG", "Troe"]
+
+
+class RRKM(object):
+    """Microcanonical rate constants of a unimolecular reaction."""
+
+    def __init__(self, km, grain, energy_max, fft=False):
+        """
+           Arguments:
+            | ``km`` -- A KineticModel with one reactant and a transition state
+            | ``grain`` -- The width of an energy grain
+            | ``energy_max`` -- The highest energy to consider, measured from
+                                the ground state of the reactant
+
+           Optional argument:
+            | ``fft`` -- Use fast Fourier transforms to convolve in the
+                         external rotation, see
+                         :class:`tamkin.microcanonical.DensityOfStates`.
+                         [default=False]
+
+           The microcanonical rate constant is
+
+           .. math:: k(E) = \\frac{N^\\ddagger(E - E_0)}{h \\rho(E)}
+
+           where :math:`N^\\ddagger` is the sum of states of the transition
+           state, :math:`\\rho` is the density of states of the reactant and
+           :math:`E_0` is the difference between the ground state energies.
+
+           Useful attributes:
+            | ``energies`` -- The energies of the grains, measured from the
+                              ground state of the reactant
+            | ``rate_constants`` -- The microcanonical rate constants
+            | ``barrier`` -- The zero-point corrected barrier
+        """
+        reactants = [(pf, st) for pf, st in km._iter_pfs() if st < 0]
+        transition_states = [(pf, st) for pf, st in km._iter_pfs() if st > 0]
+        if len(reactants) != 1 or reactants[0][1] != -1 or \
+           len(transition_states) != 1 or transition_states[0][1] != 1:
+            raise ValueError("RRKM theory requires a unimolecular reaction.")
+        self.km = km
+        self.grain = grain
+        self.dos_react = DensityOfStates(reactants[0][0], grain, energy_max, fft)
+        self.dos_trans = DensityOfStates(transition_states[0][0], grain, energy_max, fft)
+        self.barrier = self.dos_trans.ground_energy - self.dos_react.ground_energy
+        shift = int(round(self.barrier/grain))
+        if shift < 0:
+            raise ValueError("The ground state of the transition state is below the reactant.")
+        size = len(self.dos_react.counts)
+        # The sum of states at the center of each grain.
+        sums = numpy.zeros(size, float)
+        if shift < size:
+            sums[shift:] = (self.dos_trans.sums - 0.5*self.dos_trans.counts)[:size-shift]
+        sums = sums.clip(0, numpy.inf)
+        densities = self.dos_react.densities
+        self.rate_constants = numpy.zeros(size, float)
+        mask = densities > 0
+        self.rate_constants[mask] = sums[mask]/(planck*densities[mask])
+
+    energies = property(lambda self: self.dos_react.energies)
+
+    def canonical_rate_constant(self, temp):
+        """The high-pressure limit of the thermal rate constant.
+
+           Argument:
+            | ``temp`` -- the temperature (or an array of temperatures)
+
+           This is the Boltzmann average of the microcanonical rate constants.
+           It agrees with the transition state theory result (without
+           tunneling) of the kinetic model, up to discretization errors.
+        """
+        temp = _as_temp(temp)
+        beta = 1.0/(boltzmann*temp)
+        weights = self.dos_react.counts*numpy.exp(-beta.reshape(beta.shape + (1,))*self.energies)
+        return _as_result((weights*self.rate_constants).sum(axis=-1)/weights.sum(axis=-1))
+
+
+class MasterEquation(object):
+    """A one-dimensional energy-grained master equation for a unimolecular reaction."""
+
+    def __init__(self, rrkm, bath_mass, sigma, epsilon, alpha, alpha_power=0.0, cutoff=10.0):
+        """
+           Arguments:
+            | ``rrkm`` -- An RRKM object
+            | ``bath_mass`` -- The mass of a bath gas molecule
+            | ``sigma`` -- The Lennard-Jones diameter for collisions between
+                           the reactant and the bath gas
+            | ``epsilon`` -- The Lennard-Jones well depth for collisions between
+                             the reactant and the bath gas
+            | ``alpha`` -- The average energy transferred in a deactivating
+                           collision at 300K, <Delta E_down>
+
+           Optional arguments:
+            | ``alpha_power`` -- The temperature dependence of alpha:
+                                 alpha*(T/300K)**alpha_power. [default=0.0]
+            | ``cutoff`` -- Transitions over more than cutoff*alpha are
+                            neglected, which makes the collision matrix
+                            banded. [default=10.0]
+
+           The collision frequency is computed with the Lennard-Jones
+           collision integral of Troe (J. Chem. Phys. 66, 4758 (1977)). The
+           down transitions follow the exponential-down model and the up
+           transitions are obtained from detailed balance.
+        """
+        self.rrkm = rrkm
+        self.bath_mass = bath_mass
+        self.sigma = sigma
+        self.epsilon = epsilon
+        self.alpha = alpha
+        self.alpha_power = alpha_power
+        self.cutoff = cutoff
+        pf_react = rrkm.dos_react.pf
+        if not hasattr(pf_react, "translational"):
+            raise ValueError("The reactant partition function must have an ExtTrans term.")
+        mass = pf_react.translational.mass
+        self.reduced_mass = mass*bath_mass/(mass + bath_mass)
+        # only grains that contain states take part in the master equation
+        self.mask = rrkm.dos_react.counts > 0
+
+    def collision_frequency(self, temp, pressures):
+        """The number of collisions per unit of time.
+
+           Arguments:
+            | ``temp`` -- the temperature
+            | ``pressures`` -- the pressure (or an array of pressures)
+        """
+        pressures = numpy.asarray(pressures, float)
+        concentrations = pressures/(boltzmann*temp)
+        omega = 1.0/(0.636 + 0.567*numpy.log10(boltzmann*temp/self.epsilon))
+        speed = numpy.sqrt(8*boltzmann*temp/(numpy.pi*self.reduced_mass))
+        return _as_result(concentrations*numpy.pi*self.sigma**2*speed*omega)
+
+    def _collision_matrix(self, temp):
+        """Construct the symmetrized collision operator for one temperature.
+
+           Returns the banded matrix in the lower storage format of LAPACK, i.e.
+           row k contains the k-th subdiagonal, and the rate constants of the
+           grains included in the master equation.
+
+           The transition rate from grain j down to grain i is proportional
+           to exp(-(E_j-E_i)/alpha)/N_j, with N_j the sum of these factors over
+           all i <= j. The up transitions follow from detailed balance. After
+           the similarity transformation with the square root of the Boltzmann
+           distribution, the operator becomes symmetric.
+        """
+        energies = self.rrkm.energies[self.mask]
+        rate_constants = self.rrkm.rate_constants[self.mask]
+        size = len(energies)
+        alpha = self.alpha*(temp/(300*kelvin))**self.alpha_power
+        # the band width
+        band = int(numpy.ceil(self.cutoff*alpha/self.rrkm.grain))
+        band = min(max(band, 1), size - 1)
+        log_f = self._log_populations(temp)
+        # down[k, j] is the unnormalized probability for a transition from
+        # grain j to grain j-k.
+        down = numpy.zeros((band + 1, size), float)
+        for k in xrange(band + 1):
+            down[k, k:] = numpy.exp(-(energies[k:] - energies[:size-k])/alpha)
+        norms = down.sum(axis=0)
+        result = numpy.zeros((band + 1, size), float)
+        for k in xrange(1, band + 1):
+            # symmetrized element between grains i=j-k (lower) and j (upper),
+            # stored as element [k, i] in the lower band.
+            upper = numpy.arange(k, size)
+            lower = upper - k
+            result[k, lower] = down[k, upper]/norms[upper]*numpy.exp(0.5*(log_f[upper] - log_f[lower]))
+        # The diagonal contains minus the total rate of collisional transitions
+        # out of each grain. The down part is the off-diagonal part of the
+        # column of down transitions, the up part follows from detailed balance.
+        out_down = (down[1:]/norms).sum(axis=0)
+        out_up = numpy.zeros(size, float)
+        for k in xrange(1, band + 1):
+            upper = numpy.arange(k, size)
+            lower = upper - k
+            out_up[lower] += down[k, upper]/norms[upper]*numpy.exp(log_f[upper] - log_f[lower])
+        result[0] = -(out_down + out_up)
+        return result, rate_constants
+
+    def _log_populations(self, temp):
+        """The logarithm of the Boltzmann populations of the grains."""
+        counts = self.rrkm.dos_react.counts[self.mask]
+        energies = self.rrkm.energies[self.mask]
+        return numpy.log(counts) - energies/(boltzmann*temp)
+
+    def rate_constants(self, temp, pressures, tolerance=1e-12, max_iter=100):
+        """Compute the thermal rate constants at one temperature.
+
+           Arguments:
+            | ``temp`` -- the temperature
+            | ``pressures`` -- a pressure or an array of pressures
+
+           Optional arguments:
+            | ``tolerance`` -- the convergence criterion for the inverse
+                               iteration [default=1e-12]
+            | ``max_iter`` -- the maximum number of iterations [default=100]
+
+           The rate constant is the smallest eigenvalue of minus the master
+           equation operator. The collision matrix is constructed only once
+           for all pressures. The eigenvalue is computed with inverse
+           iteration, using a banded Cholesky factorization of the
+           (symmetrized) operator for each pressure.
+        """
+        pressures = numpy.asarray(pressures, float)
+        collisions, rate_constants = self._collision_matrix(temp)
+        frequencies = numpy.array(self.collision_frequency(temp, pressures.ravel()), ndmin=1)
+        # the equilibrium distribution is a good initial guess
+        guess = numpy.exp(0.5*self._log_populations(temp))
+        result = numpy.zeros(len(frequencies), float)
+        for i, frequency in enumerate(frequencies):
+            operator = -frequency*collisions
+            operator[0] += rate_constants
+            result[i] = _smallest_eigenvalue(operator, guess, tolerance, max_iter)
+        return _as_result(result.reshape(pressures.shape))
+
+    def falloff(self, temps, pressures):
+        """Compute the rate constants on a grid of temperatures and pressures.
+
+           Arguments:
+            | ``temps`` -- an array of temperatures
+            | ``pressures`` -- an array of pressures
+
+           Returns an array with shape (len(temps), len(pressures)).
+        """
+        return numpy.array([self.rate_constants(temp, pressures) for temp in temps])
+
+    def low_pressure_limit(self, temps, tolerance=1e-12, max_iter=100):
+        """The low-pressure limit k_0 of the rate constant.
+
+           Argument:
+            | ``temps`` -- the temperature (or an array of temperatures)
+
+           Optional arguments:
+            | ``tolerance`` -- the convergence criterion for the inverse
+                               iteration [default=1e-12]
+            | ``max_iter`` -- the maximum number of iterations [default=100]
+
+           The result is the second-order rate constant, i.e. k/[M] in the
+           limit of zero pressure, where [M] is the concentration of the bath
+           gas. In this limit, every grain above the threshold reacts before
+           the next collision. The rate constant then follows from the
+           collision operator restricted to the grains below the threshold
+           (with absorbing boundary conditions), which is independent of
+           k(E). For large molecules, this limit is only reached at extremely
+           low pressures.
+        """
+        temps = _as_temp(temps)
+        result = numpy.zeros(temps.shape, float)
+        below = (self.rrkm.rate_constants[self.mask] == 0).sum()
+        for index, temp in numpy.ndenumerate(temps):
+            collisions = self._collision_matrix(temp)[0]
+            guess = numpy.exp(0.5*self._log_populations(temp)[:below])
+            eigenvalue = _smallest_eigenvalue(-collisions[:,:below], guess, tolerance, max_iter)
+            # convert the collision frequency at unit pressure to a second
+            # order rate constant
+            result[index] = eigenvalue*self.collision_frequency(temp, 1.0)*boltzmann*temp
+        return _as_result(result)
+
+
+def _smallest_eigenvalue(operator, guess, tolerance, max_iter):
+    """Inverse iteration for a banded positive definite matrix.
+
+       Arguments:
+        | ``operator`` -- the matrix in the lower banded storage format
+        | ``guess`` -- the initial guess of the eigenvector
+        | ``tolerance`` -- the relative convergence criterion
+        | ``max_iter`` -- the maximum number of iterations
+
+       A ValueError is raised when the eigenvalue is not converged after
+       max_iter iterations.
+    """
+    from scipy.linalg import cholesky_banded, cho_solve_banded
+    band = min(len(operator), len(guess))
+    factor = cholesky_banded(operator[:band], lower=True)
+    x = guess/numpy.linalg.norm(guess)
+    value = 0.0
+    for counter in xrange(max_iter):
+        y = cho_solve_banded((factor, True), x)
+        new_value = 1.0/numpy.dot(x, y)
+        x = y/numpy.linalg.norm(y)
+        if abs(new_value - value) <= tolerance*abs(new_value):
+            return new_value
+        value = new_value
+    raise ValueError("The inverse iteration did not converge in %i iterations." % max_iter)
+
+
+def fit_arrhenius(temps, rate_consts):
+    """Fit the modified Arrhenius law, k = A*T**n*exp(-Ea/(k_B*T)).
+
+       Arguments:
+        | ``temps`` -- an array with temperatures
+        | ``rate_consts`` -- an array with rate constants. The first index
+                             corresponds to the temperatures. Additional
+                             indexes (e.g. for pressures) are fitted
+                             independently, with one least squares solve.
+
+       Returns A, n and Ea. (Arrays if rate_consts has more than one index.)
+    """
+    temps = numpy.asarray(temps, float)
+    rate_consts = numpy.asarray(rate_consts, float)
+    design_matrix = numpy.array([
+        numpy.ones(len(temps)), numpy.log(temps), -1.0/(boltzmann*temps)
+    ]).transpose()
+    rhs = numpy.log(rate_consts).reshape(len(temps), -1)
+    solution = numpy.linalg.lstsq(design_matrix, rhs)[0]
+    shape = rate_consts.shape[1:]
+    return (
+        _as_result(numpy.exp(solution[0]).reshape(shape)),
+        _as_result(solution[1].reshape(shape)),
+        _as_result(solution[2].reshape(shape)),
+    )
+
+
+class PLOG(object):
+    """Pressure-dependent rate constants with one Arrhenius fit per pressure."""
+
+    def __init__(self, temps, pressures, rate_consts):
+        """
+           Arguments:
+            | ``temps`` -- an array with temperatures
+            | ``pressures`` -- an array with (increasing) pressures
+            | ``rate_consts`` -- an array with rate constants with shape
+                                 (len(temps), len(pressures))
+
+           Useful attributes:
+            | ``A``, ``n``, ``Ea`` -- arrays with the modified Arrhenius
+                                      parameters for each pressure
+        """
+        self.pressures = numpy.asarray(pressures, float)
+        self.A, self.n, self.Ea = fit_arrhenius(temps, rate_consts)
+
+    def __call__(self, temp, pressure):
+        """Evaluate the rate constant.
+
+           The logarithm of the rate constant is interpolated linearly in the
+           logarithm of the pressure. Outside the range of pressures, the
+           closest fit is used.
+        """
+        log_ks = numpy.log(self.A) + self.n*numpy.log(temp) - self.Ea/(boltzmann*temp)
+        return numpy.exp(numpy.interp(numpy.log(pressure), numpy.log(self.pressures), log_ks))
+
+
+def _troe_log_f(log_pr, log_fcent):
+    """The base-10 logarithm of the Troe broadening factor."""
+    c = -0.4 - 0.67*log_fcent
+    n = 0.75 - 1.27*log_fcent
+    x = log_pr + c
+    return log_fcent/(1 + (x/(n - 0.14*x))**2)
+
+
+class Troe(object):
+    """The Troe fall-off expression fitted to master equation results."""
+
+    def __init__(self, temps, pressures, rate_consts, k0s, kinfs):
+        """
+           Arguments:
+            | ``temps`` -- an array with temperatures
+            | ``pressures`` -- an array with pressures
+            | ``rate_consts`` -- an array with rate constants with shape
+                                 (len(temps), len(pressures))
+            | ``k0s`` -- the low-pressure limits (second order) for each
+                         temperature
+            | ``kinfs`` -- the high-pressure limits for each temperature
+
+           The low- and high-pressure limits are fitted with the modified
+           Arrhenius law. For each temperature, the broadening factor F_cent
+           is fitted to the rate constants, after which the three-parameter
+           expression F_cent = (1-a)*exp(-T/T3) + a*exp(-T/T1) is fitted to
+           these values.
+
+           Useful attributes:
+            | ``k0_params``, ``kinf_params`` -- tuples (A, n, Ea)
+            | ``fcents`` -- the fitted F_cent for each temperature
+            | ``a``, ``T3``, ``T1`` -- the parameters of F_cent(T)
+        """
+        from scipy.optimize import fminbound, leastsq
+        temps = numpy.asarray(temps, float)
+        pressures = numpy.asarray(pressures, float)
+        rate_consts = numpy.asarray(rate_consts, float)
+        k0s = numpy.asarray(k0s, float)
+        kinfs = numpy.asarray(kinfs, float)
+        self.k0_params = fit_arrhenius(temps, k0s)
+        self.kinf_params = fit_arrhenius(temps, kinfs)
+
+        self.fcents = numpy.zeros(len(temps), float)
+        for i, temp in enumerate(temps):
+            pr = k0s[i]*pressures/(boltzmann*temp)/kinfs[i]
+            log_pr = numpy.log10(pr)
+            log_f = numpy.log10(rate_consts[i]/(kinfs[i]*pr/(1 + pr)))
+            def error(log_fcent):
+                return ((_troe_log_f(log_pr, log_fcent) - log_f)**2).sum()
+            self.fcents[i] = 10**fminbound(error, -3.0, 0.0)
+
+        def residuals(params):
+            return self._fcent(temps, params) - self.fcents
+        # initial guess: the slow decay is responsible for the smallest value
+        # and the fast decay explains the largest value.
+        a = 0.5*self.fcents.min()
+        T3 = temps.min()/-numpy.log((self.fcents.max() - a)/(1 - a))
+        params = leastsq(residuals, [a, T3, 100*temps.max()])[0]
+        self.a, self.T3, self.T1 = params
+
+    def _fcent(self, temp, params=None):
+        if params is None:
+            params = self.a, self.T3, self.T1
+        a, T3, T1 = params
+        return (1 - a)*numpy.exp(-temp/T3) + a*numpy.exp(-temp/T1)
+
+    def __call__(self, temp, pressure):
+        """Evaluate the rate constant with the Troe expression."""
+        A, n, Ea = self.k0_params
+        k0 = A*temp**n*numpy.exp(-Ea/(boltzmann*temp))
+        A, n, Ea = self.kinf_params
+        kinf = A*temp**n*numpy.exp(-Ea/(boltzmann*temp))
+        pr = k0*pressure/(boltzmann*temp)/kinf
+        log_fcent = numpy.log10(self._fcent(temp))
+        return kinf*pr/(1 + pr)*10**_troe_log_f(numpy.log10(pr), log_fcent)
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+# TAMkin is a post-processing toolkit for normal mode analysis, thermochemistry
+# and reaction kinetics.
+# Copyright (C) 2008-2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, An Ghysels
+# <An.Ghysels@UGent.be> and Matthias Vandichel <Matthias.Vandichel@UGent.be>
+# Center for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all
+# rights reserved unless otherwise stated.
+#
+# This file is part of TAMkin.
+#
+# TAMkin is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# In addition to the regulations of the GNU General Public License,
+# publications and communications based in parts on this program or on
+# parts of this program are required to cite the following article:
+#
+# "TAMkin: A Versatile Package for Vibrational Analysis and Chemical Kinetics",
+# An Ghysels, Toon Verstraelen, Karen Hemelsoet, Michel Waroquier and Veronique
+# Van Speybroeck, Journal of Chemical Information and Modeling, 2010, 50,
+# 1736-1750W
+# http://dx.doi.org/10.1021/ci100099g
+#
+# TAMkin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+"""Fast surrogates for partition functions on a temperature interval
+
+   A :class:`Surrogate` approximates the logarithm of a partition function (or
+   of one of its contributions) with a piecewise Chebyshev series in ln(T). The
+   intervals are refined automatically until a given tolerance is met. Once the
+   surrogate is constructed, the cost of an evaluation no longer depends on the
+   number of vibrational frequencies or rotor levels. The first and second
+   derivatives towards ln(T) are fitted as separate series to the analytical
+   derivatives, on the same intervals, such that no accuracy is lost by
+   differentiating the series of the logarithm itself.
+
+   The function :func:`surrogate_model` replaces all partition functions in a
+   (kinetic or thermodynamic) model by their surrogates. For example::
+
+     >>> sur = Surrogate(pf, 300, 1500, tolerance=1e-8)
+     >>> sur.heat_capacity(numpy.linspace(300, 1500, 10000))
+     >>> km_fast = surrogate_model(km, 300, 1500)
+     >>> km_fast.rate_constant(750.3)
+"""
+
+
+from molmod import boltzmann
+
+import copy, numpy
+from numpy.polynomial import chebyshev
+
+from tamkin.partf import Info, StatFys, _as_temp, _as_result
+
+
+__all__ = ["Surrogate", "surrogate_model"]
+
+
+class Surrogate(Info, StatFys):
+    r"""A piecewise Chebyshev approximation of a partition function.
+
+       The logarithm of the partition function is written as
+
+       .. math:: \ln(Z(T)) = f(\ln(T)) - \frac{E_0}{k_B T}
+
+       where :math:`E_0` is the low-temperature limit of the free energy. The
+       smooth function :math:`f` and its first and second derivative towards
+       ln(T) are approximated with piecewise Chebyshev series. (The
+       derivatives are fitted to the analytical derivatives, instead of
+       differentiating the series of :math:`f`, which would amplify the
+       round-off errors on small intervals.) The differences between the helper
+       functions ``helpern``, ``helperv`` and ``helper`` are approximated with
+       separate series on the same intervals.
+
+       All attributes that are not defined by the surrogate are taken from the
+       original object, e.g. ``electronic`` or ``title`` of a partition
+       function.
+    """
+    def __init__(self, statfys, temp_low, temp_high, tolerance=1e-8, degree=12, max_pieces=1000):
+        """
+           Arguments:
+            | ``statfys`` -- A PartFun object or one of its contributions
+            | ``temp_low`` -- The lower bound of the temperature interval
+            | ``temp_high`` -- The upper bound of the temperature interval
+
+           Optional arguments:
+            | ``tolerance`` -- The maximum (absolute) error on ln(Z), on
+                               T d ln(Z)/dT and on T^2 d^2 ln(Z)/dT^2 + T
+                               d ln(Z)/dT. The errors on the entropy and the heat
+                               capacity, expressed in units of the Boltzmann
+                               constant, are also below the tolerance.
+                               [default=1e-8]
+            | ``degree`` -- The degree of the Chebyshev series on each
+                            interval. [default=12]
+            | ``max_pieces`` -- The maximum number of intervals. A ValueError
+                                is raised when the tolerance can not be
+                                reached with this number of intervals.
+                                [default=1000]
+
+           The tolerance is verified on a set of test points in each interval
+           (the extrema of the Chebyshev polynomial of the given degree, which
+           interlace with the interpolation points).
+           Tolerances below the round-off errors on the original helper
+           functions can not be reached. (These are dominated by the term
+           E_0/(k_B T), which is large for molecules with a large electronic
+           energy.)
+        """
+        if temp_low <= 0 or temp_high <= temp_low:
+            raise ValueError("The temperature interval must be positive and non-empty.")
+        self.statfys = statfys
+        self.temp_low = float(temp_low)
+        self.temp_high = float(temp_high)
+        self.tolerance = tolerance
+        self.degree = degree
+        self.max_pieces = max_pieces
+        try:
+            self.energy0 = -boltzmann*statfys.helper(0.0, 1)
+        except NotImplementedError:
+            self.energy0 = 0.0
+        Info.__init__(self, getattr(statfys, "name", "surrogate"))
+        self._fit()
+
+    def __getattr__(self, name):
+        # only called when the attribute is not found in the usual places.
+        if name == "statfys":
+            raise AttributeError(name)
+        return getattr(self.statfys, name)
+
+    num_pieces = property(lambda self: len(self.bounds) - 1)
+
+    def _exact(self, x):
+        """Compute the functions that are approximated, and their derivatives.
+
+           Argument:
+            | ``x`` -- an array with the logarithm of the temperatures
+
+           Returns f, f', f'', the difference helpern - helper and the
+           difference helperv - helper.
+        """
+        temp = numpy.exp(x)
+        kinds = ["helper", "helpert", "helpertt", "helpern", "helperv"]
+        h = self.statfys.helpers(temp, kinds)
+        e0 = self.energy0/(boltzmann*temp)
+        f = h["helper"] + e0
+        fd = temp*h["helpert"] - e0
+        fdd = temp*h["helpert"] + temp**2*h["helpertt"] + e0
+        return (f, fd, fdd, h["helpern"] - h["helper"], h["helperv"] - h["helper"])
+
+    def _fit_piece(self, x_low, x_high):
+        """Fit the Chebyshev series on one interval and test the error.
+
+           Returns a list of coefficient arrays and the maximum error.
+        """
+        m = self.degree + 1
+        mid = 0.5*(x_high + x_low)
+        half = 0.5*(x_high - x_low)
+        nodes = numpy.cos(numpy.pi*(numpy.arange(m) + 0.5)/m)
+        exact = self._exact(mid + half*nodes)
+        coeffs = [chebyshev.chebfit(nodes, values, self.degree) for values in exact]
+        # test the fit in between the interpolation points
+        check = numpy.cos(numpy.pi*numpy.arange(m+1)/m)
+        exact = self._exact(mid + half*check)
+        errors = [
+            abs(chebyshev.chebval(check, c) - values).max()
+            for c, values in zip(coeffs, exact)
+        ]
+        # The errors on the entropy/k (f + f') and heat capacity/k (f' + f'')
+        # are also below the tolerance when the errors on f, f' and f'' are
+        # below half of it.
+        error = max(2*max(errors[:3]), max(errors[3:]))
+        return coeffs, error
+
+    def _fit(self):
+        """Refine the intervals until the tolerance is met."""
+        todo = [(numpy.log(self.temp_low), numpy.log(self.temp_high))]
+        pieces = []
+        while len(todo) > 0:
+            x_low, x_high = todo.pop()
+            coeffs, error = self._fit_piece(x_low, x_high)
+            if error <= self.tolerance:
+                pieces.append((x_low, x_high, coeffs))
+            elif len(pieces) + len(todo) + 2 > self.max_pieces:
+                raise ValueError("Could not reach the tolerance (%.1e) with %i intervals." % (self.tolerance, self.max_pieces))
+            else:
+                x_mid = 0.5*(x_low + x_high)
+                todo.append((x_mid, x_high))
+                todo.append((x_low, x_mid))
+        pieces.sort()
+        self.bounds = numpy.array([piece[0] for piece in pieces] + [pieces[-1][1]])
+        # coefficients for f, f', f'', helpern - helper and helperv - helper,
+        # (derivatives towards ln(T))
+        self.coeffs = numpy.array([
+            [piece[2][i] for piece in pieces] for i in xrange(5)
+        ])
+
+    def _evaluate(self, temp, which):
+        """Evaluate some of the series.
+
+           Arguments:
+            | ``temp`` -- an array with temperatures
+            | ``which`` -- a list with indexes of the series (0: f, 1: f',
+                           2: f'', 3: helpern - helper, 4: helperv - helper)
+        """
+        if (temp < self.temp_low*(1-1e-12)).any() or (temp > self.temp_high*(1+1e-12)).any():
+            raise ValueError("Temperatures must be in the interval [%s, %s]." % (self.temp_low, self.temp_high))
+        x = numpy.log(temp).ravel()
+        indexes = numpy.searchsorted(self.bounds, x) - 1
+        indexes = numpy.clip(indexes, 0, self.num_pieces - 1)
+        x_low = self.bounds[indexes]
+        x_high = self.bounds[indexes+1]
+        t = (2*x - x_low - x_high)/(x_high - x_low)
+        result = []
+        for i in which:
+            # Clenshaw recursion with different coefficients for each point
+            coeffs = self.coeffs[i,indexes]
+            b1 = 0.0
+            b2 = 0.0
+            for k in xrange(coeffs.shape[1]-1, 0, -1):
+                b1, b2 = 2*t*b1 - b2 + coeffs[:,k], b1
+            result.append((t*b1 - b2 + coeffs[:,0]).reshape(temp.shape))
+        return result
+
+    def helper(self, temp, n):
+        """See :meth:`tamkin.partf.StatFys.helper`."""
+        temp = _as_temp(temp)
+        f, = self._evaluate(temp, [0])
+        return _as_result(temp**n*(f - self.energy0/(boltzmann*temp)))
+
+    def helpert(self, temp, n):
+        """See :meth:`tamkin.partf.StatFys.helpert`."""
+        temp = _as_temp(temp)
+        fd, = self._evaluate(temp, [1])
+        return _as_result(temp**(n-1)*(fd + self.energy0/(boltzmann*temp)))
+
+    def helpertt(self, temp, n):
+        """See :meth:`tamkin.partf.StatFys.helpertt`."""
+        temp = _as_temp(temp)
+        fd, fdd = self._evaluate(temp, [1, 2])
+        return _as_result(temp**(n-2)*(fdd - fd - 2*self.energy0/(boltzmann*temp)))
+
+    def helpern(self, temp, n):
+        """See :meth:`tamkin.partf.StatFys.helpern`."""
+        temp = _as_temp(temp)
+        f, dn = self._evaluate(temp, [0, 3])
+        return _as_result(temp**n*(f + dn - self.energy0/(boltzmann*temp)))
+
+    def helperv(self, temp, n):
+        """See :meth:`tamkin.partf.StatFys.helperv`."""
+        temp = _as_temp(temp)
+        f, dv = self._evaluate(temp, [0, 4])
+        return _as_result(temp**n*(f + dv - self.energy0/(boltzmann*temp)))
+
+    def helpers(self, temp, kinds):
+        """See :meth:`tamkin.partf.StatFys.helpers`."""
+        temp = _as_temp(temp)
+        f, fd, fdd, dn, dv = self._evaluate(temp, range(5))
+        e0 = self.energy0/(boltzmann*temp)
+        values = {
+            "helper": (f - e0),
+            "helpert": (fd + e0)/temp,
+            "helpertt": (fdd - fd - 2*e0)/temp**2,
+            "helpern": (f + dn - e0),
+            "helperv": (f + dv - e0),
+        }
+        return dict((kind, _as_result(values[kind])) for kind in kinds)
+
+    def zero_point_energy(self, helpern=None):
+        """See :meth:`tamkin.partf.StatFys.zero_point_energy`.
+
+           This is computed with the original object because the temperature
+           is outside the interval of the surrogate.
+        """
+        return self.statfys.zero_point_energy()
+
+    def dump(self, f):
+        """See :meth:`tamkin.partf.Info.dump`."""
+        print >> f, "Surrogate for temperatures in [%.2f, %.2f] K" % (self.temp_low, self.temp_high)
+        print >> f, "    Tolerance: %.1e" % self.tolerance
+        print >> f, "    Chebyshev degree: %i" % self.degree
+        print >> f, "    Number of intervals: %i" % self.num_pieces
+        self.statfys.dump(f)
+
+
+def surrogate_model(model, temp_low, temp_high, tolerance=1e-8, **kwargs):
+    """Return a copy of a model in which each PartFun is replaced by a Surrogate.
+
+       Arguments:
+        | ``model`` -- A ThermodynamicModel, KineticModel or
+                       ActivationKineticModel object.
+        | ``temp_low`` -- The lower bound of the temperature interval
+        | ``temp_high`` -- The upper bound of the temperature interval
+
+       Optional arguments:
+        | ``tolerance`` -- See :class:`Surrogate`.
+
+       Other keyword arguments are passed to the constructor of the Surrogate
+       objects. A partition function that appears in several (sub)models is
+       replaced by the same surrogate.
+    """
+    surrogates = {}
+    def convert(model):
+        result = copy.copy(model)
+        result.pfs_all = {}
+        result.pfs_list = []
+        for pf in model.pfs_list:
+            sur = surrogates.get(pf)
+            if sur is None:
+                sur = Surrogate(pf, temp_low, temp_high, tolerance, **kwargs)
+                surrogates[pf] = sur
+            result.pfs_list.append(sur)
+            result.pfs_all[sur] = model.pfs_all[pf]
+        for name in "tm", "km":
+            submodel = getattr(model, name, None)
+            if submodel is not None:
+                setattr(result, name, convert(submodel))
+        return result
+    return convert(model)
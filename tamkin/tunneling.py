@@ -176,13 +176,11 @@ class Eckart(TunnelingCorrection):
 
     def __call__(self, temps):
         """See :meth:`TunnelingCorrection.__call__`."""
-        if hasattr(temps, "__len__"):
-            result = numpy.zeros(len(temps))
-            for i, temp in enumerate(temps):
-                result[i] = self._compute_one_temp(temp)
-            return result
-        else:
-            return self._compute_one_temp(temps)
+        temps = numpy.asarray(temps, float)
+        result = numpy.zeros(temps.shape, float)
+        for index, temp in numpy.ndenumerate(temps):
+            result[index] = self._compute_one_temp(temp)
+        return result[()]
 
 
 class Wigner(TunnelingCorrection):
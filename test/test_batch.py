@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# TAMkin is a post-processing toolkit for normal mode analysis, thermochemistry
+# and reaction kinetics.
+# Copyright (C) 2008-2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, An Ghysels
+# <An.Ghysels@UGent.be> and Matthias Vandichel <Matthias.Vandichel@UGent.be>
+# Center for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all
+# rights reserved unless otherwise stated.
+#
+# This file is part of TAMkin.
+#
+# TAMkin is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# In addition to the regulations of the GNU General Public License,
+# publications and communications based in parts on this program or on
+# parts of this program are required to cite the following article:
+#
+# "TAMkin: A Versatile Package for Vibrational Analysis and Chemical Kinetics",
+# An Ghysels, Toon Verstraelen, Karen Hemelsoet, Michel Waroquier and Veronique
+# Van Speybroeck, Journal of Chemical Information and Modeling, 2010, 50,
+# 1736-1750W
+# http://dx.doi.org/10.1021/ci100099g
+#
+# TAMkin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+
+
+from tamkin import *
+
+import copy, os, signal, tempfile, shutil
+import unittest
+import numpy
+
+
+__all__ = ["BatchTestCase"]
+
+
+def _load_broken(filename):
+    raise IOError("Could not read %s" % filename)
+
+
+def _load_killed(filename):
+    # mimic a worker that is killed by the operating system
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+class BatchTestCase(unittest.TestCase):
+    def get_jobs(self):
+        return [
+            BatchJob("test/input/sterck/aa.fchk"),
+            BatchJob("test/input/sterck/aarad.fchk", terms=[ExtTrans(cp=False), ExtRot(1)]),
+            BatchJob(("test/input/an/ethanol.cor", "test/input/an/ethanol.hess.full"), load_molecule_charmm, PHVA([0,1,2])),
+            BatchJob("test/input/sterck/paats.fchk", _load_broken),
+            BatchJob(load_molecule_g03fchk("test/input/sterck/paats.fchk"), treatment=ConstrainExt(), do_modes=False),
+        ]
+
+    def check_results(self, results, jobs):
+        self.assertEqual(sorted(result.index for result in results), list(range(len(jobs))))
+        for result in results:
+            job = jobs[result.index]
+            self.assert_(result.elapsed >= 0)
+            if job.loader is _load_broken:
+                self.assertEqual(result.value, None)
+                self.assert_("IOError" in result.error)
+                continue
+            self.assertEqual(result.error, None)
+            if isinstance(job.args, Molecule):
+                molecule = job.args
+            elif isinstance(job.args, tuple):
+                molecule = job.loader(*job.args)
+            else:
+                molecule = job.loader(job.args)
+            reference = NMA(molecule, copy.deepcopy(job.treatment), job.do_modes)
+            if job.terms is None:
+                nma = result.value
+                self.assert_(isinstance(nma, NMA))
+                self.assert_(abs(nma.freqs - reference.freqs).max() < 1e-12)
+                if job.do_modes:
+                    self.assert_(abs(abs(nma.modes) - abs(reference.modes)).max() < 1e-8)
+            else:
+                pf = result.value
+                self.assert_(isinstance(pf, PartFun))
+                pf_reference = PartFun(reference, [ExtTrans(cp=False), ExtRot(1)])
+                self.assert_(abs(pf.vibrational.freqs - pf_reference.vibrational.freqs).max() < 1e-12)
+                self.assertAlmostEqual(pf.free_energy(300.0), pf_reference.free_energy(300.0))
+
+    def test_serial(self):
+        jobs = self.get_jobs()
+        results = list(run_batch(jobs, num_workers=0))
+        self.assertEqual([result.index for result in results], list(range(len(jobs))))
+        self.check_results(results, jobs)
+        self.assertRaises(ValueError, list, run_batch(jobs, num_workers=-1))
+
+    def test_pool(self):
+        jobs = self.get_jobs()
+        for num_workers, max_in_flight in (1, 1), (2, 3), (3, None):
+            results = list(run_batch(jobs, num_workers, max_in_flight))
+            self.assertEqual([result.index for result in results], list(range(len(jobs))))
+            self.check_results(results, jobs)
+            results = list(run_batch(jobs, num_workers, max_in_flight, ordered=False))
+            self.check_results(results, jobs)
+        # submission order defined by a key
+        sizes = [-i for i in xrange(len(jobs))]
+        results = list(run_batch(jobs, 2, key=(lambda job: sizes[jobs.index(job)])))
+        self.assertEqual([result.index for result in results], list(reversed(range(len(jobs)))))
+        self.check_results(results, jobs)
+        # stop before all results are consumed
+        for result in run_batch(jobs, 2):
+            break
+        self.assertEqual(result.index, 0)
+
+    def test_timeout(self):
+        jobs = self.get_jobs()
+        jobs.insert(1, BatchJob("test/input/sterck/aa.fchk", _load_killed))
+        for ordered in True, False:
+            results = list(run_batch(jobs, 2, ordered=ordered, timeout=5.0))
+            if ordered:
+                self.assertEqual([result.index for result in results], list(range(len(jobs))))
+            results.sort(key=(lambda result: result.index))
+            self.assertEqual(results[1].value, None)
+            self.assert_(results[1].error.startswith("Timeout"))
+            del results[1]
+            for result in results[1:]:
+                result.index -= 1
+            self.check_results(results, jobs[:1] + jobs[2:])
+        self.assertRaises(ValueError, list, run_batch(jobs, 2, timeout=0.0))
+
+    def test_checkpoint(self):
+        dirname = tempfile.mkdtemp("tamkin-test-batch")
+        try:
+            jobs = [
+                BatchJob("test/input/sterck/aa.fchk", checkpoint=os.path.join(dirname, "aa.chk")),
+                BatchJob("test/input/sterck/aarad.fchk", checkpoint=os.path.join(dirname, "aarad.chk"), checkpoint_fields='partf'),
+            ]
+            for result in run_batch(jobs, 2):
+                self.assertEqual(result.error, None)
+                self.assertEqual(result.value, jobs[result.index].checkpoint)
+                nma = NMA.read_from_file(result.value)
+                reference = NMA(load_molecule_g03fchk(jobs[result.index].args))
+                self.assert_(abs(nma.freqs - reference.freqs).max() < 1e-12)
+        finally:
+            shutil.rmtree(dirname)
@@ -161,6 +161,27 @@ def test_molecule_checkpoint_full():
     assert (mol1.unit_cell.active == mol2.unit_cell.active).all()
     assert mol1.symbols == mol2.symbols
 
+def test_molecule_checkpoint_binary():
+    mol1 = load_molecule_g03fchk("test/input/sterck/aa.fchk")
+    mol1.set_default_graph()
+    mol1.unit_cell = UnitCell(numpy.identity(3, float)*25)
+    mol1.write_to_file("test/output/molecule_checkpoint_binary.chk", binary=True)
+    mol2 = Molecule.read_from_file("test/output/molecule_checkpoint_binary.chk")
+
+    assert (mol1.numbers == mol2.numbers).all()
+    assert (mol1.coordinates == mol2.coordinates).all()
+    assert (mol1.masses == mol2.masses).all()
+    assert mol1.energy == mol2.energy
+    assert (mol1.gradient == mol2.gradient).all()
+    assert (mol1.hessian == mol2.hessian).all()
+    assert mol1.multiplicity == mol2.multiplicity
+    assert mol1.symmetry_number == mol2.symmetry_number
+    assert mol1.periodic == mol2.periodic
+    assert mol1.graph.edges == mol2.graph.edges
+    assert mol1.title == mol2.title
+    assert (mol1.unit_cell.matrix == mol2.unit_cell.matrix).all()
+    assert (mol1.unit_cell.active == mol2.unit_cell.active).all()
+
 def test_copy_with():
     mol1 = load_molecule_g03fchk("test/input/sterck/aa.fchk")
     mol2 = mol1.copy_with(title="foo")
@@ -40,7 +40,7 @@ from molmod.periodic import periodic
 from molmod.units import angstrom, amu, calorie, avogadro, electronvolt
 from molmod.constants import lightspeed
 
-import unittest, numpy
+import unittest, numpy, os, shutil, tempfile
 
 
 __all__ = ["IOTestCase"]
@@ -79,6 +79,84 @@ class IOTestCase(unittest.TestCase):
         self.assertEqual(molecule.hessian.shape,(atoms*3,atoms*3))
         self.assertAlmostEqual(molecule.energy,-18612.352569964281 , 7)
 
+    def test_load_molecule_charmm_sparse(self):
+        molecule = load_molecule_charmm("test/input/an/ethanol.cor","test/input/an/ethanol.hess.full")
+        molecule_sparse = load_molecule_charmm("test/input/an/ethanol.cor","test/input/an/ethanol.hess.full", sparse=True)
+        self.assertEqual(molecule_sparse.hessian.format, "csr")
+        self.assertEqual(abs(molecule_sparse.hessian.toarray() - molecule.hessian).max(), 0.0)
+        self.assertEqual(molecule_sparse.hessian.nnz, (molecule.hessian != 0).sum())
+        self.assertEqual(abs(molecule.hessian - molecule.hessian.transpose()).max(), 0.0)
+        self.assertEqual(molecule.numbers.tolist(), [6, 8, 1, 1, 1, 6, 1, 1, 1])
+
+    def test_charmm_triangle(self):
+        from tamkin.io.charmm import _read_columns, _unpack_triangle, _unpack_triangle_sparse
+        size = 7
+        numpy.random.seed(4)
+        packed = numpy.random.normal(0, 1, size*(size+1)//2)
+        packed[::3] = 0.0
+        dense = _unpack_triangle(packed, size)
+        rows, cols = numpy.triu_indices(size)
+        self.assert_((dense[rows, cols] == packed).all())
+        self.assert_((dense == dense.transpose()).all())
+        indices = packed.nonzero()[0]
+        sparse = _unpack_triangle_sparse(indices, packed[indices], size)
+        self.assert_((sparse.toarray() == dense).all())
+        # parse the triangle in small chunks, with a counter in the first column
+        f = file("test/output/charmm_triangle.txt", "w")
+        for i, value in enumerate(packed):
+            print >> f, "%5i %20.15f" % (i, value)
+        print >> f, "remainder"
+        f.close()
+        f = file("test/output/charmm_triangle.txt")
+        chunks = list(_read_columns(f, len(packed), chunk_size=5))
+        self.assertEqual(f.next(), "remainder\n")
+        f.close()
+        self.assertEqual(len(chunks), (len(packed)+4)//5)
+        parsed = numpy.concatenate(chunks)
+        self.assertEqual(parsed.shape, (len(packed), 2))
+        self.assert_((parsed[:,0] == numpy.arange(len(packed))).all())
+        self.assert_(abs(parsed[:,1] - packed).max() < 1e-14)
+
+    def test_load_molecule_charmm_cache(self):
+        dirname = tempfile.mkdtemp("tamkin-test-charmm")
+        try:
+            fn_hess = os.path.join(dirname, "ethanol.hess.full")
+            shutil.copy("test/input/an/ethanol.hess.full", fn_hess)
+            reference = load_molecule_charmm("test/input/an/ethanol.cor", fn_hess)
+            for sparse in False, True:
+                molecule = load_molecule_charmm("test/input/an/ethanol.cor", fn_hess, sparse=sparse, cache=True)
+                self.assert_(os.path.isfile(fn_hess + ".bchk"))
+                # second time from the cache, possibly in the other representation
+                for sparse_again in False, True:
+                    molecule = load_molecule_charmm("test/input/an/ethanol.cor", fn_hess, sparse=sparse_again, cache=True)
+                    hessian = molecule.hessian
+                    if sparse_again:
+                        hessian = hessian.toarray()
+                    self.assertEqual(abs(hessian - reference.hessian).max(), 0.0)
+                    self.assertEqual(abs(molecule.gradient - reference.gradient).max(), 0.0)
+                    self.assertEqual(abs(molecule.coordinates - reference.coordinates).max(), 0.0)
+                    self.assertEqual(molecule.energy, reference.energy)
+                os.remove(fn_hess + ".bchk")
+            # the cache is not used when the Hessian file changes
+            load_molecule_charmm("test/input/an/ethanol.cor", fn_hess, cache=True)
+            f = file(fn_hess)
+            lines = f.readlines()
+            f.close()
+            lines[1] = "       -3.1303308955\n"
+            f = file(fn_hess, "w")
+            f.writelines(lines)
+            f.close()
+            stat = os.stat(fn_hess)
+            os.utime(fn_hess, (stat.st_atime, stat.st_mtime + 10))
+            molecule = load_molecule_charmm("test/input/an/ethanol.cor", fn_hess, cache=True)
+            self.assertAlmostEqual(molecule.energy/(1000*calorie/avogadro), -3.1303308955)
+            # a sidecar file at another location
+            fn_cache = os.path.join(dirname, "other.bchk")
+            load_molecule_charmm("test/input/an/ethanol.cor", fn_hess, cache=fn_cache)
+            self.assert_(os.path.isfile(fn_cache))
+        finally:
+            shutil.rmtree(dirname)
+
     def test_load_molecule_cp2k(self):
         molecule = load_molecule_cp2k("test/input/cp2k/pentane/sp.out", "test/input/cp2k/pentane/freq.out")
         self.assertAlmostEqual(molecule.energy, 0.012255059530862)
@@ -208,6 +286,223 @@ class IOTestCase(unittest.TestCase):
         self.assertEqual(nma1.multiplicity, nma2.multiplicity)
         self.assertEqual(nma1.symmetry_number, nma2.symmetry_number)
 
+    def test_checkpoint_binary(self):
+        molecule = load_molecule_cp2k("test/input/cp2k/pentane/sp.out", "test/input/cp2k/pentane/freq.out")
+        nma1 = NMA(molecule)
+        nma1.write_to_file("test/output/test_binary.chk", binary=True)
+        for mmap in False, True:
+            nma2 = NMA.read_from_file("test/output/test_binary.chk", mmap=mmap)
+            self.assertEqual(set(nma1.__dict__), set(nma2.__dict__))
+            for key, value1 in nma1.__dict__.iteritems():
+                value2 = nma2.__dict__[key]
+                if isinstance(value1, numpy.ndarray):
+                    self.assertEqual(value1.dtype, value2.dtype)
+                    self.assertEqual(value1.shape, value2.shape)
+                    self.assert_((value1 == value2).all())
+                    self.assertEqual(isinstance(value2, numpy.memmap), mmap and value1.size > 0)
+                else:
+                    self.assertEqual(value1, value2)
+        # only the relevant fields
+        nma1.write_to_file("test/output/test_binary_partf.chk", fields='partf', binary=True)
+        nma2 = NMA.read_from_file("test/output/test_binary_partf.chk", mmap=True)
+        self.assert_(not hasattr(nma2, "modes"))
+        self.assert_((nma1.freqs == nma2.freqs).all())
+        # all kinds of fields
+        data = {
+            "none": None, "str": "foo bar", "bln": True, "int": -5, "flt": 1.0/3,
+            "fltar": numpy.random.normal(0, 1, (4, 3, 2)),
+            "intar": numpy.arange(10, dtype=numpy.int32)[::2],
+            "blnar": numpy.array([True, False, True]),
+            "strar": numpy.array(["H", "He", "Li"]),
+            "empty": numpy.zeros((0, 3), float),
+            "fortran": numpy.asfortranarray(numpy.random.normal(0, 1, (5, 3))),
+            "list": [1.5, 2.5],
+        }
+        dump_bchk("test/output/test_binary_kinds.chk", data)
+        for loaded in load_bchk("test/output/test_binary_kinds.chk"), load_chk("test/output/test_binary_kinds.chk", mmap=True):
+            self.assertEqual(set(loaded), set(data))
+            for key in "none", "str", "bln", "int", "flt":
+                self.assertEqual(loaded[key], data[key])
+            for key in "fltar", "intar", "blnar", "strar", "empty", "fortran", "list":
+                expected = numpy.array(data[key])
+                self.assertEqual(loaded[key].dtype, expected.dtype)
+                self.assertEqual(loaded[key].shape, expected.shape)
+                self.assert_((loaded[key] == expected).all())
+        self.assertRaises(TypeError, dump_bchk, "test/output/test_binary_error.chk", {"foo": object()})
+        self.assertRaises(IOError, load_bchk, "test/input/an/fixed.07.txt")
+
+    def test_checkpoint_fields(self):
+        data = {
+            "a": numpy.random.normal(0, 1, 7), "b": numpy.zeros(0, float),
+            "c": numpy.array([1e-300, 2.0, -3e200, 4.0, 5.0]),
+            "d": 1.5, "e": "foo", "f": numpy.random.normal(0, 1, (3, 4)),
+            "g": None, "h": numpy.array(["x", "yy", "zzz"]),
+        }
+        dump_chk("test/output/test_fields.chk", data)
+        dump_bchk("test/output/test_fields_binary.chk", data)
+        for filename in "test/output/test_fields.chk", "test/output/test_fields_binary.chk":
+            self.assertEqual(list_chk(filename), sorted(data))
+            loaded = load_chk(filename)
+            self.assertEqual(set(loaded), set(data))
+            for fields in ["a"], ["b", "d"], ["c", "f", "h"], ["f", "g"], ["e", "x"], []:
+                selection = load_chk(filename, fields=fields)
+                self.assertEqual(set(selection), set(fields) & set(data))
+                for key, value in selection.iteritems():
+                    if isinstance(value, numpy.ndarray):
+                        self.assertEqual(value.shape, loaded[key].shape)
+                        self.assert_((value == loaded[key]).all())
+                        if value.dtype.kind == "f" and value.size > 0:
+                            self.assert_(abs(value - data[key]).max() <= 1e-14*abs(data[key]).max())
+                    else:
+                        self.assertEqual(value, loaded[key])
+
+    def test_checkpoint_text_roundtrip(self):
+        numpy.random.seed(2)
+        data = {
+            "a": numpy.random.normal(0, 1, (5, 3)),
+            "b": numpy.array([1e-300, -2e250, 3.0]),
+            "c": numpy.array([True, False, False, True, True]),
+            "d": numpy.array(["H", "He", "Li"]),
+            "e": 0.1,
+        }
+        dump_chk("test/output/test_roundtrip1.chk", data)
+        loaded = load_chk("test/output/test_roundtrip1.chk")
+        self.assert_((loaded["c"] == data["c"]).all())
+        self.assert_((loaded["d"] == data["d"]).all())
+        for key in "a", "b":
+            self.assertEqual(loaded[key].shape, data[key].shape)
+            self.assert_((loaded[key].ravel() == [float("%22.15e" % x) for x in data[key].flat]).all())
+        # a second pass does not change the file
+        dump_chk("test/output/test_roundtrip2.chk", loaded)
+        f1 = file("test/output/test_roundtrip1.chk")
+        f2 = file("test/output/test_roundtrip2.chk")
+        self.assertEqual(f1.read(), f2.read())
+        f1.close()
+        f2.close()
+
+    def test_checkpoint_lazy(self):
+        molecule = load_molecule_g03fchk("test/input/sterck/aa.fchk")
+        nma1 = NMA(molecule)
+        nma1.write_to_file("test/output/test_lazy.chk", binary=True)
+        nma2 = NMA.read_from_file("test/output/test_lazy.chk", fields='partf')
+        self.assert_("modes" not in nma2.__dict__)
+        pf = PartFun(nma2, [ExtTrans(), ExtRot(1)])
+        ta = ThermoAnalysis(pf, [300.0])
+        self.assert_("modes" not in nma2.__dict__)
+        self.assertAlmostEqual(pf.free_energy(300.0), PartFun(nma1, [ExtTrans(), ExtRot(1)]).free_energy(300.0))
+        # load on first access
+        self.assert_((nma2.modes == nma1.modes).all())
+        self.assert_("modes" in nma2.__dict__)
+        self.assertRaises(AttributeError, getattr, nma2, "foo")
+        # a copy of a partially loaded object
+        nma3 = NMA.read_from_file("test/output/test_lazy.chk", fields=["freqs"])
+        nma3.write_to_file("test/output/test_lazy_copy.chk", binary=True)
+        nma4 = NMA.read_from_file("test/output/test_lazy_copy.chk")
+        self.assertEqual(set(nma4.__dict__), set(nma1.__dict__))
+        self.assert_((nma4.coordinates == nma1.coordinates).all())
+        # the same with a text checkpoint
+        nma1.write_to_file("test/output/test_lazy.chk")
+        nma2 = NMA.read_from_file("test/output/test_lazy.chk", fields='partf')
+        self.assert_("modes" not in nma2.__dict__)
+        self.assert_(abs(nma2.freqs - nma1.freqs).max() <= 1e-14*abs(nma1.freqs).max())
+        self.assert_(abs(nma2.modes - nma1.modes).max() <= 1e-14)
+
+    def check_same_molecule(self, mol1, mol2):
+        self.assertEqual(mol1.size, mol2.size)
+        self.assert_((mol1.numbers == mol2.numbers).all())
+        self.assert_((mol1.coordinates == mol2.coordinates).all())
+        self.assert_((mol1.masses == mol2.masses).all())
+        self.assertEqual(mol1.energy, mol2.energy)
+        self.assert_((mol1.gradient == mol2.gradient).all())
+        self.assert_((mol1.hessian == mol2.hessian).all())
+        self.assertEqual(mol1.multiplicity, mol2.multiplicity)
+        self.assertEqual(mol1.symmetry_number, mol2.symmetry_number)
+        self.assertEqual(mol1.periodic, mol2.periodic)
+        self.assertEqual(mol1.title, mol2.title)
+        if mol1.unit_cell is None:
+            self.assertEqual(mol2.unit_cell, None)
+        else:
+            self.assert_((mol1.unit_cell.matrix == mol2.unit_cell.matrix).all())
+            self.assert_((mol1.unit_cell.active == mol2.unit_cell.active).all())
+
+    def test_molecule_cache(self):
+        dirname = tempfile.mkdtemp("tamkin-test-cache")
+        try:
+            cache = MoleculeCache(os.path.join(dirname, "cache"))
+            calls = [
+                (load_molecule_g03fchk, ("test/input/sterck/aa.fchk",), {}),
+                (load_molecule_g03fchk, ("test/input/sterck/aa.fchk",), {"energy": -1.0}),
+                (load_molecule_cp2k, ("test/input/cp2k/pentane/sp.out", "test/input/cp2k/pentane/freq.out"), {}),
+                (load_molecule_qchem, ("test/input/qchem/h2o2.hf.sto-3g.freq.out",), {"hessfile": "test/input/qchem/hessian.dat"}),
+            ]
+            for i, (loader, args, kwargs) in enumerate(calls):
+                reference = loader(*args, **kwargs)
+                molecule = cache.load(loader, *args, **kwargs)
+                self.check_same_molecule(molecule, reference)
+                self.assertEqual((cache.hits, cache.misses), (i, i+1))
+                molecule = cache.load(loader, *args, **kwargs)
+                self.check_same_molecule(molecule, reference)
+                self.assertEqual((cache.hits, cache.misses), (i+1, i+1))
+            # a hit and a miss give equivalent, writable arrays
+            cache_other = MoleculeCache(os.path.join(dirname, "other"))
+            miss = cache_other.load(load_molecule_g03fchk, "test/input/sterck/aa.fchk")
+            hit = cache_other.load(load_molecule_g03fchk, "test/input/sterck/aa.fchk")
+            self.assertEqual((cache_other.hits, cache_other.misses), (1, 1))
+            self.check_same_molecule(hit, miss)
+            for molecule in miss, hit:
+                for name in "coordinates", "numbers", "masses", "gradient", "hessian":
+                    self.assert_(getattr(molecule, name).flags.writeable)
+            hit.hessian[0,0] += 1.0
+            # memory-mapped arrays are read-only
+            cache_mmap = MoleculeCache(os.path.join(dirname, "other"), mmap=True)
+            hit = cache_mmap.load(load_molecule_g03fchk, "test/input/sterck/aa.fchk")
+            self.assertEqual(cache_mmap.hits, 1)
+            self.check_same_molecule(hit, miss)
+            self.assert_(not hit.hessian.flags.writeable)
+            del hit
+            # equivalent arguments give the same key
+            self.assertEqual(
+                cache.get_key(load_molecule_g03fchk, ("test/input/sterck/aa.fchk",), {}),
+                cache.get_key(load_molecule_g03fchk, (), {"fn_freq": "test/input/sterck/aa.fchk", "energy": None}),
+            )
+            # a modified input file is loaded again
+            fn = os.path.join(dirname, "aa.fchk")
+            shutil.copy("test/input/sterck/aa.fchk", fn)
+            cache.load(load_molecule_g03fchk, fn)
+            stat = os.stat(fn)
+            os.utime(fn, (stat.st_atime, stat.st_mtime + 10))
+            cache.load(load_molecule_g03fchk, fn)
+            self.assertEqual((cache.hits, cache.misses), (4, 6))
+            # ... unless only the contents are taken into account
+            cache_hash = MoleculeCache(os.path.join(dirname, "cache"), hash_contents=True)
+            cache_hash.load(load_molecule_g03fchk, fn)
+            os.utime(fn, (stat.st_atime, stat.st_mtime + 20))
+            cache_hash.load(load_molecule_g03fchk, fn)
+            self.assertEqual((cache_hash.hits, cache_hash.misses), (1, 1))
+            # least recently used entries are removed
+            num_entries = len(cache._get_entries())
+            self.assertEqual(num_entries, 7)
+            cache.max_size = cache.size - 1
+            cache.evict()
+            self.assertEqual(cache.evictions, 1)
+            self.assertEqual(len(cache._get_entries()), num_entries - 1)
+            cache.clear()
+            self.assertEqual(cache.size, 0)
+            # the loaders use the active cache
+            self.assertEqual(get_molecule_cache(), None)
+            set_molecule_cache(cache)
+            try:
+                mol1 = load_molecule_g03fchk("test/input/sterck/aa.fchk")
+                mol2 = load_molecule_g03fchk(fn_freq="test/input/sterck/aa.fchk")
+                mol3 = cache.load(load_molecule_g03fchk, "test/input/sterck/aa.fchk")
+            finally:
+                set_molecule_cache(None)
+            self.check_same_molecule(mol1, mol2)
+            self.check_same_molecule(mol1, mol3)
+            self.assertEqual((cache.hits, cache.misses), (6, 7))
+        finally:
+            shutil.rmtree(dirname)
+
     def test_load_indices(self):
         blocks = load_indices("test/input/an/fixed.07.txt", groups=True)
         self.assertEqual(blocks, [[3,2,6]])
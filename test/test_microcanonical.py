@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# TAMkin is a post-processing toolkit for normal mode analysis, thermochemistry
+# and reaction kinetics.
+# Copyright (C) 2008-2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, An Ghysels
+# <An.Ghysels@UGent.be> and Matthias Vandichel <Matthias.Vandichel@UGent.be>
+# Center for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all
+# rights reserved unless otherwise stated.
+#
+# This file is part of TAMkin.
+#
+# TAMkin is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# In addition to the regulations of the GNU General Public License,
+# publications and communications based in parts on this program or on
+# parts of this program are required to cite the following article:
+#
+# "TAMkin: A Versatile Package for Vibrational Analysis and Chemical Kinetics",
+# An Ghysels, Toon Verstraelen, Karen Hemelsoet, Michel Waroquier and Veronique
+# Van Speybroeck, Journal of Chemical Information and Modeling, 2010, 50,
+# 1736-1750W
+# http://dx.doi.org/10.1021/ci100099g
+#
+# TAMkin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+
+
+
+from tamkin import *
+
+from molmod.units import centimeter
+from molmod.constants import lightspeed, planck
+
+import unittest, numpy
+
+
+__all__ = ["MicrocanonicalTestCase"]
+
+
+class MicrocanonicalTestCase(unittest.TestCase):
+    def test_beyer_swinehart(self):
+        grain = 10*planck*lightspeed/centimeter
+        counts = numpy.zeros(20)
+        counts[0] = 1
+        freq = 30*lightspeed/centimeter
+        counts1 = beyer_swinehart(counts, [freq], grain)
+        self.assertEqual(list(counts1), [1,0,0]*6 + [1,0])
+        # two identical oscillators: n+1 states at energy n quanta
+        counts2 = beyer_swinehart(counts, [freq, freq], grain)
+        self.assertEqual(list(counts2[::3]), range(1, 8))
+        # energy levels of an oscillator give the same result
+        levels = numpy.arange(10)*freq*planck + 5.0
+        counts3 = stein_rabinovitch(counts1, levels, grain)
+        self.assertEqual(list(counts3), list(counts2))
+
+    def check_laplace(self, pf, temps, fft=False):
+        grain = 1*planck*lightspeed/centimeter
+        energy_max = 30000*planck*lightspeed/centimeter
+        dos = DensityOfStates(pf, grain, energy_max, fft)
+        self.assertEqual(len(dos.counts), len(dos.energies))
+        self.assert_((dos.sums[1:] >= dos.sums[:-1] - 1e-8).all())
+        for temp in temps:
+            expected = sum(term.log(temp) for term in pf.terms if not isinstance(term, ExtTrans))
+            self.assertAlmostEqual(dos.log(temp), expected, 2)
+        return dos
+
+    def test_laplace_ethane(self):
+        molecule = load_molecule_g03fchk("test/input/ethane/gaussian.fchk")
+        pf = PartFun(NMA(molecule), [ExtTrans(), ExtRot(), Vibrations(freq_scaling=0.9, zp_scaling=0.95)])
+        dos1 = self.check_laplace(pf, [300.0, 600.0])
+        dos2 = self.check_laplace(pf, [300.0, 600.0], fft=True)
+        self.assertAlmostEqual(abs(dos1.sums - dos2.sums).max()/dos1.sums[-1], 0.0, 8)
+
+    def test_laplace_rotor(self):
+        molecule = load_molecule_g03fchk("test/input/ethane/gaussian.fchk")
+        rotscan = load_rotscan_g03log("test/input/rotor/gaussian.log")
+        rotor = Rotor(rotscan, molecule, rotsym=3, even=True)
+        pf = PartFun(NMA(molecule), [ExtTrans(), ExtRot(), rotor])
+        self.check_laplace(pf, [300.0, 600.0], fft=True)
@@ -37,7 +37,7 @@
 from tamkin import *
 
 from molmod.constants import lightspeed, boltzmann
-from molmod.units import centimeter, atm, amu, meter, mol, kcalmol
+from molmod.units import centimeter, atm, amu, meter, mol, kcalmol, angstrom
 
 import unittest, numpy
 
@@ -441,6 +441,27 @@ class NMATestCase(unittest.TestCase):
         ])
         self.check_freqs(expected_freqs, nma, 1)
 
+    def test_constrain_ext_projector(self):
+        for molecule in [
+            load_molecule_g03fchk("test/input/sterck/aa.fchk"),
+            load_molecule_cp2k("test/input/cp2k/pentane/sp.out", "test/input/cp2k/pentane/freq.out", is_periodic=False),
+            load_molecule_cpmd("test/input/cpmd/damp.out", "test/input/cpmd/GEOMETRY.xyz", "test/input/cpmd/MOLVIB", is_periodic=True),
+        ]:
+            nma1 = NMA(molecule, ConstrainExt(gradient_threshold=1e-2))
+            nma2 = NMA(molecule, ConstrainExt(gradient_threshold=1e-2, projector=True))
+            num_zeros = 3 if molecule.periodic else 6
+            self.assertEqual(len(nma2.freqs), len(nma1.freqs) + num_zeros)
+            self.assertEqual(len(nma2.zeros), num_zeros)
+            self.assert_(abs(nma2.freqs[nma2.zeros]).max() < 1e-6*abs(nma2.freqs).max())
+            nonzero = numpy.array([i for i in xrange(len(nma2.freqs)) if i not in nma2.zeros])
+            self.assert_(abs(nma2.freqs[nonzero] - nma1.freqs).max() < 1e-6*abs(nma1.freqs).max())
+            self.check_ortho(nma2.modes)
+            # the non-zero modes are the same, up to a sign
+            overlaps = abs(numpy.dot(nma1.modes.transpose(), nma2.modes[:,nonzero]).diagonal())
+            self.assert_(abs(overlaps - 1).max() < 1e-6)
+            nma3 = NMA(molecule, ConstrainExt(gradient_threshold=1e-2, projector=True), do_modes=False)
+            self.assertEqual(set(nma3.zeros), set(nma2.zeros))
+
     def test_gas_water_cpmd(self):
         molecule = load_molecule_cpmd("test/input/cpmd/damp.out", "test/input/cpmd/GEOMETRY.xyz", "test/input/cpmd/MOLVIB", is_periodic=True)
         nma = NMA(molecule, Full(), do_modes=False)
@@ -519,6 +540,67 @@ class NMATestCase(unittest.TestCase):
                         2864.80440032, 3680.49886454 ] )
         self.check_freqs(expected_freqs, nma, 4, check_zeros=True)
 
+    def test_vsa_solvers(self):
+        coordinates = numpy.loadtxt("test/input/charmm/crambin.crd", skiprows=6, usecols=(4,5,6))*angstrom
+        molecule = create_enm_molecule(coordinates[:200], rcut=6*angstrom)
+        molecule_sparse = create_enm_molecule(coordinates[:200], rcut=6*angstrom, sparse=True)
+        subs = range(20, 60)
+        for cls in VSA, VSANoMass:
+            nma = NMA(molecule, cls(subs))
+            for mol, solver in (molecule, 'cg'), (molecule_sparse, 'direct'), (molecule_sparse, 'cg'):
+                nma_other = NMA(mol, cls(subs, solver=solver))
+                self.assertEqual(set(nma_other.zeros), set(nma.zeros))
+                # the zero frequencies are numerical noise
+                self.assert_(abs(nma_other.freqs[6:] - nma.freqs[6:]).max() < 1e-8*abs(nma.freqs).max())
+        # an environment that is not positive definite is solved with LDL^T
+        molecule = load_molecule_g03fchk("test/input/sterck/paats.fchk")
+        subs = range(5)
+        nma = NMA(molecule, VSA(subs))
+        hessian_ee = molecule.hessian[15:,15:]
+        hessian_es = molecule.hessian[15:,:15]
+        hessian_small = molecule.hessian[:15,:15] - numpy.dot(hessian_es.transpose(), numpy.linalg.solve(hessian_ee, hessian_es))
+        treatment = VSA(subs)
+        treatment(molecule, False)
+        self.assert_(abs(treatment.hessian_small - hessian_small).max() < 1e-8)
+        self.assertRaises(ValueError, VSA, subs, solver='foo')
+
+    def test_isotopologues(self):
+        molecule = load_molecule_charmm("test/input/an/ethanol.cor","test/input/an/ethanol.hess.full")
+        masses_list = [molecule.masses]
+        for at in (molecule.numbers == 1).nonzero()[0][:3]:
+            masses = molecule.masses.copy()
+            masses[at] *= 2
+            masses_list.append(masses)
+        masses = molecule.masses.copy()
+        masses[molecule.numbers == 6] *= 13.0/12.0
+        masses_list.append(masses)
+        treatments = [
+            lambda: Full(),
+            lambda: ConstrainExt(gradient_threshold=1e-3),
+            lambda: PHVA([0,1,2]),
+            lambda: VSA([1,2,3,4]),
+            lambda: VSANoMass([1,2,3,4]),
+            lambda: MBH([[3,2,6],[6,7,8]]),
+            lambda: Constrain([[1,2], [0,4]]),
+        ]
+        for treatment in treatments:
+            for do_modes in True, False:
+                nmas = NMA.isotopologues(molecule, masses_list, treatment(), do_modes)
+                self.assertEqual(len(nmas), len(masses_list))
+                for nma, masses in zip(nmas, masses_list):
+                    reference = NMA(molecule.copy_with(masses=masses), treatment(), do_modes)
+                    self.assert_(abs(nma.masses - masses).max() == 0.0)
+                    self.assertEqual(set(nma.zeros), set(reference.zeros))
+                    nonzero = [i for i in xrange(len(nma.freqs)) if i not in nma.zeros]
+                    self.assert_(abs(nma.freqs[nonzero] - reference.freqs[nonzero]).max() < 1e-10)
+                    if do_modes:
+                        # compare the modes up to a sign
+                        for i in nonzero:
+                            error = min(abs(nma.modes[:,i] - reference.modes[:,i]).max(), abs(nma.modes[:,i] + reference.modes[:,i]).max())
+                            self.assert_(error < 1e-6)
+                    else:
+                        self.assertEqual(nma.modes, None)
+
     def test_mbh(self):
         molecule = load_molecule_charmm("test/input/an/ethanol.cor","test/input/an/ethanol.hess.full")
         blocks = load_indices("test/input/an/fixed.07.txt", groups=True)
@@ -527,6 +609,30 @@ class NMATestCase(unittest.TestCase):
         dump_modes_molden("test/output/ethanol.mbh.molden.log", nma)
         self.check_ortho(nma.modes)   # write_molden should not have changed this
 
+    def test_mbh_block_transform(self):
+        molecule = load_molecule_charmm("test/input/an/ethanol.cor","test/input/an/ethanol.hess.full")
+        blocks = [[3,2,6],[0,1]]
+        treatment = MBH(blocks, do_gradient_correction=False)
+        treatment(molecule, True)
+        self.assert_(isinstance(treatment.transform, BlockTransform))
+        # construct U explicitly: nonlinear block, linear block, free atoms
+        D = transrot_basis(molecule.coordinates)
+        U = numpy.zeros((27, 6+5+3*4), float)
+        for at in blocks[0]:
+            U[3*at:3*at+3,:6] = D[:,3*at:3*at+3].transpose()
+        alphas = [alpha for alpha in xrange(6) if alpha != Blocks(blocks, molecule, 1e-5).skip_axis_lin[0]]
+        for at in blocks[1]:
+            U[3*at:3*at+3,6:11] = D[alphas,3*at:3*at+3].transpose()
+        for i, at in enumerate([4,5,7,8]):
+            U[3*at:3*at+3,11+3*i:14+3*i] = numpy.identity(3)
+        self.assert_(abs(treatment.transform.matrix - U).max() < 1e-10)
+        modes = numpy.random.normal(0, 1, (23, 4))
+        self.assert_(abs(treatment.transform(modes) - numpy.dot(U, modes)).max() < 1e-10)
+        hessian_small = numpy.dot(U.transpose(), numpy.dot(molecule.hessian, U))
+        self.assert_(abs(treatment.hessian_small - hessian_small).max() < 1e-10)
+        mass_small = numpy.dot(U.transpose(), U*molecule.masses3.reshape((-1,1)))
+        self.assert_(abs(treatment.mass_matrix_small.mass_block - mass_small).max() < 1e-6)
+
     def test_mbh_ethane(self):
         molecule = load_molecule_g03fchk("test/input/ethane/gaussian.fchk")
         blocks = [[1, 0, 2, 6, 7], [1, 0, 3, 4, 5 ]]
@@ -535,6 +641,48 @@ class NMATestCase(unittest.TestCase):
         non_zero = [i for i in xrange(7) if i not in nma.zeros][0]
         self.assertAlmostEqual(nma.freqs[non_zero]/lightspeed*centimeter, 314, 0)
 
+    def test_mbh_linked_nullspace(self):
+        coordinates = numpy.loadtxt("test/input/charmm/crambin.crd", skiprows=6, usecols=(4,5,6))*angstrom
+        molecule = create_enm_molecule(coordinates, rcut=6*angstrom, sparse=True)
+        blocks = [
+            [at for at in block if at < molecule.size] for block
+            in create_blocks_peptide_charmm("test/input/charmm/crambin.crd", "dihedral")
+        ]
+        treatment = MBH([list(block) for block in blocks], do_gradient_correction=False)
+        treatment(molecule, True)
+        nullspace = treatment.transform.right
+        self.assert_(hasattr(nullspace, "tocsr"))
+        nullspace = nullspace.toarray()
+        # every column of the null space must move the copies of a shared atom
+        # in the different blocks identically
+        blkinfo = Blocks([list(block) for block in blocks], molecule, 1e-5)
+        D = transrot_basis(molecule.coordinates)
+        displacements = {}
+        for b, block in enumerate(blkinfo.blocks):
+            if b < blkinfo.nb_nlin:
+                offset = 6*b
+                alphas = range(6)
+            else:
+                offset = 6*blkinfo.nb_nlin + 5*(b-blkinfo.nb_nlin)
+                alphas = [alpha for alpha in xrange(6) if alpha != blkinfo.skip_axis_lin[b-blkinfo.nb_nlin]]
+            params = nullspace[offset:offset+len(alphas)]
+            for at in block:
+                displacements.setdefault(at, []).append(numpy.dot(D[alphas,3*at:3*at+3].transpose(), params))
+        for at, copies in displacements.iteritems():
+            for copy in copies[1:]:
+                self.assert_(abs(copy - copies[0]).max() < 1e-8)
+        # the null space must be complete: compare with the size of the
+        # null space of the dense linking constraints
+        self.assertEqual(numpy.linalg.matrix_rank(nullspace), nullspace.shape[1])
+        self.assertEqual(nullspace.shape[1], 99)
+        # Rayleigh-Ritz: the MBH frequencies are upper bounds for the full ones
+        nma = NMA(molecule, do_modes=False)
+        nma_mbh = NMA(molecule, MBH([list(block) for block in blocks]))
+        self.check_ortho(nma_mbh.modes)
+        self.assertEqual(nma_mbh.modes.shape[0], 3*molecule.size)
+        for i in xrange(6, len(nma_mbh.freqs)):
+            self.assert_(nma_mbh.freqs[i] > nma.freqs[i]*(1-1e-6))
+
     def test_mbhconstrainext(self):
         # load the plain Hessian
         molecule = load_molecule_g03fchk("test/input/sterck/aa.fchk")
@@ -625,6 +773,185 @@ class NMATestCase(unittest.TestCase):
         self.assertEqual(nma.modes.shape[1],16)
         dump_modes_molden("test/output/ethanol.constr.molden.2.log", nma)
 
+    def test_constrain_derivatives(self):
+        from tamkin.nma import _constraint_derivatives
+        from molmod.ic import bond_length, bend_angle, dihed_angle
+        coordinates = numpy.random.normal(0, 2, (10,3))
+        constraints = [[0,1],[2,3,4],[5,6,7,8],[1,9],[3,4,5,6],[9,8,7]]
+        functions = {2: bond_length, 3: bend_angle, 4: dihed_angle}
+        count = 0
+        for indexes, atoms, grad, hess in _constraint_derivatives(coordinates, constraints):
+            for i, index in enumerate(indexes):
+                self.assertEqual(list(atoms[i]), constraints[index])
+                value, d, dd = functions[len(atoms[i])](coordinates[atoms[i]], deriv=2)
+                self.assert_(abs(grad[i] - d.ravel()).max() < 1e-10)
+                self.assert_(abs(hess[i] - dd.reshape(hess[i].shape)).max() < 1e-10)
+                count += 1
+        self.assertEqual(count, len(constraints))
+
+    def test_constrain_gradient_correction(self):
+        from molmod.ic import bond_length, bend_angle, dihed_angle
+        molecule = load_molecule_charmm("test/input/an/ethanol.cor","test/input/an/ethanol.hess.full")
+        gradient = numpy.random.normal(0, 0.01, molecule.coordinates.shape)
+        molecule = Molecule(molecule.numbers, molecule.coordinates, molecule.masses, 0.0, gradient, molecule.hessian)
+        constraints = [[1,2],[0,4],[0,1,2],[3,0,1,2],[5,6,7],[4,5,6,8]]
+        treatment = Constrain(constraints)
+        treatment(molecule, True)
+        nullspace = treatment.transform.matrix
+        # Follow the constrained surface along a few directions y and compare
+        # the second derivative of a quadratic energy with the corrected
+        # Hessian. A point on the surface is x0 + nullspace.y + B0^T.z, where
+        # z is solved with Newton's method.
+        functions = {2: bond_length, 3: bend_angle, 4: dihed_angle}
+        x0 = molecule.coordinates.ravel()
+        def compute_ic(x, deriv):
+            x = x.reshape((-1,3))
+            values = numpy.zeros(len(constraints))
+            bmat = numpy.zeros((len(constraints), len(x0)))
+            for k, atoms in enumerate(constraints):
+                result = functions[len(atoms)](x[atoms], deriv=deriv)
+                values[k] = result[0]
+                if deriv > 0:
+                    for i, at in enumerate(atoms):
+                        bmat[k,3*at:3*at+3] += result[1][i]
+            return values, bmat
+        q0, bmat0 = compute_ic(x0, 1)
+        def surface(y):
+            x = x0 + numpy.dot(nullspace, y)
+            z = numpy.zeros(len(constraints))
+            for i in xrange(100):
+                q, bmat = compute_ic(x + numpy.dot(bmat0.transpose(), z), 1)
+                if abs(q - q0).max() < 1e-13:
+                    break
+                z -= numpy.linalg.solve(numpy.dot(bmat, bmat0.transpose()), q - q0)
+            return x + numpy.dot(bmat0.transpose(), z)
+        def energy(x):
+            delta = x - x0
+            return numpy.dot(gradient.ravel(), delta) + 0.5*numpy.dot(delta, numpy.dot(molecule.hessian, delta))
+        eps = 1e-3
+        for i in xrange(3):
+            y = numpy.random.normal(0, 1, nullspace.shape[1])
+            y /= numpy.linalg.norm(y)
+            num = (energy(surface(eps*y)) + energy(surface(-eps*y)) - 2*energy(x0))/eps**2
+            ana = numpy.dot(y, numpy.dot(treatment.hessian_small, y))
+            self.assertAlmostEqual(num, ana, 5)
+
+    def test_sparse_hessian(self):
+        molecule = load_molecule_charmm("test/input/an/ethanol.cor","test/input/an/ethanol.hess.full")
+        molecule_sparse = load_molecule_charmm("test/input/an/ethanol.cor","test/input/an/ethanol.hess.full", sparse=True)
+        self.assert_(abs(molecule_sparse.hessian.toarray() - molecule.hessian).max() < 1e-10)
+        # the index lists are loaded for each treatment because PHVA_MBH
+        # renumbers the atoms in the blocks.
+        blocks = lambda: load_indices("test/input/an/fixed.07.txt", groups=True)
+        fixed = lambda: load_indices("test/input/an/fixed.06.txt")
+        subs = lambda: load_indices("test/input/an/fixed.03.txt")
+        treatments = [
+            lambda: Full(),
+            lambda: ConstrainExt(gradient_threshold=1e-3),
+            lambda: ConstrainExt(gradient_threshold=1e-3, projector=True),
+            lambda: PHVA(fixed()),
+            lambda: VSA(subs()),
+            lambda: VSANoMass(subs()),
+            lambda: MBH(blocks()),
+            lambda: MBH([[3,2,6],[6,7,8]]),
+            lambda: PHVA_MBH(fixed(), blocks()),
+            lambda: Constrain([[1,2], [0,4]]),
+        ]
+        for treatment in treatments:
+            nma = NMA(molecule, treatment())
+            nma_sparse = NMA(molecule_sparse, treatment())
+            self.assert_(abs(nma_sparse.freqs - nma.freqs).max() < 1e-6)
+            self.assertEqual(len(nma_sparse.zeros), len(nma.zeros))
+            self.assertEqual(nma_sparse.modes.shape, nma.modes.shape)
+
+    def test_num_modes(self):
+        coordinates = numpy.loadtxt("test/input/charmm/crambin.crd", skiprows=6, usecols=(4,5,6))*angstrom
+        molecule = create_enm_molecule(coordinates, rcut=6*angstrom)
+        molecule_sparse = create_enm_molecule(coordinates, rcut=6*angstrom, sparse=True)
+        nma = NMA(molecule, do_modes=False)
+        sqrt_masses3 = molecule.masses3**0.5
+        hessian_mw = molecule.hessian/sqrt_masses3/sqrt_masses3.reshape((-1,1))
+        for mol in molecule, molecule_sparse:
+            nma_sub = NMA(mol, num_modes=20)
+            self.assertEqual(nma_sub.freqs.shape, (20,))
+            self.assertEqual(nma_sub.modes.shape, (3*molecule.size, 20))
+            self.check_ortho(nma_sub.modes)
+            self.assertEqual(len(nma_sub.zeros), 6)
+            self.assertEqual(set(nma_sub.zeros), set(range(6)))
+            # compare the non-zero frequencies with the full NMA and check
+            # that the modes are eigenvectors of the mass-weighted Hessian
+            for i in xrange(6, 20):
+                self.assertAlmostEqual(nma_sub.freqs[i]/nma.freqs[i], 1.0, 6)
+                mode = nma_sub.modes[:,i]
+                residual = numpy.dot(hessian_mw, mode) - (2*numpy.pi*nma_sub.freqs[i])**2*mode
+                self.assert_(abs(residual).max() < 1e-10)
+            nma_sub = NMA(mol, do_modes=False, num_modes=20)
+            self.assertEqual(nma_sub.modes, None)
+            self.assertEqual(len(nma_sub.zeros), 6)
+            for i in xrange(6, 20):
+                self.assertAlmostEqual(nma_sub.freqs[i]/nma.freqs[i], 1.0, 6)
+
+        # a subset with a treatment that produces a mass matrix and a transform
+        molecule = load_molecule_charmm("test/input/an/ethanol.cor","test/input/an/ethanol.hess.full", sparse=True)
+        blocks = load_indices("test/input/an/fixed.07.txt", groups=True)
+        nma = NMA(molecule, MBH(blocks), do_modes=False)
+        nma_sub = NMA(molecule, MBH(blocks), num_modes=10)
+        self.assertEqual(nma_sub.modes.shape, (27, 10))
+        self.check_ortho(nma_sub.modes)
+        for i in xrange(6, 10):
+            self.assertAlmostEqual(nma_sub.freqs[i]/nma.freqs[i], 1.0, 6)
+
+    def test_freq_window(self):
+        coordinates = numpy.loadtxt("test/input/charmm/crambin.crd", skiprows=6, usecols=(4,5,6))*angstrom
+        molecule = create_enm_molecule(coordinates, rcut=6*angstrom)
+        molecule_sparse = create_enm_molecule(coordinates, rcut=6*angstrom, sparse=True)
+        nma = NMA(molecule, do_modes=False)
+        # a window between two frequencies
+        low = 0.5*(nma.freqs[20] + nma.freqs[21])
+        high = 0.5*(nma.freqs[50] + nma.freqs[51])
+        sqrt_masses3 = molecule.masses3**0.5
+        hessian_mw = molecule.hessian/sqrt_masses3/sqrt_masses3.reshape((-1,1))
+        for mol in molecule, molecule_sparse:
+            nma_sub = NMA(mol, freq_window=(low, high))
+            self.assertEqual(len(nma_sub.freqs), 30)
+            self.assertEqual(nma_sub.modes.shape, (3*molecule.size, 30))
+            self.assertEqual(len(nma_sub.zeros), 0)
+            self.check_ortho(nma_sub.modes)
+            for i in xrange(30):
+                self.assertAlmostEqual(nma_sub.freqs[i]/nma.freqs[i+21], 1.0, 6)
+                mode = nma_sub.modes[:,i]
+                residual = numpy.dot(hessian_mw, mode) - (2*numpy.pi*nma_sub.freqs[i])**2*mode
+                self.assert_(abs(residual).max() < 1e-10)
+            nma_sub = NMA(mol, do_modes=False, freq_window=(low, high))
+            self.assertEqual(len(nma_sub.freqs), 30)
+            # a window that includes the zero frequencies
+            nma_sub = NMA(mol, freq_window=(-numpy.inf, high))
+            self.assertEqual(len(nma_sub.freqs), 51)
+            self.assertEqual(set(nma_sub.zeros), set(range(6)))
+            for i in xrange(6, 51):
+                self.assertAlmostEqual(nma_sub.freqs[i]/nma.freqs[i], 1.0, 6)
+
+        # a window with the C-H and O-H stretches of ethanol
+        molecule = load_molecule_charmm("test/input/an/ethanol.cor","test/input/an/ethanol.hess.full")
+        nma = NMA(molecule, do_modes=False)
+        nma_sub = NMA(molecule, freq_window=(2500*lightspeed/centimeter, numpy.inf))
+        expected = nma.freqs[nma.freqs > 2500*lightspeed/centimeter]
+        self.assertEqual(len(nma_sub.freqs), 6)
+        self.assertEqual(len(nma_sub.zeros), 0)
+        for i in xrange(6):
+            self.assertAlmostEqual(nma_sub.freqs[i]/expected[i], 1.0, 6)
+        # the window (0, high] does not include the zero frequencies
+        high = 0.5*(nma.freqs[20] + nma.freqs[21])
+        nma_sub = NMA(molecule, freq_window=(0.0, high))
+        self.assertEqual(len(nma_sub.zeros), 0)
+        self.assert_((nma_sub.freqs > 0).all())
+        self.assert_(len(nma_sub.freqs) >= 15)
+        for i in xrange(15):
+            self.assertAlmostEqual(nma_sub.freqs[-15+i]/nma.freqs[6+i], 1.0, 6)
+
+        self.assertRaises(ValueError, NMA, molecule, freq_window=(1.0, 0.0))
+        self.assertRaises(ValueError, NMA, molecule, num_modes=5, freq_window=(0.0, 1.0))
+
     def test_sandra(self):
         cases = [
             ("test/input/sandra/F_freq.fchk", []),
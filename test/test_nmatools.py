@@ -146,3 +146,26 @@ class NMAToolsTestCase(unittest.TestCase):
 
         mol = create_enm_molecule(molecule.coordinates, selected, masses=numpy.ones(molecule.size)*2.0, rcut=5)
         nma = NMA(mol)
+
+    def test_create_enm_molecule_sparse(self):
+        molecule = load_molecule_charmm("test/input/an/ethanol.cor", "test/input/an/ethanol.hess.full")
+        mol = create_enm_molecule(molecule, rcut=5)
+        mol_sparse = create_enm_molecule(molecule, rcut=5, sparse=True)
+        self.assert_(abs(mol_sparse.hessian.toarray() - mol.hessian).max() < 1e-10)
+        # compare with a straightforward construction of the ENM Hessian
+        N = molecule.size
+        hessian = numpy.zeros((3*N,3*N),float)
+        for i in xrange(N):
+            for j in xrange(i+1,N):
+                x = (molecule.coordinates[i] - molecule.coordinates[j]).reshape((3,1))
+                dist2 = (x**2).sum()
+                if dist2 < 5**2:
+                    corr = numpy.dot(x, x.transpose())/dist2
+                    hessian[3*i:3*(i+1), 3*i:3*(i+1)] += corr
+                    hessian[3*i:3*(i+1), 3*j:3*(j+1)] -= corr
+                    hessian[3*j:3*(j+1), 3*i:3*(i+1)] -= corr
+                    hessian[3*j:3*(j+1), 3*j:3*(j+1)] += corr
+        self.assert_(abs(mol.hessian - hessian).max() < 1e-10)
+        nma = NMA(mol)
+        nma_sparse = NMA(mol_sparse)
+        self.assert_(abs(nma_sparse.freqs - nma.freqs).max() < 1e-10)
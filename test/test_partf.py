@@ -544,3 +544,197 @@ class PartFunTestCase(unittest.TestCase):
         pf = PartFun(nma, [ExtTrans(), ExtRot(), Vibrations(freq_threshold=1e-3)])
         assert len(pf.vibrational.zero_freqs) == 12
         assert (pf.vibrational.positive_freqs > 1e-3).all()
+
+    def test_temperature_arrays(self):
+        molecule = load_molecule_g03fchk("test/input/ethane/gaussian.fchk")
+        nma = NMA(molecule)
+        rotscan = load_rotscan_g03log("test/input/rotor/gaussian.log")
+        rotor = Rotor(rotscan, molecule, rotsym=3, even=True)
+        temps = numpy.array([50.0, 300.0, 1000.0, 2500.0])
+        for classical in True, False:
+            pf = PartFun(nma, [
+                ExtTrans(), ExtRot(), rotor, Vibrations(classical, 0.9, 0.8),
+                PCMCorrection((-5*kjmol, 300)),
+            ])
+            for stat_fys in [pf] + pf.terms:
+                for name in ["log", "logt", "logtt", "logn", "logv",
+                             "internal_heat", "heat_capacity", "entropy",
+                             "free_energy", "chemical_potential"]:
+                    values = getattr(stat_fys, name)(temps)
+                    self.assertEqual(values.shape, temps.shape)
+                    for i in xrange(len(temps)):
+                        value = getattr(stat_fys, name)(temps[i])
+                        self.assert_(numpy.isscalar(value))
+                        self.assertAlmostEqual(values[i], value, delta=abs(value)*1e-10)
+                    if isinstance(stat_fys, StatFysTerms):
+                        values = getattr(stat_fys, "%s_terms" % name)(temps)
+                        self.assertEqual(values.shape, (stat_fys.num_terms, len(temps)))
+                        for i in xrange(len(temps)):
+                            value = getattr(stat_fys, "%s_terms" % name)(temps[i])
+                            self.assertEqual(value.shape, (stat_fys.num_terms,))
+                            for j in xrange(stat_fys.num_terms):
+                                self.assertAlmostEqual(values[j,i], value[j], delta=abs(value[j])*1e-10)
+            # zero temperature is handled per element
+            temps0 = numpy.array([0.0, 300.0])
+            for name in "free_energy", "chemical_potential":
+                values = getattr(pf, name)(temps0)
+                self.assertAlmostEqual(values[0], getattr(pf, name)(0.0))
+                self.assertAlmostEqual(values[1], getattr(pf, name)(300.0))
+            self.assertRaises(NotImplementedError, pf.logt, temps0)
+
+    def test_evaluate(self):
+        molecule = load_molecule_g03fchk("test/input/ethane/gaussian.fchk")
+        nma = NMA(molecule)
+        rotscan = load_rotscan_g03log("test/input/rotor/gaussian.log")
+        rotor = Rotor(rotscan, molecule, rotsym=3, even=True)
+        temps = numpy.array([50.0, 300.0, 1000.0])
+        for classical in True, False:
+            pf = PartFun(nma, [
+                ExtTrans(), ExtRot(), rotor, Vibrations(classical, 0.9, 0.8),
+                PCMCorrection((-5*kjmol, 300)),
+            ])
+            for stat_fys in [pf] + pf.terms:
+                results = stat_fys.evaluate(temps)
+                self.assertEqual(len(results), 10)
+                for name, values in results.iteritems():
+                    expected = getattr(stat_fys, name)(temps)
+                    for i in xrange(len(temps)):
+                        self.assertAlmostEqual(values[i], expected[i], delta=abs(expected[i])*1e-10+1e-14)
+                if isinstance(stat_fys, StatFysTerms):
+                    results = stat_fys.evaluate_terms(temps, ["entropy", "logtt"])
+                    self.assertEqual(sorted(results), ["entropy", "logtt"])
+                    for name, values in results.iteritems():
+                        expected = getattr(stat_fys, "%s_terms" % name)(temps)
+                        self.assertEqual(values.shape, expected.shape)
+                        for value, expected_value in zip(values.ravel(), expected.ravel()):
+                            self.assertAlmostEqual(value, expected_value, delta=abs(expected_value)*1e-10+1e-14)
+            # scalar temperatures give scalar results
+            results = pf.evaluate(300.0, ["free_energy"])
+            self.assert_(numpy.isscalar(results["free_energy"]))
+            self.assertAlmostEqual(results["free_energy"], pf.free_energy(300.0), delta=abs(pf.free_energy(300.0))*1e-10)
+            # contributions
+            keys, results = pf.evaluate_contributions(temps, ["log", "heat_capacity"])
+            self.assertEqual(keys[0], "total")
+            self.assertEqual(results["log"].shape, (len(keys), len(temps)))
+            for i in xrange(len(temps)):
+                self.assertAlmostEqual(results["log"][0,i], pf.log(temps[i]), delta=abs(pf.log(temps[i]))*1e-10)
+            self.assertRaises(ValueError, pf.evaluate, temps, ["foo"])
+            self.assertRaises(ValueError, pf.evaluate, numpy.array([0.0, 300.0]))
+
+    def test_cache(self):
+        molecule = load_molecule_g03fchk("test/input/ethane/gaussian.fchk")
+        nma = NMA(molecule)
+        pf = PartFun(nma, [ExtTrans(), ExtRot()], cache_size=4)
+        ref = PartFun(nma, [ExtTrans(), ExtRot()])
+        self.assertAlmostEqual(pf.free_energy(300), ref.free_energy(300))
+        self.assertEqual(pf.cache_misses, 1)
+        self.assertAlmostEqual(pf.free_energy(300.0), ref.free_energy(300))
+        self.assertEqual(pf.cache_hits, 1)
+        self.assertEqual(pf.cache_misses, 1)
+        # arrays of temperatures are cached too
+        temps = numpy.array([300.0, 400.0])
+        values = pf.free_energy(temps)
+        values[:] = 0.0
+        self.assertAlmostEqual(pf.free_energy(temps)[1], ref.free_energy(400))
+        self.assertEqual(pf.cache_hits, 2)
+        # changes in the frequencies, energy or pressure clear the cache
+        km = ThermodynamicModel([pf], [])
+        km.backup_freqs()
+        km.alter_freqs(1e-5, 0.5)
+        ref.vibrational.positive_freqs = pf.vibrational.positive_freqs.copy()
+        ref.electronic.energy = pf.electronic.energy
+        self.assertAlmostEqual(pf.free_energy(300), ref.free_energy(300))
+        km.restore_freqs()
+        ref.vibrational.positive_freqs = pf.vibrational.positive_freqs.copy()
+        ref.electronic.energy = pf.electronic.energy
+        self.assertAlmostEqual(pf.free_energy(300), ref.free_energy(300))
+        pf.vibrational.positive_freqs[0] *= 1.1
+        ref.vibrational.positive_freqs[0] *= 1.1
+        self.assertAlmostEqual(pf.free_energy(300), ref.free_energy(300))
+        pf.electronic.energy += 0.01
+        ref.electronic.energy += 0.01
+        self.assertAlmostEqual(pf.free_energy(300), ref.free_energy(300))
+        pf.translational.pressure *= 2
+        ref.translational.pressure *= 2
+        self.assertAlmostEqual(pf.free_energy(300), ref.free_energy(300))
+        self.assertEqual(pf.cache_hits, 2)
+        # least recently used results are dropped
+        for temp in 100, 200, 300, 400, 500:
+            pf.helper(temp, 1)
+        self.assertEqual(len(pf._cache), 4)
+        misses = pf.cache_misses
+        pf.helper(500, 1)
+        pf.helper(100, 1)
+        self.assertEqual(pf.cache_misses, misses + 1)
+
+    def test_bank(self):
+        ethane = load_molecule_g03fchk("test/input/ethane/gaussian.fchk")
+        linear = load_molecule_g03fchk("test/input/linear/gaussian.fchk")
+        aa = load_molecule_g03fchk("test/input/sterck/aa.fchk")
+        rotscan = load_rotscan_g03log("test/input/rotor/gaussian.log")
+        pfs = [
+            PartFun(NMA(ethane), [ExtTrans(), ExtRot()]),
+            PartFun(NMA(ethane), [ExtTrans(cp=False), ExtRot(), Vibrations(classical=True)]),
+            PartFun(NMA(linear), [ExtTrans(pressure=2*atm), ExtRot(), Vibrations(freq_scaling=0.9, zp_scaling=0.8)]),
+            PartFun(NMA(aa), [ExtTrans(), ExtRot(1)]),
+            PartFun(NMA(aa), [Electronic(2)]),
+            PartFun(NMA(ethane), [ExtTrans(), ExtRot(), Rotor(rotscan, ethane, rotsym=3, even=True)]),
+        ]
+        bank = PartFunBank(pfs)
+        self.assertEqual(bank.num_pfs, len(pfs))
+        self.assertEqual(len(bank.others), 1)
+        temps = numpy.array([100.0, 300.0, 1000.0])
+        results = bank.evaluate(temps)
+        self.assertEqual(len(results), 10)
+        for pf, values in bank.unpack(results):
+            self.assert_(pf is pfs[bank.index(pf)])
+            for name, value in values.iteritems():
+                expected = getattr(pf, name)(temps)
+                self.assertEqual(value.shape, temps.shape)
+                for i in xrange(len(temps)):
+                    # the electronic energy cancels out in the entropy and the
+                    # heat capacity, which amplifies the round-off errors.
+                    self.assertAlmostEqual(value[i], expected[i], delta=abs(expected[i])*1e-8)
+        # single quantities and scalar temperatures
+        free_energies = bank.free_energy(300.0)
+        self.assertEqual(free_energies.shape, (len(pfs),))
+        for i, pf in enumerate(pfs):
+            self.assertAlmostEqual(free_energies[i], pf.free_energy(300.0), delta=abs(free_energies[i])*1e-10)
+        self.assertRaises(ValueError, bank.index, PartFun(NMA(aa)))
+
+    def test_surrogate(self):
+        molecule = load_molecule_g03fchk("test/input/ethane/gaussian.fchk")
+        nma = NMA(molecule)
+        rotscan = load_rotscan_g03log("test/input/rotor/gaussian.log")
+        rotor = Rotor(rotscan, molecule, rotsym=3, even=True)
+        for cp in True, False:
+            pf = PartFun(nma, [ExtTrans(cp), ExtRot(), rotor])
+            sur = Surrogate(pf, 200, 2000, tolerance=1e-7)
+            self.assert_(sur.num_pieces >= 1)
+            self.assertEqual(sur.title, pf.title)
+            temps = numpy.linspace(200, 2000, 157)
+            error = abs(sur.log(temps) - pf.log(temps)).max()
+            self.assert_(error < 1e-7)
+            error = abs(temps*(sur.logt(temps) - pf.logt(temps))).max()
+            self.assert_(error < 1e-7)
+            error = abs(sur.entropy(temps) - pf.entropy(temps)).max()/boltzmann
+            self.assert_(error < 1e-7)
+            error = abs(sur.heat_capacity(temps) - pf.heat_capacity(temps)).max()/boltzmann
+            self.assert_(error < 1e-7)
+            error = abs(sur.chemical_potential(temps) - pf.chemical_potential(temps))/(boltzmann*temps)
+            self.assert_(error.max() < 1e-7)
+            error = abs(sur.logv(temps) - pf.logv(temps)).max()
+            self.assert_(error < 1e-7)
+            self.assertAlmostEqual(sur.zero_point_energy(), pf.zero_point_energy())
+            self.assert_(numpy.isscalar(sur.free_energy(300.0)))
+            self.assertRaises(ValueError, sur.free_energy, 100.0)
+        # models
+        pf_react = PartFun(nma, [ExtTrans(), ExtRot()])
+        pf_trans = PartFun(nma, [ExtTrans(), ExtRot(), rotor])
+        km = KineticModel([pf_react, pf_react], pf_trans)
+        km_sur = surrogate_model(km, 300, 1000, 1e-8)
+        self.assertEqual(len(km_sur.pfs_list), 2)
+        self.assert_(km.pfs_list[0] is pf_react)
+        temps = numpy.array([300.0, 456.7, 1000.0])
+        for temp in temps:
+            self.assertAlmostEqual(km_sur.rate_constant(temp, True), km.rate_constant(temp, True), 6)
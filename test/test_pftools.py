@@ -36,8 +36,8 @@
 
 from tamkin import *
 
-from molmod.units import kjmol, atm, meter, mol, second
-from molmod.constants import boltzmann
+from molmod.units import kjmol, atm, meter, mol, second, centimeter, amu
+from molmod.constants import boltzmann, lightspeed
 
 import unittest
 import numpy
@@ -108,3 +108,160 @@ class PFToolsTestCase(unittest.TestCase):
         pf = PartFun(NMA(load_molecule_g03fchk("test/input/mat5T/react.fchk")), [ExtTrans(), ExtRot(1)])
         ta = ThermoAnalysis(pf, [200,300,400,500,600,700,800,900])
         ta.write_to_file("test/output/thermo_mat2.csv")
+
+    def test_thermo_analysis_evaluate(self):
+        molecule = load_molecule_g03fchk("test/input/ethane/gaussian.fchk")
+        rotscan = load_rotscan_g03log("test/input/rotor/gaussian.log")
+        rotor = Rotor(rotscan, molecule, rotsym=3, even=True)
+        pf = PartFun(NMA(molecule), [ExtTrans(), ExtRot(), rotor])
+        temps = [200,300,400,500,600,700,800,900]
+        ta = ThermoAnalysis(pf, temps)
+        for table in ta.tables:
+            # compare with a table computed with the individual methods
+            check = ThermoTable(table.label, table.unit, table.unit_name,
+                                table.method_name, pf, temps)
+            self.assertEqual(table.keys, check.keys)
+            self.assertEqual(table.data.shape, check.data.shape)
+            for row, check_row in zip(table.data, check.data):
+                for value, check_value in zip(row, check_row):
+                    self.assertAlmostEqual(value, check_value, delta=abs(check_value)*1e-10+1e-14)
+
+    def test_reaction_analysis_temperature_arrays(self):
+        pf_react1 = PartFun(NMA(load_molecule_g03fchk("test/input/sterck/aa.fchk")), [ExtTrans(cp=False), ExtRot(1)])
+        pf_react2 = PartFun(NMA(load_molecule_g03fchk("test/input/sterck/aarad.fchk")), [ExtTrans(cp=False), ExtRot(1)])
+        pf_ts = PartFun(NMA(load_molecule_g03fchk("test/input/sterck/paats.fchk")), [ExtTrans(cp=False), ExtRot(1)])
+        km = KineticModel([pf_react1, pf_react2], pf_ts, tunneling=Wigner(pf_ts))
+        ra = ReactionAnalysis(km, 300, 600, temp_step=1)
+        self.assertEqual(ra.ln_rate_consts.shape, ra.temps.shape)
+        for temp, ln_rate_const in zip(ra.temps[::37], ra.ln_rate_consts[::37]):
+            self.assertAlmostEqual(ln_rate_const, km.rate_constant(temp, do_log=True), 10)
+        temps = numpy.array([[300.0, 400.0], [500.0, 600.0]])
+        for method in km.rate_constant, km.equilibrium_constant, km.free_energy_change:
+            values = method(temps)
+            self.assertEqual(values.shape, temps.shape)
+            for index, temp in numpy.ndenumerate(temps):
+                check = method(temp)
+                self.assertAlmostEqual(values[index], check, delta=abs(check)*1e-12)
+        self.assert_(isinstance(km.rate_constant(300.0), float))
+        self.assertAlmostEqual(km.rate_constant([300.0])[0], km.rate_constant(300.0))
+
+    def test_monte_carlo_batched(self):
+        pf_react1 = PartFun(NMA(load_molecule_g03fchk("test/input/sterck/aa.fchk")), [ExtTrans(cp=False), ExtRot(1)])
+        pf_react2 = PartFun(NMA(load_molecule_g03fchk("test/input/sterck/aarad.fchk")), [ExtTrans(cp=False), ExtRot(1)])
+        pf_ts = PartFun(NMA(load_molecule_g03fchk("test/input/sterck/paats.fchk")), [ExtTrans(cp=False), ExtRot(1)])
+        km = KineticModel([pf_react1, pf_react2], pf_ts)
+        ra = ReactionAnalysis(km, 280, 360)
+        freqs = [pf.vibrational.positive_freqs.copy() for pf in km.pfs_list]
+        energies = [pf.electronic.energy for pf in km.pfs_list]
+
+        # Only an error on the energy: the samples are known exactly.
+        numpy.random.seed(1)
+        ra.monte_carlo(0.0, 0.01, 100, batched=True)
+        numpy.random.seed(1)
+        scale_energies = 1.0 + numpy.random.normal(0.0, 1.0, 100)*0.01
+        delta_E = km.energy_difference()
+        for sample, scale_energy in zip(ra.monte_carlo_samples, scale_energies):
+            self.assertAlmostEqual(sample[0], ra.parameters[0], 6)
+            self.assertAlmostEqual(sample[1], ra.Ea + delta_E*(scale_energy - 1), 10)
+
+        # The kinetic model is not changed.
+        for pf, pf_freqs, energy in zip(km.pfs_list, freqs, energies):
+            self.assert_(pf.vibrational.positive_freqs is not pf_freqs)
+            self.assertEqual(abs(pf.vibrational.positive_freqs - pf_freqs).max(), 0.0)
+            self.assertEqual(pf.electronic.energy, energy)
+            self.assert_(not hasattr(pf.vibrational, "positive_freqs_orig"))
+
+        # Compare the distribution with the serial implementation. (Medians
+        # are used because the distributions have heavy tails due to the low
+        # frequencies.)
+        numpy.random.seed(2)
+        ra.monte_carlo(num_iter=400, batched=True)
+        samples = ra.monte_carlo_samples
+        ra.monte_carlo(num_iter=400)
+        for i in xrange(2):
+            spread = numpy.median(abs(samples[:,i] - numpy.median(samples[:,i])))
+            check_spread = numpy.median(abs(ra.monte_carlo_samples[:,i] - numpy.median(ra.monte_carlo_samples[:,i])))
+            self.assertAlmostEqual(numpy.median(samples[:,i]), numpy.median(ra.monte_carlo_samples[:,i]), delta=0.3*spread)
+            self.assertAlmostEqual(spread/check_spread, 1.0, delta=0.2)
+
+    def test_monte_carlo_executor(self):
+        from multiprocessing import Pool
+        pf_react1 = PartFun(NMA(load_molecule_g03fchk("test/input/sterck/aa.fchk")), [ExtTrans(cp=False), ExtRot(1)])
+        pf_react2 = PartFun(NMA(load_molecule_g03fchk("test/input/sterck/aarad.fchk")), [ExtTrans(cp=False), ExtRot(1)])
+        pf_ts = PartFun(NMA(load_molecule_g03fchk("test/input/sterck/paats.fchk")), [ExtTrans(cp=False), ExtRot(1)])
+        ra1 = ReactionAnalysis(KineticModel([pf_react1, pf_react2], pf_ts), 280, 360)
+        ra2 = ReactionAnalysis(KineticModel([pf_react1, pf_react2], pf_ts, tunneling=Wigner(pf_ts)), 300, 400)
+
+        # serial reference, independent of the global random state
+        ra1.monte_carlo(num_iter=250, energy_error=0.01, seed=5, block_size=100)
+        samples = ra1.monte_carlo_samples
+        covariance = ra1.covariance
+        self.assertEqual(samples.shape, (250, 2))
+        numpy.random.seed(3)
+        ra1.monte_carlo(num_iter=250, energy_error=0.01, seed=5, block_size=100)
+        self.assertEqual(abs(ra1.monte_carlo_samples - samples).max(), 0.0)
+        # bit-identical results with any number of workers
+        for num_workers in 1, 3:
+            pool = Pool(num_workers)
+            try:
+                ra1.monte_carlo(num_iter=250, energy_error=0.01, executor=pool, seed=5, block_size=100)
+                self.assertEqual(abs(ra1.monte_carlo_samples - samples).max(), 0.0)
+                self.assertEqual(abs(ra1.covariance - covariance).max(), 0.0)
+                monte_carlo_reactions([ra1, ra2], num_iter=150, executor=pool, seed=7, block_size=40)
+                if num_workers == 1:
+                    reference = [ra1.monte_carlo_samples, ra2.monte_carlo_samples]
+                else:
+                    self.assertEqual(abs(ra1.monte_carlo_samples - reference[0]).max(), 0.0)
+                    self.assertEqual(abs(ra2.monte_carlo_samples - reference[1]).max(), 0.0)
+            finally:
+                pool.close()
+                pool.join()
+        self.assertEqual(ra2.monte_carlo_samples.shape, (150, 2))
+        self.assertEqual(ra2.monte_carlo_iter, 150)
+        # the reactions get different random streams
+        self.assert_(abs(ra1.monte_carlo_samples - ra2.monte_carlo_samples).min() > 0.0)
+        # invalid arguments
+        self.assertRaises(ValueError, ra1.monte_carlo, freq_error=1.0)
+        self.assertRaises(ValueError, ra1.monte_carlo, energy_error=-0.1)
+        self.assertRaises(ValueError, ra1.monte_carlo, energy_error=1.5)
+        self.assertRaises(ValueError, monte_carlo_reactions, [ra1], energy_error=1.5)
+        self.assertRaises(ValueError, ra1.monte_carlo, num_iter=0)
+
+    def test_kinetic_isotope_effects(self):
+        reactants = [
+            load_molecule_g03fchk("test/input/sterck/aa.fchk"),
+            load_molecule_g03fchk("test/input/sterck/aarad.fchk"),
+        ]
+        transition_state = load_molecule_g03fchk("test/input/sterck/paats.fchk")
+        make_pf = lambda nma: PartFun(nma, [ExtTrans(cp=False), ExtRot(1)])
+        temps = numpy.array([300.0, 400.0, 500.0])
+        # substitute the hydrogens of the first reactant by deuterium, and
+        # one hydrogen in the first reactant and the transition state.
+        deuterium = 2.014101778*amu
+        all_h = dict((at, deuterium) for at in (reactants[0].numbers == 1).nonzero()[0])
+        all_h_ts = dict((at, deuterium) for at in (transition_state.numbers == 1).nonzero()[0][:len(all_h)])
+        substitutions = [[all_h, {}, all_h_ts], [{3: deuterium}, {}, {3: deuterium}]]
+        for treatment in None, ConstrainExt(gradient_threshold=1e-2):
+            kies = kinetic_isotope_effects(reactants, transition_state, substitutions, temps, make_pf, treatment)
+            self.assertEqual(kies.shape, (2, 3))
+            for kie, pattern in zip(kies, substitutions):
+                # reference computed with separate NMAs
+                rate_consts = []
+                for changes in [{}, {}, {}], pattern:
+                    pfs = []
+                    for molecule, change in zip(reactants + [transition_state], changes):
+                        masses = molecule.masses.copy()
+                        for at, mass in change.iteritems():
+                            masses[at] = mass
+                        if treatment is None:
+                            nma = NMA(molecule.copy_with(masses=masses))
+                        else:
+                            nma = NMA(molecule.copy_with(masses=masses), ConstrainExt(gradient_threshold=1e-2))
+                        pfs.append(make_pf(nma))
+                    rate_consts.append(KineticModel(pfs[:-1], pfs[-1]).rate_constant(temps))
+                self.assert_(abs(kie/(rate_consts[0]/rate_consts[1]) - 1).max() < 1e-8)
+        # a single dictionary is applied to all molecules, with tunneling
+        kies = kinetic_isotope_effects(reactants[:1], transition_state, [{3: deuterium}], 300.0, make_pf, tunneling=Wigner)
+        self.assertEqual(kies.shape, (1,))
+        self.assertRaises(ValueError, kinetic_isotope_effects, reactants, transition_state, [[{}]], temps, make_pf)
+
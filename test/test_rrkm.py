@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# TAMkin is a post-processing toolkit for normal mode analysis, thermochemistry
+# and reaction kinetics.
+# Copyright (C) 2008-2012 Toon Verstraelen <Toon.Verstraelen@UGent.be>, An Ghysels
+# <An.Ghysels@UGent.be> and Matthias Vandichel <Matthias.Vandichel@UGent.be>
+# Center for Molecular Modeling (CMM), Ghent University, Ghent, Belgium; all
+# rights reserved unless otherwise stated.
+#
+# This file is part of TAMkin.
+#
+# TAMkin is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# In addition to the regulations of the GNU General Public License,
+# publications and communications based in parts on this program or on
+# parts of this program are required to cite the following article:
+#
+# "TAMkin: A Versatile Package for Vibrational Analysis and Chemical Kinetics",
+# An Ghysels, Toon Verstraelen, Karen Hemelsoet, Michel Waroquier and Veronique
+# Van Speybroeck, Journal of Chemical Information and Modeling, 2010, 50,
+# 1736-1750W
+# http://dx.doi.org/10.1021/ci100099g
+#
+# TAMkin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+#
+#--
+
+
+from tamkin import *
+
+from molmod.units import kelvin, bar, amu, angstrom, centimeter
+from molmod.constants import boltzmann, lightspeed, planck
+
+import unittest
+import numpy
+
+
+__all__ = ["RRKMTestCase"]
+
+
+class RRKMTestCase(unittest.TestCase):
+    def load_mat(self):
+        # The lowest frequencies are not reliable and are left out, because they
+        # would require a very fine energy grid.
+        wavenumber = planck*lightspeed/centimeter
+        def load_pf(fn_fchk):
+            molecule = load_molecule_g03fchk(fn_fchk)
+            return PartFun(NMA(molecule, ConstrainExt(gradient_threshold=1e-3)), [
+                ExtTrans(), ExtRot(1), Vibrations(freq_threshold=10*lightspeed/centimeter)
+            ])
+        pf_react = load_pf("test/input/mat5T/react.fchk")
+        pf_ts = load_pf("test/input/mat5T/ts.fchk")
+        km = KineticModel([pf_react], pf_ts)
+        rrkm = RRKM(km, 5*wavenumber, 100000*wavenumber)
+        me = MasterEquation(rrkm, 39.95*amu, 3.5*angstrom, 100*kelvin*boltzmann, 200*wavenumber, cutoff=5.0)
+        self.pf_react = pf_react
+        self.pf_ts = pf_ts
+        return km, rrkm, me
+
+    def test_canonical(self):
+        km, rrkm, me = self.load_mat()
+        for temp in 800, 1200:
+            # The rounding of the frequencies to an integer number of grains
+            # causes a nearly temperature-independent error.
+            self.assertAlmostEqual(
+                numpy.log(rrkm.canonical_rate_constant(temp)),
+                numpy.log(km.rate_constant(temp)), delta=0.5
+            )
+        temps = numpy.array([800.0, 1200.0])
+        rate_consts = rrkm.canonical_rate_constant(temps)
+        self.assertEqual(rate_consts.shape, (2,))
+        self.assertAlmostEqual(rate_consts[1], rrkm.canonical_rate_constant(1200.0))
+        self.assertEqual(rrkm.rate_constants[:int(rrkm.barrier/rrkm.grain)-1].max(), 0.0)
+        self.assertRaises(ValueError, RRKM, KineticModel([self.pf_react, self.pf_react], self.pf_ts), rrkm.grain, 1e-3)
+
+    def test_falloff(self):
+        km, rrkm, me = self.load_mat()
+        temps = numpy.array([800.0, 1000.0, 1200.0])
+        pressures = 10**numpy.arange(-4, 2.1, 1.0)*bar
+        rate_consts = me.falloff(temps, pressures)
+        self.assertEqual(rate_consts.shape, (3, len(pressures)))
+        # monotonous in pressure and temperature
+        self.assert_((rate_consts[:,1:] > rate_consts[:,:-1]).all())
+        self.assert_((rate_consts[1:] > rate_consts[:-1]).all())
+        # high-pressure limit
+        kinfs = rrkm.canonical_rate_constant(temps)
+        for i in xrange(3):
+            self.assertAlmostEqual(rate_consts[i,-1]/kinfs[i], 1.0, 1)
+            self.assert_(rate_consts[i,-1] < kinfs[i]*(1+1e-6))
+        # low-pressure limit: k/[M] increases towards k0 at (very) low pressures
+        k0s = me.low_pressure_limit(temps)
+        self.assertEqual(k0s.shape, (3,))
+        low_pressures = 10**numpy.arange(-50, -9.9, 10.0)*bar
+        low = me.rate_constants(1000.0, low_pressures)*boltzmann*1000.0/low_pressures
+        self.assert_((low[1:] < low[:-1]).all())
+        self.assertAlmostEqual(low[0]/k0s[1], 1.0, 5)
+        self.assert_((rate_consts*boltzmann*temps.reshape(-1,1)/pressures < k0s.reshape(-1,1)).all())
+        # one pressure at a time gives the same result
+        self.assertAlmostEqual(me.rate_constants(1000.0, pressures[3])/rate_consts[1,3], 1.0, 8)
+        # no silent results when the inverse iteration does not converge
+        self.assertRaises(ValueError, me.rate_constants, 1000.0, pressures[3], max_iter=1)
+        self.assertRaises(ValueError, me.low_pressure_limit, temps, max_iter=1)
+
+        plog = PLOG(temps, pressures, rate_consts)
+        for i, temp in enumerate(temps):
+            for j, pressure in enumerate(pressures):
+                self.assertAlmostEqual(numpy.log(plog(temp, pressure)/rate_consts[i,j]), 0.0, 1)
+
+        troe = Troe(temps, pressures, rate_consts, k0s, kinfs)
+        for i, temp in enumerate(temps):
+            for j, pressure in enumerate(pressures):
+                # The Troe expression is only a rough model for the broad
+                # fall-off curves of large molecules.
+                self.assertAlmostEqual(numpy.log(troe(temp, pressure)/rate_consts[i,j]), 0.0, delta=0.6)